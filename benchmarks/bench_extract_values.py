@@ -0,0 +1,91 @@
+"""
+Benchmark of point extraction from rasters with utils.extract_values_from_rasters.
+
+Compares the vectorized extraction (method="nearest") with selecting points one by one
+via rioxarray (previous implementation, measured on a subset of points and extrapolated).
+
+Usage:
+    python bench_extract_values.py [--npoints 100000] [--nrasters 50] [--nloop 1000]
+"""
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import rasterio
+import rioxarray as rxr
+from rasterio.transform import from_origin
+
+from geodata_harvester import utils
+
+
+def make_rasters(outpath, nrasters, width=2000, height=2000, res=0.001):
+    """
+    Write single-band test rasters with random values
+    """
+    rng = np.random.default_rng(0)
+    transform = from_origin(149.0, -29.0, res, res)
+    profile = dict(driver="GTiff", width=width, height=height, count=1, dtype="float32",
+                   crs="EPSG:4326", transform=transform, tiled=True)
+    fnames = []
+    for i in range(nrasters):
+        fname = os.path.join(outpath, f"raster_{i}.tif")
+        with rasterio.open(fname, "w", **profile) as dst:
+            dst.write(rng.random((height, width), dtype="float32"), 1)
+        fnames.append(fname)
+    bounds = (149.0, -29.0 - height * res, 149.0 + width * res, -29.0)
+    return fnames, bounds
+
+
+def extract_loop(coords, raster_files):
+    """
+    Previous implementation: select each point separately
+    """
+    values = []
+    for raster_file in raster_files:
+        ds = rxr.open_rasterio(raster_file)
+        values.append([ds.sel(x=lng, y=lat, method="nearest").values.flatten().tolist() for lng, lat in coords])
+        ds.close()
+    return np.hstack(values)
+
+
+def main(npoints, nrasters, nloop):
+    outpath = tempfile.mkdtemp(prefix="bench_extract_")
+    try:
+        fnames, bounds = make_rasters(outpath, nrasters)
+        rng = np.random.default_rng(1)
+        coords = np.column_stack([
+            rng.uniform(bounds[0], bounds[2], npoints),
+            rng.uniform(bounds[1], bounds[3], npoints),
+        ])
+        print(f"{npoints} points, {nrasters} rasters")
+
+        t0 = time.perf_counter()
+        gdf = utils.extract_values_from_rasters(coords, fnames)
+        t_vec = time.perf_counter() - t0
+        print(f"vectorized: {t_vec:.2f} s")
+
+        # Point-by-point selection on subset of points
+        nloop = min(nloop, npoints)
+        t0 = time.perf_counter()
+        values_loop = extract_loop(coords[:nloop], fnames)
+        t_loop = (time.perf_counter() - t0) * npoints / nloop
+        print(f"point-by-point (extrapolated from {nloop} points): {t_loop:.2f} s")
+        print(f"speedup: {t_loop / t_vec:.0f}x")
+
+        # Check that both methods return the same values
+        values_vec = gdf.iloc[:nloop, 2:2 + nrasters].values
+        assert np.array_equal(values_vec, values_loop)
+    finally:
+        shutil.rmtree(outpath, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--npoints", type=int, default=100000)
+    parser.add_argument("--nrasters", type=int, default=50)
+    parser.add_argument("--nloop", type=int, default=1000)
+    args = parser.parse_args()
+    main(args.npoints, args.nrasters, args.nloop)
@@ -0,0 +1,118 @@
+"""
+Benchmark of raster reprojection with utils.reproj_raster.
+
+For each input/output pair (crs and resolution), compares the windowed, multithreaded
+warping of all bands in one call (utils.reproj_raster) with warping one band at a time
+in a single thread (previous implementation). Results of both methods are compared for
+nearest neighbour resampling; bilinear and average resampling are timed for the new method.
+
+Usage:
+    python bench_reproject.py [--nbands 100] [--size 2000] [--threads ALL_CPUS]
+"""
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.warp import calculate_default_transform, reproject, transform_bounds, Resampling
+
+from geodata_harvester import utils, geotiff
+
+# Input/output pairs: (name, crs of input, crs of output, resolution of output relative to input)
+PAIRS = [
+    ("EPSG:4326 -> EPSG:4326, 2x coarser", "EPSG:4326", "EPSG:4326", 2.0),
+    ("EPSG:4326 -> EPSG:4326, 2x finer", "EPSG:4326", "EPSG:4326", 0.5),
+    ("EPSG:4326 -> EPSG:3577 (Albers)", "EPSG:4326", "EPSG:3577", 1.0),
+    ("EPSG:3577 -> EPSG:4326", "EPSG:3577", "EPSG:4326", 1.0),
+]
+
+
+def make_raster(fname, crs, nbands, size):
+    """
+    Write multi-band test raster with random values over the same region in given crs
+    """
+    bounds = transform_bounds("EPSG:4326", crs, 149.0, -31.0, 151.0, -29.0)
+    res = (bounds[2] - bounds[0]) / size
+    profile = dict(driver="GTiff", width=size, height=size, count=nbands, dtype="float32", nodata=-9999,
+                   crs=crs, transform=from_origin(bounds[0], bounds[3], res, res), tiled=True)
+    rng = np.random.default_rng(0)
+    with rasterio.open(fname, "w", **profile) as dst:
+        for band in range(1, nbands + 1):
+            dst.write(rng.random((size, size), dtype="float32"), band)
+    return bounds, res
+
+
+def reproj_loop(infile, outfile, bbox_out, resolution_out, crs_out, nodata=-9999):
+    """
+    Previous implementation of utils.reproj_raster: warp one band at a time
+    (output written with the same GeoTIFF layout as the new implementation)
+    """
+    with rasterio.open(infile) as src:
+        width_out = int((bbox_out[2] - bbox_out[0]) / resolution_out)
+        height_out = int((bbox_out[3] - bbox_out[1]) / resolution_out)
+        dst_transform, dst_width, dst_height = calculate_default_transform(
+            src.crs, crs_out, width_out, height_out, *bbox_out
+        )
+        dst_kwargs = src.meta.copy()
+        dst_kwargs.update(crs=crs_out, transform=dst_transform, width=dst_width, height=dst_height, nodata=nodata)
+        with geotiff.open_raster(outfile, **dst_kwargs) as dst:
+            for i in range(1, src.count + 1):
+                reproject(
+                    source=rasterio.band(src, i),
+                    destination=rasterio.band(dst, i),
+                    src_transform=src.transform,
+                    src_crs=src.crs,
+                    dst_transform=dst_transform,
+                    dst_crs=crs_out,
+                    resampling=Resampling.nearest,
+                )
+
+
+def main(nbands, size, threads):
+    outpath = tempfile.mkdtemp(prefix="bench_reproject_")
+    try:
+        for name, crs_in, crs_out, scale in PAIRS:
+            infile = os.path.join(outpath, "input.tif")
+            bounds, res = make_raster(infile, crs_in, nbands, size)
+            # bbox and resolution of output are given in units of the input crs (see utils.reproj_raster)
+            bbox_out = bounds
+            resolution_out = res * scale
+            print(f"{name}: {nbands} bands, {size} x {size} pixels")
+
+            t0 = time.perf_counter()
+            reproj_loop(infile, os.path.join(outpath, "loop.tif"), bbox_out, resolution_out, crs_out)
+            t_loop = time.perf_counter() - t0
+            print(f"  band by band, single thread: {t_loop:.2f} s")
+
+            for resampling in ["nearest", "bilinear", "average"]:
+                outfile = os.path.join(outpath, f"{resampling}.tif")
+                t0 = time.perf_counter()
+                utils.reproj_raster(
+                    infile, outfile, bbox_out, resolution_out, crs_out=crs_out, nodata=-9999,
+                    resampling=resampling, num_threads=threads,
+                )
+                t_new = time.perf_counter() - t0
+                print(f"  all bands, windowed, {resampling}: {t_new:.2f} s (speedup {t_loop / t_new:.1f}x)")
+
+            # Check that nearest neighbour results are the same
+            with rasterio.open(os.path.join(outpath, "loop.tif")) as a, \
+                    rasterio.open(os.path.join(outpath, "nearest.tif")) as b:
+                assert a.transform == b.transform and a.shape == b.shape
+                same = np.mean(a.read() == b.read())
+            print(f"  identical pixels (nearest): {100 * same:.3f} %")
+    finally:
+        shutil.rmtree(outpath, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nbands", type=int, default=100)
+    parser.add_argument("--size", type=int, default=2000)
+    parser.add_argument("--threads", default="ALL_CPUS")
+    args = parser.parse_args()
+    threads = args.threads if args.threads == "ALL_CPUS" else int(args.threads)
+    main(args.nbands, args.size, threads)
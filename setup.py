@@ -44,6 +44,7 @@ if __name__ == "__main__":
                             'schema',
                             'requests==2.28.1'
                             ],
+          extras_require={'zarr': ['zarr']},
           python_requires='>=3.8',
           packages=packages,
           package_dir={'': 'src'},
@@ -0,0 +1,396 @@
+"""
+Persistent download cache shared across runs and output folders.
+
+Downloaded files are stored in a cache directory under a key that is computed from the
+request parameters (source, layer, identifier, bbox, resolution, crs, date, ...),
+independent of the output path and file name of a run. If a request is found in the cache,
+the cached file is copied into the output folder instead of downloading it again. Output
+files are independent copies, so that outputs can be modified in place (e.g. by
+geotiff.rewrite) without changing the cache.
+
+The cache is disabled by default and can be enabled with, e.g.:
+
+    from geodata_harvester import cache
+    cache.configure(cache_dir="~/.cache/geodata_harvester/downloads", max_size_gb=20)
+
+Files are written atomically (temporary file + rename) and the least recently used files are
+removed when the total size of the cache exceeds max_size_gb. Each cached file has a sidecar
+.json file with the request parameters.
+
+For raster requests, a spatial index (R-tree) over the bounding boxes and resolutions of
+cached rasters allows to find a cached raster of the same layer that covers a requested
+bounding box at the same or finer resolution (see find_superset), so that subsets of
+previously downloaded regions can be cropped locally.
+
+This package is part of the Data Harvester project developed for the Agricultural Research Federation (AgReFed).
+
+Copyright 2023 Sydney Informatics Hub (SIH), The University of Sydney
+
+This open-source software is released under the LGPL-3.0 License.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from shapely import STRtree, box
+
+# Cache directory (None: cache disabled) and maximum size of cache in GB
+_config = {"cache_dir": None, "max_size_gb": 10}
+_lock = threading.Lock()
+# One lock per key so that concurrent requests for the same file wait for the first download
+_key_locks = {}
+# Spatial index of cached rasters, rebuilt when the content of the cache directory changes
+_index = {"mtime": None, "layers": {}}
+# Parameters that define the grid of a raster request, all other parameters define the layer
+_GRID_PARAMS = ["bbox", "width", "height", "resx", "resy"]
+
+
+def configure(cache_dir=None, max_size_gb=None):
+    """
+    Configure the download cache.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        cache directory. Set to False to disable the cache.
+    max_size_gb : float, optional
+        maximum total size of cached files in GB (Default: 10)
+    """
+    if cache_dir is not None:
+        if cache_dir is False:
+            _config["cache_dir"] = None
+        else:
+            cache_dir = os.path.expanduser(cache_dir)
+            os.makedirs(cache_dir, exist_ok=True)
+            _config["cache_dir"] = cache_dir
+    if max_size_gb is not None:
+        _config["max_size_gb"] = max_size_gb
+
+
+def enabled():
+    """
+    Return True if the download cache is enabled.
+    """
+    return _config["cache_dir"] is not None
+
+
+def cache_key(**params):
+    """
+    Return key for request parameters.
+
+    Parameters
+    ----------
+    **params : request parameters, e.g. source, layer, identifier, bbox, resolution, crs, date.
+        Values must be JSON serialisable (lists, tuples, str, numbers or None).
+
+    Returns
+    -------
+    key : str, sha1 hash of parameters
+    """
+    params = {k: _normalise(v) for k, v in params.items()}
+    text = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def fetch(outfname, download_func, resume=False, **params):
+    """
+    Save file for request to outfname, either from cache or by calling download_func.
+
+    Parameters
+    ----------
+    outfname : str
+        output file name
+    download_func : function
+        function that downloads the file for the request and saves it to the given file name,
+        i.e. download_func(fname)
+    resume : bool
+        if True, download_func resumes interrupted downloads (see fetch_path)
+    **params : request parameters for cache key (see cache_key)
+
+    Returns
+    -------
+    hit : bool, True if file was served from cache
+    """
+    if not enabled():
+        download_func(outfname)
+        return False
+    fname_cache, hit = fetch_path(download_func, os.path.splitext(outfname)[1], resume=resume, **params)
+    _copy(fname_cache, outfname)
+    return hit
+
+
+def fetch_path(download_func, ext="", resume=False, **params):
+    """
+    Return path of cached file for request, download_func is only called if file is not in cache.
+    The cache must be enabled (see configure).
+
+    Parameters
+    ----------
+    download_func : function
+        function that downloads the file for the request and saves it to the given file name,
+        i.e. download_func(fname)
+    ext : str
+        file extension, e.g. ".tif"
+    resume : bool
+        if True, download_func is called with the path of the cached file and must write the data to
+        the stable partial file path + ".part" and rename it once complete (e.g. getdata_silo.download_resumable),
+        so that an interrupted download is resumed by the next request. Partial files are counted
+        and removed by evict like cached files.
+        If False (Default), download_func writes to a temporary file that is removed if the download fails.
+    **params : request parameters for cache key (see cache_key)
+
+    Returns
+    -------
+    fname_cache : str, path of file in cache
+    hit : bool, True if file was already in cache
+    """
+    key = cache_key(**params)
+    fname_cache = os.path.join(_config["cache_dir"], key + ext)
+    with _lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+    with key_lock:
+        if os.path.exists(fname_cache):
+            # Update time of last use for LRU eviction
+            os.utime(fname_cache)
+            return fname_cache, True
+        if resume:
+            # Incomplete data is kept in fname_cache + ".part" (under the key lock) until download_func renames it
+            download_func(fname_cache)
+            _write_metadata(key, params, os.path.basename(fname_cache))
+        else:
+            # Download to temporary file first, so that the cache never contains incomplete files
+            fname_tmp = f"{fname_cache}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                download_func(fname_tmp)
+                _write_metadata(key, params, os.path.basename(fname_cache))
+                os.replace(fname_tmp, fname_cache)
+            finally:
+                for fname in [fname_tmp, fname_tmp + ".part"]:
+                    if os.path.exists(fname):
+                        os.remove(fname)
+    # Keep file that was just added
+    evict(keep=fname_cache)
+    return fname_cache, False
+
+
+def evict(max_size_gb=None, keep=None):
+    """
+    Remove least recently used files until total size of cache is below max_size_gb.
+    Partial files of interrupted downloads (.part) are counted and removed like cached files,
+    except while the download of the same request is in progress.
+
+    Parameters
+    ----------
+    max_size_gb : float, optional
+        maximum size in GB, default as configured
+    keep : str, optional
+        path of file that is not removed
+    """
+    if not enabled():
+        return
+    if max_size_gb is None:
+        max_size_gb = _config["max_size_gb"]
+    max_bytes = max_size_gb * 1024**3
+    with _lock:
+        entries = []
+        for fname in os.listdir(_config["cache_dir"]):
+            if fname.endswith((".json", ".tmp")):
+                continue
+            if fname.endswith(".part") and _in_progress(fname.split(".")[0]):
+                continue
+            path = os.path.join(_config["cache_dir"], fname)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(entry[1] for entry in entries)
+        # Oldest first
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            if path == keep:
+                continue
+            _remove_entry(path)
+            total -= size
+
+
+def contains(**params):
+    """
+    Return True if the cache is enabled and contains a file for the request parameters.
+    """
+    if not enabled():
+        return False
+    key = cache_key(**params)
+    return os.path.exists(os.path.join(_config["cache_dir"], key + ".json"))
+
+
+def find_superset(bbox, resx, resy, **params):
+    """
+    Find cached raster of the same layer that covers bbox at the same or finer resolution.
+
+    Parameters
+    ----------
+    bbox : list
+        requested bounding box [minx, miny, maxx, maxy]
+    resx, resy : float
+        requested resolution in units of crs
+    **params : other request parameters that define the layer (source, identifier, crs, format, ...),
+        i.e. all parameters of the request except for bbox, width, height, resx, resy
+
+    Returns
+    -------
+    fname : str, path of cached raster, or None if not found.
+        If multiple rasters qualify, the one with the coarsest resolution is returned.
+    """
+    if not enabled():
+        return None
+    layer = _index_layers().get(_layer_key(params))
+    if layer is None:
+        return None
+    tree, entries = layer
+    # Tolerance for rounding noise in coordinates and resolution
+    eps = 1e-9 * max(abs(bbox[2] - bbox[0]), abs(bbox[3] - bbox[1]))
+    request = box(bbox[0] + eps, bbox[1] + eps, bbox[2] - eps, bbox[3] - eps)
+    candidates = [
+        entries[i]
+        for i in tree.query(request, predicate="covered_by")
+        if (entries[i][1] <= resx * (1 + 1e-9)) and (entries[i][2] <= resy * (1 + 1e-9))
+    ]
+    for _, _, _, path in sorted(candidates, key=lambda entry: -entry[1] * entry[2]):
+        if os.path.exists(path):
+            # Update time of last use for LRU eviction
+            os.utime(path)
+            return path
+    return None
+
+
+def clear():
+    """
+    Remove all files from the cache.
+    """
+    evict(max_size_gb=0)
+
+
+def _normalise(value):
+    """
+    Convert value to JSON compatible type, floats are rounded to avoid rounding noise in keys.
+    """
+    if isinstance(value, (list, tuple)):
+        return [_normalise(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _normalise(v) for k, v in value.items()}
+    if isinstance(value, float):
+        return round(value, 10)
+    if hasattr(value, "item"):
+        # numpy scalar
+        return _normalise(value.item())
+    return value
+
+
+def _layer_key(params):
+    """
+    Return key of the layer of a raster request, i.e. of all parameters except the grid parameters.
+    """
+    return cache_key(**{k: v for k, v in params.items() if k not in _GRID_PARAMS})
+
+
+def _index_layers():
+    """
+    Return spatial index of cached rasters as dict {layer key: (STRtree, entries)},
+    with entries (bbox, resx, resy, path) in the same order as the tree geometries.
+    """
+    cache_dir = _config["cache_dir"]
+    with _lock:
+        mtime = (cache_dir, os.stat(cache_dir).st_mtime_ns)
+        if _index["mtime"] == mtime:
+            return _index["layers"]
+        entries = {}
+        for fname in os.listdir(cache_dir):
+            if not fname.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(cache_dir, fname)) as f:
+                    metadata = json.load(f)
+            except (OSError, ValueError):
+                continue
+            entry = _raster_entry(metadata)
+            if entry is not None:
+                entries.setdefault(_layer_key(metadata["params"]), []).append(entry)
+        layers = {}
+        for key, layer_entries in entries.items():
+            tree = STRtree([box(*entry[0]) for entry in layer_entries])
+            layers[key] = (tree, layer_entries)
+        _index["mtime"] = mtime
+        _index["layers"] = layers
+    return layers
+
+
+def _raster_entry(metadata):
+    """
+    Return index entry (bbox, resx, resy, path) of cached GeoTIFF, or None for other files.
+    """
+    params = metadata.get("params", {})
+    bbox = params.get("bbox")
+    if (bbox is None) or (str(params.get("format", "")).lower() != "geotiff"):
+        return None
+    resx, resy = params.get("resx"), params.get("resy")
+    if (resx is None) or (resy is None):
+        if not params.get("width") or not params.get("height"):
+            return None
+        resx = (bbox[2] - bbox[0]) / params["width"]
+        resy = (bbox[3] - bbox[1]) / params["height"]
+    return (bbox, resx, resy, os.path.join(_config["cache_dir"], metadata["file"]))
+
+
+def _write_metadata(key, params, fname_cache):
+    """
+    Save request parameters of cached file as json (atomically).
+    """
+    fname = os.path.join(_config["cache_dir"], key + ".json")
+    fname_tmp = f"{fname}.{os.getpid()}.{threading.get_ident()}.tmp"
+    metadata = {"params": {k: _normalise(v) for k, v in params.items()}}
+    metadata["file"] = fname_cache
+    metadata["created"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    with open(fname_tmp, "w") as f:
+        json.dump(metadata, f, default=str)
+    os.replace(fname_tmp, fname)
+
+
+def _in_progress(key):
+    """
+    Return True if a request with key is being downloaded by this process.
+    """
+    key_lock = _key_locks.get(key)
+    return (key_lock is not None) and key_lock.locked()
+
+
+def _remove_entry(path):
+    """
+    Remove cached file and its metadata (partial files have no metadata).
+    """
+    fnames = [path] if path.endswith(".part") else [path, os.path.splitext(path)[0] + ".json"]
+    for fname in fnames:
+        try:
+            os.remove(fname)
+        except FileNotFoundError:
+            pass
+
+
+def _copy(src, dst):
+    """
+    Copy cached file src to output file dst (atomically).
+    """
+    dirname = os.path.dirname(dst)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    dst_tmp = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        shutil.copyfile(src, dst_tmp)
+        os.replace(dst_tmp, dst)
+    finally:
+        if os.path.exists(dst_tmp):
+            os.remove(dst_tmp)
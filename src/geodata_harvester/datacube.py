@@ -0,0 +1,180 @@
+"""
+Zarr datacube output for time stacks.
+
+Time stacks of a data source (e.g. temporal aggregations of DEA or SILO layers, or the daily
+SILO stacks) are written to one chunked Zarr store per source, with one group per layer:
+
+    <outpath>/<source>.zarr/<layer>/<variable>(time, y, x)
+
+Coordinates (time, y, x), crs (spatial_ref) and attributes (source, layer, aggregation) are
+stored with the data, so that point extraction and time-window aggregation can read only the
+chunks they need, e.g.:
+
+    import xarray as xr
+    ds = xr.open_zarr("results/silo.zarr", group="daily_rain")
+    ts = ds["daily_rain"].sel(x=149.1, y=-30.2, method="nearest").values
+
+Writing Zarr stores requires the optional package zarr (pip install zarr). Chunking and
+compression can be changed with configure().
+
+This package is part of the Data Harvester project developed for the Agricultural Research Federation (AgReFed).
+
+Copyright 2023 Sydney Informatics Hub (SIH), The University of Sydney
+
+This open-source software is released under the LGPL-3.0 License.
+"""
+
+import os
+import rioxarray  # noqa: F401
+
+from geodata_harvester import temporal
+
+try:
+    import zarr
+except ImportError:
+    zarr = None
+
+# Chunk sizes along time, y and x, and Blosc compression (compressor name, level, shuffle)
+_config = {
+    "chunks": {"time": 64, "y": 256, "x": 256},
+    "compressor": "zstd",
+    "level": 3,
+    "shuffle": "bitshuffle",
+}
+
+
+def configure(chunks=None, compressor=None, level=None, shuffle=None):
+    """
+    Configure chunking and compression of Zarr stores.
+
+    Parameters
+    ----------
+    chunks : dict, optional
+        chunk sizes of dimensions, e.g. {"time": 64, "y": 256, "x": 256} (Default).
+        Dimensions that are not given are not chunked.
+    compressor : str, optional
+        Blosc compressor: "zstd" (Default), "lz4", "lz4hc", "zlib" or "blosclz"
+    level : int, optional
+        compression level 0-9 (Default: 3)
+    shuffle : str, optional
+        "bitshuffle" (Default), "shuffle" or "noshuffle"
+    """
+    if chunks is not None:
+        _config["chunks"] = dict(chunks)
+    for key, value in dict(compressor=compressor, level=level, shuffle=shuffle).items():
+        if value is not None:
+            _config[key] = value
+
+
+def available():
+    """
+    Return True if zarr is installed.
+    """
+    return zarr is not None
+
+
+def write_stack(xdr, store, group, name, attrs=None):
+    """
+    Write time stack to group of Zarr store (replaces existing group).
+
+    Parameters
+    ----------
+    xdr : xarray.DataArray
+        time stack with dimensions (time, y, x) or (time, band, y, x) and crs (rioxarray)
+    store : str
+        path of Zarr store, e.g. "results/silo.zarr"
+    group : str
+        name of group, e.g. layer name
+    name : str
+        name of data variable
+    attrs : dict, optional
+        attributes of data variable, e.g. source, layer and aggregation
+
+    Returns
+    -------
+    store : str
+    """
+    if zarr is None:
+        raise ImportError("zarr is required for Zarr output, install with: pip install zarr")
+    xdr = xdr.transpose("time", ...)
+    if "band" in xdr.dims and xdr.sizes["band"] == 1:
+        xdr = xdr.squeeze("band", drop=True)
+    xdr = xdr.rename(name)
+    nodata = xdr.rio.nodata
+    # Attributes of the GeoTIFFs (scale, offset, band names) do not apply to the stack
+    xdr.attrs = {k: v for k, v in (attrs or {}).items() if v is not None}
+    xdr.encoding = {}
+    if "spatial_ref" in xdr.coords:
+        xdr.attrs["grid_mapping"] = "spatial_ref"
+    # Dimensions without configured chunk size (e.g. band) are not chunked
+    chunks = {dim: min(_config["chunks"].get(dim, size), size) for dim, size in xdr.sizes.items()}
+    if _dask_available():
+        xdr = xdr.chunk(chunks)
+    ds = xdr.to_dataset()
+    ds.attrs = {k: v for k, v in xdr.attrs.items() if k != "grid_mapping"}
+    encoding = {name: {"chunks": tuple(chunks[dim] for dim in xdr.dims)}}
+    encoding[name].update(_compressor_encoding())
+    if nodata is not None:
+        # Missing values are read as nan
+        encoding[name]["_FillValue"] = nodata
+    ds.to_zarr(store, group=group, mode="w", encoding=encoding)
+    return store
+
+
+def write_files(file_list, store, group, name, date_list=None, attrs=None):
+    """
+    Write GeoTIFFs of a time series (one file per time step, e.g. temporal aggregations)
+    to group of Zarr store.
+
+    Parameters
+    ----------
+    file_list : list of file names in date order
+    store, group, name, attrs : see write_stack
+    date_list : list of dates, optional.
+        If None, the dates are extracted from the file names (after the last underscore).
+
+    Returns
+    -------
+    store : str
+    """
+    xdr = temporal.multiband_raster_to_xarray(file_list, date_list=date_list)
+    return write_stack(xdr, store, group, name, attrs=attrs)
+
+
+def write_multiband(fname, store, group, name, attrs=None):
+    """
+    Write multi-band GeoTIFF with one band per time step (e.g. SILO daily stacks, band
+    description as date) to group of Zarr store.
+
+    Returns
+    -------
+    store : str
+    """
+    xdr = temporal.combine_rasters_temporal(fname, channel_name="band", attribute_name="long_name")
+    return write_stack(xdr, store, group, name, attrs=attrs)
+
+
+def store_path(outpath, source):
+    """
+    Return path of Zarr store of a data source.
+    """
+    return os.path.join(outpath, source.lower() + ".zarr")
+
+
+def _compressor_encoding():
+    """
+    Return encoding of Blosc compressor for installed zarr version.
+    """
+    if int(zarr.__version__.split(".")[0]) >= 3:
+        from zarr.codecs import BloscCodec
+        return {"compressors": [BloscCodec(cname=_config["compressor"], clevel=_config["level"], shuffle=_config["shuffle"])]}
+    from numcodecs import Blosc
+    shuffle = {"noshuffle": Blosc.NOSHUFFLE, "shuffle": Blosc.SHUFFLE, "bitshuffle": Blosc.BITSHUFFLE}[_config["shuffle"]]
+    return {"compressor": Blosc(cname=_config["compressor"], clevel=_config["level"], shuffle=shuffle)}
+
+
+def _dask_available():
+    """
+    Return True if dask is installed (required for chunked writing of lazy stacks).
+    """
+    return temporal._chunks is not None
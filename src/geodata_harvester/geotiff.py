@@ -0,0 +1,250 @@
+"""
+Common layer for writing GeoTIFF outputs.
+
+All output rasters of the harvester (WCS downloads, reprojected and aggregated rasters,
+temporal aggregations, SILO time stacks, DEM terrain layers) are written with the
+functions of this module, so that the output layout is configured in one place:
+
+- internally tiled GeoTIFF with configurable block size (default 512 x 512 pixels)
+- compression (default DEFLATE; ZSTD, LZW, LERC, LERC_DEFLATE, LERC_ZSTD or None) with predictor
+  (horizontal differencing for integer and floating point predictor for float data)
+- internal overviews (optional)
+- Cloud-Optimized GeoTIFF (COG) layout (optional, always with overviews)
+
+The layout can be changed with configure(), e.g.:
+
+    from geodata_harvester import geotiff
+    geotiff.configure(cog=True, compress="zstd", blocksize=256)
+
+Rasters are written either with open_raster() and finalize() (rasterio), with write_xarray()
+(rioxarray) or are converted with rewrite() (e.g. images downloaded from a server).
+
+This package is part of the Data Harvester project developed for the Agricultural Research Federation (AgReFed).
+
+Copyright 2023 Sydney Informatics Hub (SIH), The University of Sydney
+
+This open-source software is released under the LGPL-3.0 License.
+"""
+
+import os
+import numpy as np
+import rasterio
+import rasterio.shutil
+from rasterio.enums import Resampling
+
+# Output layout: COG, block size in pixels, compression (None: no compression), compression level
+# (None: GDAL default), maximum error of LERC compression (0: lossless), internal overviews and
+# resampling method for overviews
+_config = {
+    "cog": False,
+    "blocksize": 512,
+    "compress": "deflate",
+    "level": None,
+    "max_z_error": 0,
+    "overviews": False,
+    "overview_resampling": "nearest",
+}
+
+# Options of rasterio profiles that are replaced by the configured layout
+_LAYOUT_OPTIONS = ["driver", "tiled", "blockxsize", "blockysize", "compress", "predictor", "zlevel",
+                   "zstd_level", "max_z_error", "bigtiff"]
+
+
+def configure(
+    cog=None,
+    blocksize=None,
+    compress=None,
+    level=None,
+    max_z_error=None,
+    overviews=None,
+    overview_resampling=None,
+):
+    """
+    Configure layout of GeoTIFF outputs.
+
+    Parameters
+    ----------
+    cog : bool, optional
+        write Cloud-Optimized GeoTIFFs (with overviews)
+    blocksize : int, optional
+        size of internal tiles in pixels, multiple of 16 (Default: 512)
+    compress : str, optional
+        compression method: "deflate" (Default), "zstd", "lzw", "lerc", "lerc_deflate", "lerc_zstd"
+        or "none"
+    level : int, optional
+        compression level of DEFLATE (1-12) or ZSTD (1-22)
+    max_z_error : float, optional
+        maximum error of LERC compression (Default: 0, lossless)
+    overviews : bool, optional
+        build internal overviews (always True for COG)
+    overview_resampling : str, optional
+        resampling method for overviews, e.g. "nearest" (Default), "average", "mode"
+    """
+    if (blocksize is not None) and (blocksize % 16 != 0):
+        raise ValueError("blocksize must be a multiple of 16")
+    if compress is not None:
+        compress = None if str(compress).lower() == "none" else str(compress).lower()
+        _config["compress"] = compress
+    for key, value in dict(
+        cog=cog,
+        blocksize=blocksize,
+        level=level,
+        max_z_error=max_z_error,
+        overviews=overviews,
+        overview_resampling=overview_resampling,
+    ).items():
+        if value is not None:
+            _config[key] = value
+
+
+def blocksize():
+    """
+    Return size of internal tiles of GeoTIFF outputs in pixels (see configure), e.g. to align
+    windows of block-wise processing with the tiles.
+    """
+    return _config["blocksize"]
+
+
+def creation_options(dtype):
+    """
+    Return GTiff creation options of configured layout for data type.
+
+    Parameters
+    ----------
+    dtype : str or numpy dtype
+
+    Returns
+    -------
+    options : dict
+        options for rasterio.open (mode "w") or rioxarray's to_raster
+    """
+    blocksize = _config["blocksize"]
+    options = {
+        "driver": "GTiff",
+        "tiled": True,
+        "blockxsize": blocksize,
+        "blockysize": blocksize,
+        "bigtiff": "IF_SAFER",
+    }
+    compress = _config["compress"]
+    if compress is None:
+        return options
+    options["compress"] = compress
+    if compress in ["deflate", "zstd", "lzw", "lerc_deflate", "lerc_zstd"]:
+        if not compress.startswith("lerc"):
+            # Floating point predictor for float data, horizontal differencing otherwise
+            options["predictor"] = 3 if np.issubdtype(np.dtype(dtype), np.floating) else 2
+        if _config["level"] is not None:
+            if compress.endswith("deflate"):
+                options["zlevel"] = _config["level"]
+            elif compress.endswith("zstd"):
+                options["zstd_level"] = _config["level"]
+    if compress.startswith("lerc"):
+        options["max_z_error"] = _config["max_z_error"]
+    return options
+
+
+def open_raster(fname, **profile):
+    """
+    Open GeoTIFF for writing with configured layout.
+
+    Parameters
+    ----------
+    fname : str
+        output file name
+    **profile : rasterio profile (dtype, count, width, height, crs, transform, nodata, ...).
+        Driver, tiling and compression options are replaced by the configured layout.
+
+    Returns
+    -------
+    dst : rasterio dataset in write mode. Call finalize(fname) after closing the dataset.
+    """
+    profile = {k: v for k, v in profile.items() if k.lower() not in _LAYOUT_OPTIONS}
+    profile.update(creation_options(profile["dtype"]))
+    return rasterio.open(fname, "w", **profile)
+
+
+def write_xarray(xdr, fname, **kwargs):
+    """
+    Write rioxarray DataArray or Dataset to GeoTIFF with configured layout.
+
+    Parameters
+    ----------
+    xdr : xarray.DataArray or xarray.Dataset
+    fname : str
+        output file name
+    **kwargs : additional arguments for rio.to_raster
+    """
+    dtype = kwargs.pop("dtype", None)
+    if dtype is None:
+        dtype = xdr.dtype if hasattr(xdr, "dtype") else list(xdr.data_vars.values())[0].dtype
+    xdr.rio.to_raster(fname, dtype=dtype, **creation_options(dtype), **kwargs)
+    finalize(fname)
+    return fname
+
+
+def rewrite(fname):
+    """
+    Rewrite existing GeoTIFF with configured layout (e.g. for images downloaded from a server).
+    """
+    with rasterio.open(fname) as src:
+        dtype = src.dtypes[0]
+    fname_tmp = fname + ".layout.tmp"
+    try:
+        rasterio.shutil.copy(fname, fname_tmp, **creation_options(dtype))
+        finalize(fname_tmp)
+        os.replace(fname_tmp, fname)
+    finally:
+        if os.path.exists(fname_tmp):
+            os.remove(fname_tmp)
+    return fname
+
+
+def finalize(fname):
+    """
+    Build overviews or convert to Cloud-Optimized GeoTIFF as configured.
+    Call after a file opened with open_raster() is closed.
+    """
+    if _config["cog"]:
+        _to_cog(fname)
+    elif _config["overviews"]:
+        with rasterio.open(fname, "r+") as dst:
+            factors = overview_factors(dst.width, dst.height)
+            if len(factors) > 0:
+                dst.build_overviews(factors, Resampling[_config["overview_resampling"]])
+                dst.update_tags(ns="rio_overview", resampling=_config["overview_resampling"])
+    return fname
+
+
+def overview_factors(width, height):
+    """
+    Return overview decimation factors (powers of 2) until the overview fits into one block.
+    """
+    factors = []
+    factor = 2
+    while max(width, height) / factor >= _config["blocksize"] / 2:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+
+def _to_cog(fname):
+    """
+    Convert GeoTIFF to Cloud-Optimized GeoTIFF with overviews (replaces file).
+    """
+    with rasterio.open(fname) as src:
+        dtype = src.dtypes[0]
+    options = {k: v for k, v in creation_options(dtype).items() if k not in ["tiled", "blockxsize", "blockysize"]}
+    options["driver"] = "COG"
+    options["blocksize"] = _config["blocksize"]
+    options["compress"] = options.get("compress") or "none"
+    if "predictor" in options:
+        options["predictor"] = "YES"
+    options["overview_resampling"] = _config["overview_resampling"]
+    fname_tmp = fname + ".cog.tmp"
+    try:
+        rasterio.shutil.copy(fname, fname_tmp, **options)
+        os.replace(fname_tmp, fname)
+    finally:
+        if os.path.exists(fname_tmp):
+            os.remove(fname_tmp)
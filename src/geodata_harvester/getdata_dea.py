@@ -42,13 +42,14 @@ TBF:
 """
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 from owslib.wcs import WebCoverageService
 import rasterio
 from rasterio import MemoryFile
 from rasterio.plot import show
 from datetime import datetime, timezone
 from termcolor import cprint, colored
-from geodata_harvester import utils
+from geodata_harvester import utils, wcsclient
 from geodata_harvester.utils import spin
 
 # logger setup
@@ -442,7 +443,7 @@ def get_times(url, layername, year=None):
     ------
     list of dates
     """
-    wcs = WebCoverageService(url, version="1.0.0", timeout=300)
+    wcs = wcsclient.get_wcs(url, version="1.0.0", timeout=300)
     times = wcs[layername].timepositions
     if year is None:
         return times
@@ -474,7 +475,7 @@ def get_times_startend(url, layername, dt_start, dt_end):
     # Convert to datetimes
     dt_start = datetime.strptime(dt_start, "%Y-%m-%d")
     dt_end = datetime.strptime(dt_end, "%Y-%m-%d")
-    wcs = WebCoverageService(url, version="1.0.0", timeout=300)
+    wcs = wcsclient.get_wcs(url, version="1.0.0", timeout=300)
     times = wcs[layername].timepositions
     dates = []
     for time in times:
@@ -536,35 +537,27 @@ def get_wcsmap(
     else:
         try:
             with spin(f"Downloading {layername}.tif for {date}") as s:
-                wcs = WebCoverageService(url, version="1.0.0", timeout=300)
+                # large images are downloaded in tiles (see wcsclient.download_coverage)
                 if date == "None":
-                    data = wcs.getCoverage(
-                        identifier=layername,
-                        bbox=bbox,
-                        format=format_out,
-                        crs=crs,
-                        width=nwidth,
-                        height=nheight,
-                        Styles="tc",
-                    )
+                    time_kwargs = {}
                 else:
-                    data = wcs.getCoverage(
-                        identifier=layername,
-                        time=[date],
-                        bbox=bbox,
-                        format=format_out,
-                        crs=crs,
-                        width=nwidth,
-                        height=nheight,
-                        Styles="tc",
-                    )
+                    time_kwargs = {"time": [date]}
+                wcsclient.download_coverage(
+                    outfname,
+                    url,
+                    identifier=layername,
+                    bbox=bbox,
+                    format=format_out,
+                    crs=crs,
+                    width=nwidth,
+                    height=nheight,
+                    Styles="tc",
+                    **time_kwargs,
+                )
                 s(1)
         except:
             utils.msg_err("Download failed")
             return False
-        # Save data
-        with open(outfname, "wb") as f:
-            f.write(data.read())
     return True
 
 
@@ -645,11 +638,16 @@ def get_dea_layers_daterange(
     crs="EPSG:4326",
     format_out="GeoTIFF",
     verbose=False,
+    max_workers=4,
 ):
     """
     Get all images for all layers and all dates between start_date and end_date.
     Downloaded images are saved in outpath.
 
+    Images of all layers and dates are downloaded in parallel with up to max_workers threads
+    (the number of concurrent requests to the DEA server is additionally limited by
+    wcsclient.host_slot).
+
     Parameters
     ----------
     layernames : list of strings
@@ -668,10 +666,12 @@ def get_dea_layers_daterange(
         crs, default 'EPSG:4326'
     format: str
         output format, either "GeoTIFF" or "NetCDF"
+    max_workers: int
+        maximum number of parallel downloads, default 4
 
     Return
     ------
-    list of output filenames for each layer
+    list of output filenames for each layer (in order of layers and dates)
     """
     # Logger setup
     if verbose:
@@ -682,21 +682,16 @@ def get_dea_layers_daterange(
     # Check if input is list
     if not (isinstance(layernames, tuple) | isinstance(layernames, list)):
         layernames = [layernames]
-    # Loop over layernames
+    # Collect download tasks of all layers
     # logging.print("Processing DEA...")
-    fnames_out = []
+    tasks = []
     for layername in layernames:
-        # save for each layer
-        fnames_out += get_dea_images_daterange(
-            layername,
-            date_start,
-            date_end,
-            bbox,
-            resolution,
-            outpath,
-            crs=crs,
-            format_out=format_out,
-        )
+        layer_tasks = _get_daterange_tasks(layername, date_start, date_end, outpath, format_out)
+        if layer_tasks is not False:
+            tasks += layer_tasks
+    fnames_out = _download_images(
+        tasks, bbox, resolution, crs=crs, format_out=format_out, max_workers=max_workers
+    )
     # logging.print(f"DEA download(s) complete (saved to: {outpath})")
     return fnames_out
 
@@ -819,10 +814,12 @@ def get_dea_images_daterange(
     crs="EPSG:4326",
     format_out="GeoTIFF",
     verbose=False,
+    max_workers=4,
 ):
     """
     Get all satellite images from DEA for a given layer and year.
     Downloaded images are saved either as GeoTIFF or NetCDF.
+    Images are downloaded in parallel with up to max_workers threads.
 
     Parameters
     ----------
@@ -842,10 +839,12 @@ def get_dea_images_daterange(
         crs, default 'EPSG:4326'
     format: str
         output format, either "GeoTIFF" or "NetCDF"
+    max_workers: int
+        maximum number of parallel downloads, default 4
 
     Return
     ------
-    Exited ok: boolean
+    list of output filenames (in date order)
     """
     # Logger setup
     if verbose:
@@ -853,6 +852,36 @@ def get_dea_images_daterange(
     else:
         write_logs.setup()
 
+    tasks = _get_daterange_tasks(layername, date_min, date_max, outpath, format_out)
+    if tasks is False:
+        return False
+    return _download_images(
+        tasks, bbox, resolution, crs=crs, format_out=format_out, max_workers=max_workers
+    )
+
+
+def _get_daterange_tasks(layername, date_min, date_max, outpath, format_out="GeoTIFF"):
+    """
+    Return download tasks for all available images of a layer between date_min and date_max.
+
+    Parameters
+    ----------
+    layername : str
+        layer identifier
+    date_min : str
+        start datetime string for images (format: YYYY-MM-DD)
+    date_max : str
+        end datetime string for images (format: YYYY-MM-DD)
+    outpath : str
+        output directory
+    format: str
+        output format, either "GeoTIFF" or "NetCDF"
+
+    Return
+    ------
+    list of tuples (layername, date, outfname) in date order,
+    or False if time coverage could not be retrieved
+    """
     os.makedirs(outpath, exist_ok=True)
 
     # URL
@@ -875,8 +904,8 @@ def get_dea_images_daterange(
 
     if len(dates) == 0:
         dates = ["None"]
-    # Download images for all dates in year
-    outfnames = []
+    # Define output files for all dates
+    tasks = []
     for date in dates:
         if format_out == "GeoTIFF":
             fname_end = ".tif"
@@ -894,8 +923,46 @@ def get_dea_images_daterange(
                 date[:-1]).astimezone(timezone.utc)
             fname_out = f"{layername}_{datestring.year}-{datestring.month}-{datestring.day}{fname_end}"
         outfname = os.path.join(outpath, fname_out)
-        # Get data
-        download_ok = get_wcsmap(
+        tasks.append((layername, date, outfname))
+    return tasks
+
+
+def _download_images(
+    tasks,
+    bbox,
+    resolution,
+    crs="EPSG:4326",
+    format_out="GeoTIFF",
+    max_workers=4,
+):
+    """
+    Download images for a list of tasks in parallel.
+    Existing files are skipped (see get_wcsmap).
+
+    Parameters
+    ----------
+    tasks : list of tuples (layername, date, outfname)
+    bbox : list
+        layer bounding box
+    resolution : int
+        layer resolution in arcsec
+    crs: str
+        crs, default 'EPSG:4326'
+    format: str
+        output format, either "GeoTIFF" or "NetCDF"
+    max_workers: int
+        maximum number of parallel downloads
+
+    Return
+    ------
+    list of output filenames of successful downloads (in order of tasks)
+    """
+    # URL
+    url = "https://ows.dea.ga.gov.au/?version=1.3.0"
+
+    def _download(task):
+        layername, date, outfname = task
+        return get_wcsmap(
             outfname,
             layername,
             bbox,
@@ -905,9 +972,19 @@ def get_dea_images_daterange(
             crs=crs,
             format_out=format_out,
         )
+
+    if (max_workers is None) or (max_workers <= 1) or (len(tasks) <= 1):
+        downloads_ok = [_download(task) for task in tasks]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # map returns results in order of tasks
+            downloads_ok = list(executor.map(_download, tasks))
+
+    outfnames = []
+    for (layername, date, outfname), download_ok in zip(tasks, downloads_ok):
         # Log download success message if file does not already exist
         if download_ok:
             outfnames.append(outfname)
         else:
             cprint(f"✘ {layername} for date {date} failed to download", "red")
-    return outfnames
\ No newline at end of file
+    return outfnames
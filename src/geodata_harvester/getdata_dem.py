@@ -9,6 +9,7 @@ Core functions:
     getwcs_dem(): download the data as geotiff file for given bbox and resolution
     dem2slope(): convert geotiff to slope raster
     dem2aspect(): convert geotiff to aspect raster
+    dem2terrain(): convert geotiff to multiple terrain rasters (slope, aspect, curvature, hillshade, TPI, roughness)
     getdict_license(): get the license and attributes for the DEM 1 arc second grid
 
 The DEM layer metadata can be retrieved with the function get_capabilities().
@@ -34,9 +35,9 @@ Author: Sebastian Haan
 import logging
 import os
 from datetime import datetime, timezone
-from geodata_harvester import utils
+from geodata_harvester import utils, wcsclient
 from geodata_harvester.utils import spin
-from geodata_harvester import arc2meter
+from geodata_harvester import terrain
 
 import rasterio
 
@@ -45,8 +46,17 @@ from geodata_harvester import write_logs
 from owslib.wcs import WebCoverageService
 from rasterio.plot import show
 from termcolor import cprint
-import rioxarray
-import numpy as np
+
+
+# Terrain layers derived from the DEM and their names in terrain.py
+TERRAIN_LAYERS = {
+    "Slope": "slope",
+    "Aspect": "aspect",
+    "Curvature": "curvature",
+    "Hillshade": "hillshade",
+    "TPI": "tpi",
+    "Roughness": "roughness",
+}
 
 
 def get_demdict():
@@ -74,6 +84,10 @@ def get_demdict():
         "DEM": "Digital Elevation Model",
         "Slope": "Slope",
         "Aspect": "Aspect Ratio",
+        "Curvature": "Curvature",
+        "Hillshade": "Hillshade",
+        "TPI": "Topographic Position Index",
+        "Roughness": "Roughness",
     }
     return demdict
 
@@ -189,10 +203,10 @@ def getwcs_dem(
     os.makedirs(outpath, exist_ok=True)
     # Create WCS object and get data
     try:
+        # title is kept in the download cache (if enabled), so that cached downloads need no network access
         with spin("Retrieving coverage from WCS server") as s:
-            wcs = WebCoverageService(url, version="1.0.0", timeout=300)
+            layername = wcsclient.get_title(url, "1", version="1.0.0", timeout=300)
             s(1)
-        layername = wcs["1"].title
         date = datetime.now(timezone.utc).strftime("%Y_%m_%d")
         fname_out = layername.replace(" ", "_") + "_" + date + ".tif"
         outfname = os.path.join(outpath, fname_out)
@@ -201,7 +215,10 @@ def getwcs_dem(
             # logging.warning(f"△ | download skipped: {outfname} already exists")
         else:
             with spin(f"Downloading {fname_out}") as s:
-                data = wcs.getCoverage(
+                # large images are downloaded in tiles (see wcsclient.download_coverage)
+                wcsclient.download_coverage(
+                    outfname,
+                    url,
                     identifier="1",
                     bbox=bbox,
                     format="GeoTIFF",
@@ -211,9 +228,6 @@ def getwcs_dem(
                     Styles="tc",
                 )
                 s(1)
-            # Save data to file
-            with open(outfname, "wb") as f:
-                f.write(data.read())
             # logging.print(f"✓ | DEM downloaded to: {outfname}")
     except Exception as e:
         print(e)
@@ -225,13 +239,13 @@ def getwcs_dem(
 def get_dem_layers(layernames, outpath, bbox, resolution=1, crs="EPSG:4326"):
     """
     Wrapper funtion to get the layers from the Geoscience Australia DEM 1 arc second grid
-    and to calculate slope and aspect layers
+    and to calculate terrain layers (computed together in one pass over the DEM)
 
     Parameters
     ----------
     layernames : list
         list of layer names to download
-        ['DEM', 'Slope', 'Aspect']
+        ['DEM', 'Slope', 'Aspect', 'Curvature', 'Hillshade', 'TPI', 'Roughness']
     outpath : str
         output directory for the downloaded file
     bbox : list
@@ -243,30 +257,21 @@ def get_dem_layers(layernames, outpath, bbox, resolution=1, crs="EPSG:4326"):
 
     Return
     ------
-    Output outnames: lits of output filenames
+    Output outnames: lits of output filenames of recognised layer names (in order of layernames),
+    or [False] if the DEM download failed
     """
-    outfnames = []
-    dem_ok = False
     for layername in layernames:
-        if layername == "DEM":
-            outfname = outfname_dem = getwcs_dem(
-                outpath, bbox, resolution, crs=crs)
-            dem_ok = True
-        elif layername == "Slope":
-            if not dem_ok:
-                outfname_dem = getwcs_dem(outpath, bbox, resolution, crs=crs)
-                dem_ok = True
-            outfname = dem2slope(outfname_dem)
-        elif layername == "Aspect":
-            if not dem_ok:
-                outfname_dem = getwcs_dem(outpath, bbox, resolution, crs=crs)
-                dem_ok = True
-            outfname = dem2aspect(outfname_dem)
-        else:
+        if layername != "DEM" and layername not in TERRAIN_LAYERS:
             utils.msg_warn(f"Layername {layername} not recognised, skipping")
-            outfname = None
-        outfnames.append(outfname)
-    return outfnames
+    layernames = [layername for layername in layernames if layername == "DEM" or layername in TERRAIN_LAYERS]
+    if not layernames:
+        return []
+    outfname_dem = getwcs_dem(outpath, bbox, resolution, crs=crs)
+    if not outfname_dem:
+        return [False]
+    terrain_layers = [layername for layername in layernames if layername in TERRAIN_LAYERS]
+    fnames_terrain = dem2terrain(outfname_dem, terrain_layers) if terrain_layers else {}
+    return [outfname_dem if layername == "DEM" else fnames_terrain[layername] for layername in layernames]
 
 
 def plot_raster(infname):
@@ -282,11 +287,13 @@ def plot_raster(infname):
     show(data)
 
 
-
 def calculate_slope_aspect(fname_dem, fname_out, type='slope'):
     """
     Calculate slope or aspect from DEM and save as geotiff.
 
+    The DEM is processed block-wise (see terrain.py), data type of the output and number
+    of workers can be set with terrain.configure().
+
     Parameters
     ----------
     fname_dem : str
@@ -300,37 +307,37 @@ def calculate_slope_aspect(fname_dem, fname_out, type='slope'):
     if type not in ['slope', 'aspect']:
         raise ValueError(f"Type {type} not recognised, must be 'slope' or 'aspect'")
 
-    # Open the DEM file
-    dem = rioxarray.open_rasterio(fname_dem, masked=True)
-
-    # convert dem  to meters if necessary
-    if dem.rio.crs != 'EPSG:4326':
-        dem = dem.rio.reproject('EPSG:4326')
-    # caculate factor for converting degrees to meter based on Latitude
-    deg2meter_x = arc2meter.calc_arc2meter(3600, dem.y)[0] # this is an array (due to Latitude dependency in conversion)
-    deg2meter_y = arc2meter.calc_arc2meter(3600, dem.y)[1] # ths is a constant
+    # Gradients in x and y direction (converted to meter based on Latitude), computed and
+    # saved in windows of rows of the DEM
+    terrain.calculate(fname_dem, fname_out, layer=type)
 
-    # Calculate the gradient in the x and y directions
-    gradient_x = dem.differentiate("x") / deg2meter_x
-    gradient_y = dem.differentiate("y") / deg2meter_y
 
-    # Calculate slope:
-    if type == 'slope':
-        gradient_magnitude = np.sqrt(gradient_x**2 + gradient_y**2)
-        result = np.arctan(gradient_magnitude) * 180 / np.pi
-
-    if type == 'aspect':
-        result = np.arctan2(gradient_x, gradient_y) * 180 / np.pi + 180
-
-    # mask out values where dem has zero
-    result = result.where(dem != 0, 0)
-
-    # Assign the coordinate reference system of the original DEM to the new raster
-    result = result.rio.write_crs(dem.rio.crs)
+def dem2terrain(fname_dem, layernames):
+    """
+    Calculate terrain layers from DEM in one pass and save as geotiffs.
+    Output files are saved in the folder of the DEM with the layer name as prefix,
+    e.g. Slope_<DEM file name>.
 
-    # Save the result as a new GeoTIFF file
-    result.rio.to_raster(fname_out)
+    Parameters
+    ----------
+    fname_dem : str
+        DEM path + file name
+    layernames : list
+        list of terrain layers, any of TERRAIN_LAYERS:
+        ['Slope', 'Aspect', 'Curvature', 'Hillshade', 'TPI', 'Roughness']
 
+    Return
+    ------
+    dict of layer name and output filename
+    """
+    fname = os.path.basename(fname_dem)
+    path = os.path.dirname(fname_dem)
+    fnames_out = {layername: os.path.join(path, layername + "_" + fname) for layername in layernames}
+    terrain.derivatives(fname_dem, {TERRAIN_LAYERS[layername]: fname_out for layername, fname_out in fnames_out.items()})
+    for layername, fname_out in fnames_out.items():
+        logging.info(f"✔  DEM {layername.lower()} from: {fname_dem}")
+        utils.msg_success(f"{layername} (from DEM) generated at: {fname_out}")
+    return fnames_out
 
 
 def dem2slope(fname_dem):
@@ -342,15 +349,7 @@ def dem2slope(fname_dem):
     fname_dem : str
         DEM path + file name
     """
-    # Get filename
-    fname = os.path.basename(fname_dem)
-    # Get path for output
-    path = os.path.dirname(fname_dem)
-    fname_out = os.path.join(path, "Slope_" + fname)
-    calculate_slope_aspect(fname_dem, fname_out, type='slope')
-    logging.info(f"✔  DEM slope from: {fname_dem}")
-    utils.msg_success(f"DEM slope generated at: {fname_out}")
-    return fname_out
+    return dem2terrain(fname_dem, ["Slope"])["Slope"]
 
 
 def dem2aspect(fname_dem):
@@ -362,15 +361,7 @@ def dem2aspect(fname_dem):
     fname_dem : str
         DEM file name
     """
-    # Get filename
-    fname = os.path.basename(fname_dem)
-    # Get path for output
-    path = os.path.dirname(fname_dem)
-    fname_out = os.path.join(path, "Aspect_" + fname)
-    calculate_slope_aspect(fname_dem, fname_out, type='aspect')
-    logging.info(f"✓ | DEM aspect from: {fname_dem}")
-    utils.msg_success(f"Aspect (from DEM) generated at: {fname_out}")
-    return fname_out
+    return dem2terrain(fname_dem, ["Aspect"])["Aspect"]
 
 
 def test_getwcs_dem(outpath="./test_DEM/"):
@@ -388,7 +379,6 @@ def test_getwcs_dem(outpath="./test_DEM/"):
     outfname = getwcs_dem(outpath, bbox, resolution, url, crs)
     # Convert to slope and aspect
     print("Convert to slope and aspect...")
-    dem2slope(outfname)
-    dem2aspect(outfname)
+    dem2terrain(outfname, ["Slope", "Aspect"])
     # plot DEM
     plot_raster(outfname)
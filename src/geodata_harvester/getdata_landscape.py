@@ -30,7 +30,7 @@ from rasterio.plot import show
 import matplotlib.pyplot as plt
 from termcolor import cprint, colored
 from alive_progress import alive_bar, config_handler
-from geodata_harvester import utils
+from geodata_harvester import utils, wcsclient
 from geodata_harvester.utils import spin
 
 
@@ -186,20 +186,19 @@ def get_wcsmap(url, identifier, crs, bbox, resolution, outfname, layername):
         utils.msg_warn(f"{layer_fname} already exists, skipping download")
     else:
         with spin(f"Downloading {layer_fname}") as s:
-            wcs = WebCoverageService(url, version="1.0.0")
-            # Get data
-            data = wcs.getCoverage(
-                identifier,
+            # Get data, large images are downloaded in tiles (see wcsclient.download_coverage)
+            wcsclient.download_coverage(
+                outfname,
+                url,
+                identifier=identifier,
                 format="GEOTIFF",
                 bbox=bbox,
                 crs=crs,
                 resx=resolution,
                 resy=resolution,
+                timeout=30,
             )
             s(1)
-        # Save data
-        with open(outfname, "wb") as f:
-            f.write(data.read())
 
 
 def get_landscape_layers(layernames, bbox, outpath, resolution=3):
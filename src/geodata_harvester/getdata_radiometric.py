@@ -31,7 +31,7 @@ from rasterio.plot import show
 from datetime import datetime, timezone
 from termcolor import cprint, colored
 from alive_progress import alive_bar, config_handler
-from geodata_harvester import utils
+from geodata_harvester import utils, wcsclient
 from geodata_harvester.utils import spin
 
 
@@ -237,8 +237,10 @@ def get_radiometric_image(
     else:
         try:
             with spin(f"Downloading {layername}") as s:
-                wcs = WebCoverageService(url, version="1.0.0", timeout=300)
-                data = wcs.getCoverage(
+                # large images are downloaded in tiles (see wcsclient.download_coverage)
+                wcsclient.download_coverage(
+                    outfname,
+                    url,
                     identifier=layername,
                     time=[date],
                     bbox=bbox,
@@ -251,10 +253,6 @@ def get_radiometric_image(
         except:
             utils.msg_err("Download failed")
             return False
-
-        # Save data
-        with open(outfname, "wb") as f:
-            f.write(data.read())
         # print(f"Layer {layername} saved in {outfname}")
     return True
 
@@ -273,7 +271,7 @@ def get_times(url, layername, year=None):
     ------
     list of dates
     """
-    wcs = WebCoverageService(url, version="1.0.0", timeout=300)
+    wcs = wcsclient.get_wcs(url, version="1.0.0", timeout=300)
     times = wcs[layername].timepositions
     if year is None:
         return times
@@ -3,7 +3,7 @@ Python script to automatically download and crop climate data layers from SILO.
 
 Functionalities:
 - download SILO data for custom time period and layer(s) as defined in dictionary
-- clip data to custom bounding box
+- clip data to custom bounding box (remotely via HTTP range requests if supported by server)
 - save data as multi-band geotiff or netCDF
 
 The SILO climate layers are described as dictionary in the module function get_silodict()
@@ -26,9 +26,14 @@ Author: Sebastian Haan
 """
 
 import os
-import shutil
+import time
 import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.exceptions import MaxRetryError
 import numpy as np
 
 # from urllib import request
@@ -37,11 +42,75 @@ import rasterio
 import rioxarray as rio
 import xarray
 
-from geodata_harvester import utils
+from geodata_harvester import utils, cache, geotiff
 from geodata_harvester.utils import spin
 
 # from datacube.utils.cog import write_cog
 
+# Base url of SILO annual files
+SILO_BASEURL = "https://s3-ap-southeast-2.amazonaws.com/silo-open-data/Official/annual/"
+
+# Timeout (connect, read) in seconds, number of retries with exponential backoff (backoff * 2**retry seconds)
+# and size of connection pool of the shared HTTP session for downloads from SILO.
+# Number of concurrent downloads and of concurrent crop/write tasks (see get_SILO_raster)
+_config = {"timeout": (10, 60), "retries": 5, "backoff": 1.0, "pool_size": 16, "download_workers": 4, "cpu_workers": 2}
+_session = {"session": None}
+_session_lock = threading.Lock()
+
+
+def configure(timeout=None, retries=None, backoff=None, pool_size=None, download_workers=None, cpu_workers=None):
+    """
+    Configure HTTP session and number of workers for SILO downloads.
+
+    INPUT:
+    timeout : float or tuple (connect timeout, read timeout) in seconds
+    retries : int, number of retries of failed requests and interrupted downloads
+    backoff : float, backoff factor in seconds, retry n waits backoff * 2**n seconds
+    pool_size : int, maximum number of connections kept alive
+    download_workers : int, number of years downloaded concurrently (default 4)
+    cpu_workers : int, number of years cropped and written concurrently (default 2)
+    """
+    for key, value in dict(
+        timeout=timeout,
+        retries=retries,
+        backoff=backoff,
+        pool_size=pool_size,
+        download_workers=download_workers,
+        cpu_workers=cpu_workers,
+    ).items():
+        if value is not None:
+            _config[key] = value
+    # New session with updated settings is created with next request
+    with _session_lock:
+        if _session["session"] is not None:
+            _session["session"].close()
+        _session["session"] = None
+
+
+def get_session():
+    """
+    Return shared requests session with keep-alive connection pool and retries with exponential backoff.
+
+    OUTPUT:
+    session : requests.Session
+    """
+    with _session_lock:
+        if _session["session"] is None:
+            retry = Retry(
+                total=_config["retries"],
+                backoff_factor=_config["backoff"],
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=["HEAD", "GET"],
+            )
+            adapter = HTTPAdapter(
+                pool_connections=_config["pool_size"], pool_maxsize=_config["pool_size"], max_retries=retry
+            )
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session["session"] = session
+        return _session["session"]
+
 
 def download_file(url, layername, year, outpath="."):
     """
@@ -58,10 +127,9 @@ def download_file(url, layername, year, outpath="."):
     if os.path.exists(local_filename):
         utils.msg_warn(f"{layername} for {year} already exists, skipping download")
         return local_filename
+
     with spin(f"Downloading {layername} for {year}") as s:
-        with requests.get(url, stream=True) as r:
-            with open(local_filename, "wb") as f:
-                shutil.copyfileobj(r.raw, f)
+        cache.fetch(local_filename, lambda fname: download_resumable(url, fname), resume=True, source=url)
         s(1)
 
     # with request.urlopen(url) as response:
@@ -71,6 +139,169 @@ def download_file(url, layername, year, outpath="."):
     return local_filename
 
 
+def download_resumable(url, outfname, chunk_size=2**20):
+    """
+    Download file with shared HTTP session and resume interrupted downloads.
+
+    The data is written to outfname + ".part". If the download is interrupted, it is resumed
+    with an HTTP range request from the size of the partial file (up to the configured number
+    of retries, with exponential backoff). A partial file of a previous run is resumed as well.
+    The file is renamed to outfname once it is complete.
+
+    INPUT:
+    url : str
+    outfname : str, output file name
+    chunk_size : int, size of chunks in bytes
+
+    OUTPUT:
+    outfname : str
+    """
+    session = get_session()
+    fname_part = outfname + ".part"
+    attempt = 0
+    while True:
+        offset = os.path.getsize(fname_part) if os.path.exists(fname_part) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset > 0 else {}
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=_config["timeout"]) as r:
+                if (r.status_code == 416) and (offset > 0):
+                    # Partial file is not valid for this url, start again from byte 0 (not counted as retry)
+                    os.remove(fname_part)
+                    continue
+                r.raise_for_status()
+                if r.status_code == 206:
+                    # Content-Range: bytes start-end/total
+                    content_range = r.headers["Content-Range"].split()[-1]
+                    if int(content_range.split("-")[0]) != offset:
+                        os.remove(fname_part)
+                        raise IOError(f"Unexpected Content-Range {content_range}")
+                    total = int(content_range.split("/")[-1])
+                    mode = "ab"
+                else:
+                    # Server ignored range request, download complete file
+                    total = int(r.headers["Content-Length"]) if "Content-Length" in r.headers else None
+                    offset = 0
+                    mode = "wb"
+                with open(fname_part, mode) as f:
+                    for chunk in r.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+            size = os.path.getsize(fname_part)
+            if (total is None) or (size == total):
+                os.replace(fname_part, outfname)
+                return outfname
+            raise IOError(f"Incomplete download: {size} of {total} bytes received")
+        except (requests.HTTPError, requests.exceptions.RetryError):
+            raise
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError, IOError) as e:
+            if (attempt == _config["retries"]) or _retries_exhausted(e):
+                raise
+            wait = _config["backoff"] * 2**attempt
+            utils.msg_warn(f"Download of {url} interrupted ({e}), resuming in {wait:.0f} seconds")
+            time.sleep(wait)
+            attempt += 1
+
+
+def _retries_exhausted(error):
+    """
+    Return True if error is raised after the retries of the HTTP adapter of the session are exhausted
+    (see get_session), i.e. the request is not retried again by download_resumable.
+    """
+    return bool(error.args) and isinstance(error.args[0], MaxRetryError)
+
+
+def supports_range_requests(url, timeout=30):
+    """
+    Check if server supports HTTP range requests for url.
+
+    INPUT:
+    url : str
+    timeout : int, timeout in seconds
+
+    OUTPUT:
+    bool
+    """
+    try:
+        with get_session().get(url, headers={"Range": "bytes=0-7"}, stream=True, timeout=timeout) as r:
+            return r.status_code == 206
+    except requests.RequestException:
+        return False
+
+
+def subset_dataset(ds, bbox=None, date_start=None, date_end=None):
+    """
+    Select data of SILO dataset within bounding box and date range.
+
+    INPUT:
+    ds : xarray dataset
+    bbox : list of bounding box coordinates (optional)
+    date_start : str, start date in format 'YYYY-MM-DD' (optional)
+    date_end : str, end date in format 'YYYY-MM-DD' (optional)
+
+    OUTPUT:
+    ds : xarray dataset
+    """
+    if bbox is not None:
+        ds = ds.sel(lon=slice(bbox[0], bbox[2]), lat=slice(bbox[1], bbox[3]))
+    if (date_start is not None) | (date_end is not None):
+        ds = ds.sel(time=slice(date_start, date_end))
+    return ds
+
+
+def read_remote_subset(url, layername, year, bbox=None, date_start=None, date_end=None):
+    """
+    Read subset of remote SILO netCDF file without downloading the whole file.
+
+    Uses HTTP range requests (byte-range mode of the netCDF library) so that only the
+    netCDF4/HDF5 chunks overlapping the bounding box and date range are transferred.
+
+    INPUT:
+    url : str, url of netCDF file
+    layername : str
+    year : int
+    bbox : list of bounding box coordinates (optional)
+    date_start : str, start date in format 'YYYY-MM-DD' (optional)
+    date_end : str, end date in format 'YYYY-MM-DD' (optional)
+
+    OUTPUT:
+    ds : xarray dataset loaded in memory,
+        or None if range requests are not supported or reading failed
+    """
+    if cache.enabled():
+        # Keep subset in download cache so that it can be reused by other runs
+        def _save(fname):
+            ds = _read_remote_subset(url, layername, year, bbox, date_start, date_end)
+            if ds is None:
+                raise ValueError("remote subset not available")
+            ds.to_netcdf(fname)
+
+        try:
+            fname, _ = cache.fetch_path(
+                _save, ".nc", source=url, bbox=bbox, date_start=date_start, date_end=date_end
+            )
+        except ValueError:
+            return None
+        with xarray.open_dataset(fname) as ds:
+            return ds.load()
+    return _read_remote_subset(url, layername, year, bbox, date_start, date_end)
+
+
+def _read_remote_subset(url, layername, year, bbox, date_start, date_end):
+    """
+    Read subset of remote netCDF file (see read_remote_subset).
+    """
+    if not supports_range_requests(url):
+        return None
+    try:
+        with spin(f"Reading {layername} for {year} (remote subset)") as s:
+            with xarray.open_dataset(url + "#mode=bytes", engine="netcdf4") as ds_remote:
+                ds = subset_dataset(ds_remote, bbox, date_start, date_end).load()
+            s(1)
+    except Exception as e:
+        utils.msg_warn(f"Remote subset of {layername} for {year} failed ({e}), downloading full file")
+        return None
+    return ds
+
+
 def get_silodict():
     """
     Get dictionary of available layers and meta data
@@ -129,51 +360,51 @@ def getdict_license():
     return dict
 
 
-def xarray2tif(ds, outfname, layername):
+def xarray2tif(ds, outfname, layername, max_memory_mb=256):
     """
     Convert rio xarray dataset to multi-band geotiff with each time as separate band.
 
-    TBD: optional: save separate tif each time slice
+    The (time, lat, lon) array of the layer is written directly to the bands of the GeoTIFF,
+    in blocks of bands that fit within max_memory_mb. The date of each band is set as band
+    description and as band tag 'long_name' (format 'YYYY-MM-DD').
 
     INPUT:
     ds : xarray dataset
     outfname : str
         path+name of output file (".tif")
+    layername : str
+        name of data variable in ds
+    max_memory_mb : float
+        maximum size of data read into memory at once (in MB)
 
     OUTPUT:
     tif : str, name of multi-band geotiff
     """
-
-    # create empty array
-    dsnew = xarray.Dataset()
-
-    for i in range(len(ds.time)):
-
-        # We will the date of the image to name the GeoTIFF
-        date = ds.isel(time=i).time.dt.strftime("%Y-%m-%d").data
-        # print(f'Writing {date}')
-
-        da = ds.isel(time=i)
-        attr = ds.attrs
-        dsnew[str(date)] = xarray.DataArray(
-            da.variables[layername][:],
-            dims=["lat", "lon"],
-            coords={"lat": da.variables["lat"], "lon": da.variables["lon"]},
-            name = str(date)     
-        )
-        dsnew[str(date)].attrs = {'long_name': str(date)}
-
-        # Write GeoTIFF with datacube libary for cloud optimized GeoTIFFs (COG)
-        # write_cog(geo_im=singletimestamp_da,
-        #         fname=os.path.join(outpath,f'{outfname_base}_{date}.tif',
-        #         overwrite=True)
-
-    
-    # Set crs
-    dsnew.rio.write_crs(4326, inplace=True)
-
-    # Write GeoTIFF to disk
-    dsnew.rio.to_raster(outfname)
+    da = ds[layername].transpose("time", "lat", "lon")
+    dates = [str(date) for date in ds.time.dt.strftime("%Y-%m-%d").values]
+    # Georeferencing from lat/lon coordinates (same as rioxarray)
+    transform = da.rio.set_spatial_dims(x_dim="lon", y_dim="lat").rio.transform()
+    ntimes, ny, nx = da.shape
+    profile = {
+        "dtype": da.dtype,
+        "count": ntimes,
+        "width": nx,
+        "height": ny,
+        "crs": "EPSG:4326",
+        "transform": transform,
+        "interleave": "band",
+    }
+    # Number of bands per block
+    nbands = max(1, int(max_memory_mb * 2**20 // (ny * nx * da.dtype.itemsize)))
+    with geotiff.open_raster(outfname, **profile) as dst:
+        for i in range(0, ntimes, nbands):
+            block = da.isel(time=slice(i, i + nbands)).values
+            dst.write(block, indexes=list(range(i + 1, i + 1 + len(block))))
+        for band, date in enumerate(dates, start=1):
+            dst.set_band_description(band, date)
+            dst.update_tags(band, long_name=date)
+    geotiff.finalize(outfname)
+    return outfname
 
 
 def get_SILO_layers(
@@ -185,6 +416,7 @@ def get_SILO_layers(
     format_out="tif",
     delete_tempfiles=False,
     verbose=False,
+    remote=True,
     ):
     """
     Get raster data from SILO for certain climate variable and save data as geotif.
@@ -201,6 +433,8 @@ def get_SILO_layers(
         bbox : list of bounding box coordinates (optional)
         format_out : str, format of output data: either 'NetCDF' (nc) or 'GeoTIFF' (tif)
         delete_tempfiles : bool, delete temporary files after processing
+        remote : bool, read only data within bbox and date range from server via
+            HTTP range requests (default True). Falls back to download of full files.
 
     Returns:
         fnames_out : list of output filenames
@@ -241,41 +475,71 @@ def get_SILO_layers(
     date_end = str(date_end)
     years = np.arange(int(date_start[:4]), int(date_end[:4]) + 1).tolist()
     fnames_out_silo = []
-    
-    for layername in layernames:
-
-        # run the download
-        fnames_out = get_SILO_raster(
-            layername, 
-            years, 
-            outpath_temp, 
-            bbox = bbox, 
-            format_out = 'nc', 
-            delete_temp = False)
-
-        # process the data into a single file and trim to date range
-        if (format_out == 'tif') | (format_out == 'GeoTIFF'):
-            outfname = os.path.join(outpath, "silo_" + layername + "_" + date_start + "-" + date_end + ".tif")
-        elif (format_out == 'NetCDF') | (format_out == 'nc'):
-            outfname = os.path.join(outpath, "silo_" + layername + "_" + date_start + "-" + date_end + ".nc")
-        else:
-            raise ValueError("format_out must be either 'tif' or 'nc'")
-
-        # Combine all years into one file and trim to date range
-        process_raster_daterange(fnames_out, date_start, date_end, outfname, layername)
-
-        # Delete temporary cropped files (not the downloaded file)
-        for fname in fnames_out:
-            os.remove(fname)
-    
-        #Save the layer name
-        # Check if outfname is list or string
-        if isinstance(outfname, list):
-            fnames_out_silo += outfname
-        else:
-            fnames_out_silo.append(outfname)
+
+    # All variables are processed concurrently and share the download, cpu and remote read workers
+    with ThreadPoolExecutor(max_workers=_config["download_workers"]) as download_pool, \
+            ThreadPoolExecutor(max_workers=_config["cpu_workers"]) as cpu_pool, \
+            ThreadPoolExecutor(max_workers=1) as remote_pool, \
+            ThreadPoolExecutor(max_workers=max(len(layernames), 1)) as layer_pool:
+        futures = [
+            layer_pool.submit(
+                _get_SILO_layer,
+                layername,
+                years,
+                outpath,
+                outpath_temp,
+                bbox,
+                format_out,
+                date_start,
+                date_end,
+                remote,
+                (download_pool, cpu_pool, remote_pool),
+            )
+            for layername in layernames
+        ]
+        # Results in order of layernames (re-raises any exception of a worker)
+        for future in futures:
+            fnames_out_silo.append(future.result())
 
     return fnames_out_silo
+
+
+def _get_SILO_layer(layername, years, outpath, outpath_temp, bbox, format_out, date_start, date_end, remote, pools):
+    """
+    Get SILO data for one climate variable and date range, combined into one file (see get_SILO_layers).
+
+    Returns:
+        outfname : str, output filename
+    """
+    # run the download
+    fnames_out = get_SILO_raster(
+        layername,
+        years,
+        outpath_temp,
+        bbox = bbox,
+        format_out = 'nc',
+        delete_temp = False,
+        date_start = date_start,
+        date_end = date_end,
+        remote = remote,
+        pools = pools)
+
+    # process the data into a single file and trim to date range
+    if (format_out == 'tif') | (format_out == 'GeoTIFF'):
+        outfname = os.path.join(outpath, "silo_" + layername + "_" + date_start + "-" + date_end + ".tif")
+    elif (format_out == 'NetCDF') | (format_out == 'nc'):
+        outfname = os.path.join(outpath, "silo_" + layername + "_" + date_start + "-" + date_end + ".nc")
+    else:
+        raise ValueError("format_out must be either 'tif' or 'nc'")
+
+    # Combine all years into one file and trim to date range
+    process_raster_daterange(fnames_out, date_start, date_end, outfname, layername)
+
+    # Delete temporary cropped files (not the downloaded file)
+    for fname in fnames_out:
+        os.remove(fname)
+
+    return outfname
     
 
 
@@ -318,6 +582,10 @@ def get_SILO_raster(
     format_out="nc",
     delete_temp=False,
     verbose=False,
+    date_start=None,
+    date_end=None,
+    remote=True,
+    pools=None,
     ):
     """
     Get raster data from SILO for certain climate variable and save data as geotif.
@@ -333,6 +601,20 @@ def get_SILO_raster(
         bbox : list of bounding box coordinates (optional)
         format_out : str, format of output data: either 'nc' (netCDF) or 'tif' (geotiff)
         delete_temp : bool, delete temporary folder after download
+        date_start : str, select only data from this date on, format 'YYYY-MM-DD' (optional)
+        date_end : str, select only data until this date, format 'YYYY-MM-DD' (optional)
+        remote : bool, if True and bbox is given, read only data within bbox and date range
+            via HTTP range requests instead of downloading the full annual file (default True).
+            Falls back to full download if the server does not support range requests.
+        pools : tuple of (download executor, cpu executor, remote executor), optional. Executors for
+            downloads, for cropping and writing of years and for remote subset reads, which can be shared
+            between calls (see get_SILO_layers). By default, new executors with the configured number
+            of workers are used (see configure), and one worker for remote reads.
+
+    Years are processed as a pipeline: the next years are downloaded while previous years
+    are cropped and written to disk. Remote subset reads run in a single worker, because the
+    netCDF library reads only one file at a time per process (global HDF5/netCDF lock), while
+    full file downloads of years without range request support run in the download workers.
 
     Returns:
         fnames_out : list of output filenames
@@ -410,31 +692,34 @@ def get_SILO_raster(
             print(f"see for more details: {url_info}")
             return False
 
-    # Silo base url
-    silo_baseurl = (
-        "https://s3-ap-southeast-2.amazonaws.com/silo-open-data/Official/annual/"
-    )
-
-    fnames_out = []
-    # Download data for each year and save as geotif
-    for year in years:
-        # Get url
-        url = silo_baseurl + layername + "/" + str(year) + "." + layername + ".nc"
-        # Download file
-        # print(f'Downloading data for year {year} from {url} ...')
-        filename = download_file(url, layername, year, outpath)
-
-        # Open file in Xarray
-        ds = xarray.open_dataset(filename)
-        # select data in bbox:
-        if bbox is not None:
-            ds = ds.sel(lon=slice(bbox[0], bbox[2]), lat=slice(bbox[1], bbox[3]))
-        # Save data
+    def _url(year):
+        return SILO_BASEURL + layername + "/" + str(year) + "." + layername + ".nc"
+
+    def _fetch_remote(year):
+        # Network stage: read only data in bbox from server (unless full file already downloaded),
+        # None if not available
+        url = _url(year)
+        if os.path.exists(os.path.join(outpath, url.split("/")[-1])):
+            return None
+        ds = read_remote_subset(url, layername, year, bbox, date_start, date_end)
+        return None if ds is None else (ds, None)
+
+    def _fetch(year):
+        # Network stage: download full file
+        return None, download_file(_url(year), layername, year, outpath)
+
+    def _crop(year, fetched):
+        # CPU stage: crop downloaded file and save data
+        ds, filename = fetched
+        if ds is None:
+            # Open file in Xarray
+            ds = xarray.open_dataset(filename)
+            # select data in bbox and date range:
+            ds = subset_dataset(ds, bbox, date_start, date_end)
         if (format_out == "nc") | (format_out == "NetCDF"):
             # Save netCDF file
             outfname = layername + "_" + str(year) + "_cropped.nc"
-            outfile = os.path.join(outpath, outfname)
-            ds.to_netcdf(outfile)
+            ds.to_netcdf(os.path.join(outpath, outfname))
         elif (format_out == "tif") | (format_out == "GeoTIFF"):
             # Save as multi-band geotiff file
             outfname = layername + "_" + str(year) + "_cropped.tif"
@@ -442,16 +727,52 @@ def get_SILO_raster(
         # Close file
         ds.close()
         # Remove file
-        if delete_temp:
+        if delete_temp and (filename is not None):
             os.remove(filename)
-        # print("Saved " + layername + " for year " + str(year) + " as geotif: ")
-        # print(os.path.join(outpath,outfname))
-        fnames_out.append(os.path.join(outpath, outfname))
-
-    # Convert netcdf to geotif
-    # nc_to_geotif(filename, outpath, layername, year)
-    # https://pratiman-91.github.io/2020/08/01/NetCDF-to-GeoTIFF-using-Python.html
-    return fnames_out
+        return os.path.join(outpath, outfname)
+
+    fetch_remote = _fetch_remote if (remote and (bbox is not None)) else None
+    if pools is None:
+        with ThreadPoolExecutor(max_workers=_config["download_workers"]) as download_pool, \
+                ThreadPoolExecutor(max_workers=_config["cpu_workers"]) as cpu_pool, \
+                ThreadPoolExecutor(max_workers=1) as remote_pool:
+            return _run_pipeline(years, _fetch, _crop, download_pool, cpu_pool, remote_pool, fetch_remote)
+    return _run_pipeline(years, _fetch, _crop, *pools, fetch_remote=fetch_remote)
+
+
+def _run_pipeline(items, fetch, process, download_pool, cpu_pool, remote_pool=None, fetch_remote=None):
+    """
+    Run fetch(item) in download_pool and process(item, result of fetch) in cpu_pool for all items,
+    each item is processed as soon as it is fetched so that downloads and processing overlap.
+
+    If fetch_remote is given, items are first fetched with fetch_remote(item) in remote_pool,
+    and only items for which fetch_remote returns None are fetched with fetch in download_pool.
+
+    Returns:
+        list of results of process in order of items
+    """
+    if fetch_remote is None:
+        pending = {download_pool.submit(fetch, item): (i, False) for i, item in enumerate(items)}
+    else:
+        pending = {remote_pool.submit(fetch_remote, item): (i, True) for i, item in enumerate(items)}
+    cpu_futures = [None] * len(items)
+    try:
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                i, is_remote = pending.pop(future)
+                result = future.result()
+                if is_remote and (result is None):
+                    # Remote read not available, download full file
+                    pending[download_pool.submit(fetch, items[i])] = (i, False)
+                else:
+                    cpu_futures[i] = cpu_pool.submit(process, items[i], result)
+        return [future.result() for future in cpu_futures]
+    except Exception:
+        # Do not start remaining downloads after an error
+        for future in pending:
+            future.cancel()
+        raise
 
 ### Test function ###
 
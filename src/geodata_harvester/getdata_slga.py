@@ -27,7 +27,7 @@ import os
 from owslib.wcs import WebCoverageService
 import rasterio
 from rasterio.plot import show
-from geodata_harvester import utils
+from geodata_harvester import utils, wcsclient
 from geodata_harvester.utils import spin
 
 # logger setup
@@ -201,22 +201,20 @@ def get_wcsmap(url, identifier, crs, bbox, resolution, outfname):
         return False
     else:
         with spin(f"Downloading {filename}") as s:
-            wcs = WebCoverageService(url, version="1.0.0")
-            # Get data
-            data = wcs.getCoverage(
-                identifier,
+            # Get data, large images are downloaded in tiles (see wcsclient.download_coverage)
+            wcsclient.download_coverage(
+                outfname,
+                url,
+                identifier=identifier,
                 format="GEOTIFF",
                 bbox=bbox,
                 crs=crs,
                 resx=resolution,
                 resy=resolution,
+                timeout=30,
             )
-            # timeout=30)
             s(1)
 
-        # Save data
-        with open(outfname, "wb") as f:
-            f.write(data.read())
         return True
 
 
@@ -9,7 +9,15 @@ The following main steps are automatically executed within the run() function:
     - save downloaded image files to disk as GeoTiffs
     - save summary table of downloaded files as CSV
     - extract data for point locations provided in input file (name specified in settings)
-    - save extracted point results to disk as CSV and as geopackage 
+    - save extracted point results to disk as CSV and as geopackage
+
+Data sources are downloaded concurrently (one worker thread per source) and their results
+are merged into the download log in a fixed source order. The number of concurrent sources
+can be limited with the setting `max_workers` (set to 1 to process sources one after another).
+
+Completed stages (downloads and temporal aggregations) are recorded in a checkpoint manifest
+in the output folder (see manifest.py). With run(path_to_config, resume=True), stages whose
+inputs and outputs are unchanged since the previous run are skipped.
 
 Example call within Python:
     from geodata_harvester import harvest
@@ -19,6 +27,7 @@ Example call within Python:
 
 import os
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import geopandas as gpd
 from termcolor import cprint
 import yaml
@@ -27,14 +36,21 @@ import argparse
 import numpy as np
 from datetime import datetime, timedelta
 from geodata_harvester.widgets import harvesterwidgets as hw
-from geodata_harvester.utils import init_logtable, update_logtable
+from geodata_harvester.utils import update_logtable
 from geodata_harvester import (getdata_dea, getdata_dem,  getdata_landscape,
                                getdata_radiometric, getdata_silo, getdata_slga,
-                               utils, temporal)
+                               utils, temporal, wcsclient, cache, geotiff,
+                               datacube, terrain)
+from geodata_harvester.manifest import Manifest
+from geodata_harvester.logtable import LogTable, LOG_DB_NAME
 from eeharvest import harvester as eeharvester
 
 
-def run(path_to_config, log_name="download_summary", preview=False, return_df=False):
+# Fixed order in which data sources are merged into the download log
+SOURCE_ORDER = ["GEE", "DEA", "DEM", "Landscape", "Radiometric", "SILO", "SLGA"]
+
+
+def run(path_to_config, log_name="download_summary", preview=False, return_df=False, resume=False):
     """
     A headless version of the Data-Harvester (with some limitations).
     Results are saved to disk.
@@ -48,6 +64,9 @@ def run(path_to_config, log_name="download_summary", preview=False, return_df=Fa
         Plots a matrix of downloaded images if set to True, by default False
     return_df : bool, optional (Default: False)
         if True, returns dataframe with results
+    resume : bool, optional (Default: False)
+        if True, skip all stages that were completed in a previous run with unchanged inputs
+        and outputs (as recorded in the manifest file in the output folder)
 
     Returns
     -------
@@ -59,6 +78,45 @@ def run(path_to_config, log_name="download_summary", preview=False, return_df=Fa
     # Load config file (based on notebook for now, will optimise later)
     settings = hw.load_settings(path_to_config)
 
+    # Store WCS capabilities on disk to reuse them between runs (optional)
+    if getattr(settings, "wcs_cache_dir", None) is not None:
+        wcsclient.configure(cache_dir=settings.wcs_cache_dir)
+    # Limit number of concurrent requests per server (optional)
+    if getattr(settings, "max_connections", None) is not None:
+        wcsclient.configure(max_connections=settings.max_connections)
+    # Reuse downloaded files between runs and output folders (optional)
+    if getattr(settings, "cache_dir", None) is not None:
+        cache.configure(cache_dir=settings.cache_dir)
+    if getattr(settings, "cache_max_size_gb", None) is not None:
+        cache.configure(max_size_gb=settings.cache_max_size_gb)
+    # Timeout, retries and number of concurrent downloads and crop tasks for SILO (optional)
+    getdata_silo.configure(
+        timeout=getattr(settings, "download_timeout", None),
+        retries=getattr(settings, "download_retries", None),
+        download_workers=getattr(settings, "silo_download_workers", None),
+        cpu_workers=getattr(settings, "silo_cpu_workers", None),
+    )
+    # Layout of output GeoTIFFs: COG, compression, block size and overviews (optional)
+    geotiff.configure(
+        cog=getattr(settings, "output_cog", None),
+        compress=getattr(settings, "output_compress", None),
+        blocksize=getattr(settings, "output_blocksize", None),
+        overviews=getattr(settings, "output_overviews", None),
+    )
+    # Zarr datacube output of time stacks, chunking and compression (optional)
+    if getattr(settings, "output_zarr", False) and not datacube.available():
+        utils.msg_warn("output_zarr requires the package zarr (pip install zarr), no Zarr stores are written")
+    datacube.configure(
+        chunks=getattr(settings, "zarr_chunks", None),
+        compressor=getattr(settings, "zarr_compressor", None),
+        level=getattr(settings, "zarr_compress_level", None),
+    )
+    # Block-wise terrain layers of DEM: output data type and number of workers (optional)
+    terrain.configure(
+        dtype=getattr(settings, "terrain_dtype", None),
+        workers=getattr(settings, "terrain_workers", None),
+    )
+
     # Count number of sources to download from
     count_sources = len(settings.target_sources)
     list_sources = list(settings.target_sources.keys())
@@ -103,7 +161,7 @@ def run(path_to_config, log_name="download_summary", preview=False, return_df=Fa
 
     # Temporal range
     # convert date strings to datetime objects
-    date_diff = (datetime.strptime(settings.date_max, "%Y-%m-%d") 
+    date_diff = (datetime.strptime(settings.date_max, "%Y-%m-%d")
         - datetime.strptime(settings.date_min, "%Y-%m-%d")).days
     if settings.time_intervals is not None:
         period_days = date_diff // settings.time_intervals
@@ -112,8 +170,8 @@ def run(path_to_config, log_name="download_summary", preview=False, return_df=Fa
     else:
         period_days = None
 
-    # Create download log
-    download_log = init_logtable()
+    # Create download log (SQLite database in output folder, exported at the end of the run)
+    download_log = LogTable(os.path.join(settings.outpath, LOG_DB_NAME))
     # process each data source
     utils.msg_info(
         f"Found the following {count_sources} sources: {list_sources}")
@@ -121,75 +179,277 @@ def run(path_to_config, log_name="download_summary", preview=False, return_df=Fa
 
     # GEE
     if "GEE" in list_sources:
-        # Try to initialise API if Earth Engine is selected
+        # Try to initialise API if Earth Engine is selected.
+        # This is done before starting any worker since it may require user authentication.
         try:
             eeharvester.initialise()
         except:
             eeharvester.initialise(auth_mode = 'notebook')
 
-        cprint("\n⌛ Downloading Google Earth Engine data...", attrs=["bold"])
-        # get data from GEE with eeharvest
-        #gee = eeharvester.collect(config=path_to_config)
-        #gee.preprocess()
-        #gee.download()
-        # use auto function to download and preprocess
+    # Download and process all sources, then add results to log table in fixed source order
+    max_workers = getattr(settings, "max_workers", None)
+    manifest = Manifest(settings.outpath, resume=resume)
+    results = run_sources(settings, path_to_config, period_days, max_workers=max_workers, manifest=manifest)
+    for source in SOURCE_ORDER:
+        for log_entry in results.get(source, []):
+            download_log = update_logtable(download_log, settings=settings, **log_entry)
 
-        if period_days is None:
-            """
-            If no time intervals are specified and reduce is not set, download all datasets.
-            If no time intervals are specified, but reduce is set, 
-            download the temporal reduced (aggregated) set over the entire time range.
-            """
-            gee_outpath = os.path.join(settings.outpath,'ee')
-            gee = eeharvester.auto(config=path_to_config, outpath=gee_outpath)
-            # add settings.outpath to all entries in list of gee.filenames
-            # if gee.filenames is a list of strings
-            if not isinstance(gee.filenames, list):
-                # convert to list
-                gee.filenames = [gee.filenames]
-            # get list of filenames in the directory
-            gee_filenames = []
-            # Walk through the directory and its subdirectories to find full paths
-            for root, _, files in os.walk(gee_outpath):
-                for file in files:
-                    if file in gee.filenames:
-                        # Join the root and file to get the full path
-                        file_path = os.path.join(root, file)
-                        gee_filenames.append(file_path)
-            outfnames =  gee_filenames 
-            agg_list = [None] * len(outfnames)
-            layernames = [Path(filename).resolve().stem for filename in gee_filenames]
-            layer_titles = layernames
+    # save log to file
+    download_log.to_csv(os.path.join(settings.outpath, log_name + ".csv"))
+    download_log.to_csv(os.path.join(settings.outpath, "df_log.csv"))
+
+    # extract filename from settings.infile
+    # Select all processed data
+    df_sel = download_log.to_dataframe()
+    download_log.close()
+    rasters = df_sel["filename_out"].values.tolist()
+    titles = df_sel["layertitle"].values.tolist()
+    # Warp all layers onto one common grid defined by target_bbox and target_res (optional)
+    if getattr(settings, "align_grid", False):
+        cprint("\nAligning layers to common grid -----", "magenta", attrs=["bold"])
+        grid = utils.target_grid(settings.target_bbox, settings.target_res / 3600)
+        # each layer is a stage, so that layers aligned in a previous run are skipped if resuming
+        rasters = [
+            _stage(
+                manifest,
+                f"align/{raster}",
+                lambda raster=raster: utils.align_rasters(
+                    [raster],
+                    os.path.join(settings.outpath, "aligned"),
+                    grid,
+                    num_threads=getattr(settings, "warp_threads", None) or "ALL_CPUS",
+                    warp_mem_limit=getattr(settings, "warp_mem_limit", None) or 512,
+                    root=settings.outpath,
+                )[0],
+                inputs=dict(bbox=settings.target_bbox, res=settings.target_res),
+                input_files=[raster],
+                outputs=lambda fname: [fname],
+            )
+            for raster in rasters
+        ]
+        utils.msg_success(f"{len(rasters)} layers aligned to grid of {grid['width']} x {grid['height']} pixels")
+    if points_available:
+        fn = Path(settings.infile).resolve().name
+        cprint(
+            f"\nExtracting data points for {fn}  -----", "magenta", attrs=["bold"])
+        # Extract datatable from rasters given input coordinates
+        # gdf = utils.raster_query(longs, lats, rasters, titles) # old slower version
+        gdf = utils.extract_values_from_rasters(coords, rasters)
+        # Save as geopackage
+        gdf.to_file(os.path.join(settings.outpath,
+                    "results.gpkg"), driver="GPKG")
+        # Save the results table to a csv as well
+        gdf.drop("geometry", axis=1).to_csv(
+            os.path.join(settings.outpath, "results.csv"), index=True, mode="w"
+        )
+        utils.msg_success(
+            f"Data points extracted to {settings.outpath}results.gpkg")
+
+    if preview and points_available:
+        utils.plot_rasters(rasters, longs, lats, titles)
+    elif preview and not points_available:
+        utils.plot_rasters(rasters, titles=titles)
+
+    cprint("\n🎉 🎉 🎉 Harvest complete 🎉 🎉 🎉", "magenta", attrs=["bold"])
+
+    if return_df and points_available:
+        return gdf
+    else:
+        return None
+
+
+def run_sources(settings, path_to_config, period_days, max_workers=None, manifest=None):
+    """
+    Download and process all data sources in settings.target_sources.
+
+    Each source is processed by its own worker thread, so that the total run time
+    is approximately given by the slowest source.
+
+    Parameters
+    ----------
+    settings : settings namespace
+    path_to_config : str
+        Path to YAML config file (required for GEE)
+    period_days : int or None
+        number of days per temporal aggregation interval
+    max_workers : int, optional
+        maximum number of sources processed at the same time.
+        If None (Default), all sources are processed concurrently.
+        If 1, sources are processed sequentially in SOURCE_ORDER.
+    manifest : Manifest, optional
+        checkpoint manifest of run, each source is recorded as a stage
+
+    Returns
+    -------
+    results : dict
+        for each source a list of log entries (keyword arguments for update_logtable)
+    """
+    harvesters = {
+        "GEE": harvest_gee,
+        "DEA": harvest_dea,
+        "DEM": harvest_dem,
+        "Landscape": harvest_landscape,
+        "Radiometric": harvest_radiometric,
+        "SILO": harvest_silo,
+        "SLGA": harvest_slga,
+    }
+    sources = [source for source in SOURCE_ORDER if source in settings.target_sources]
+    if max_workers is None:
+        max_workers = len(sources)
+    max_workers = max(1, min(int(max_workers), max(len(sources), 1)))
+
+    def _harvest(source):
+        if manifest is None:
+            return harvesters[source](settings, path_to_config, period_days)
+        return manifest.run_stage(
+            source,
+            lambda: harvesters[source](settings, path_to_config, period_days, manifest=manifest),
+            inputs=_source_inputs(settings, source, period_days),
+            outputs=_log_filenames,
+        )
+
+    results = {}
+    if max_workers == 1:
+        for source in sources:
+            results[source] = _harvest(source)
+        return results
+
+    utils.msg_info(f"Processing {len(sources)} sources with {max_workers} workers")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {source: executor.submit(_harvest, source) for source in sources}
+    # Collect results in fixed order (re-raises any exception of a worker)
+    for source in sources:
+        results[source] = futures[source].result()
+    return results
+
+
+def _source_inputs(settings, source, period_days):
+    """
+    Return settings that determine the results of a data source (inputs of manifest stage).
+    """
+    return dict(
+        source=source,
+        settings=settings.target_sources[source],
+        bbox=settings.target_bbox,
+        res=settings.target_res,
+        date_min=settings.date_min,
+        date_max=settings.date_max,
+        period_days=period_days,
+        outpath=settings.outpath,
+    )
+
+
+def _log_filenames(log_entries):
+    """
+    Return all filenames of list of log entries (outputs of manifest stage).
+    """
+    return [fname for entry in log_entries for fname in entry.get("filenames", [])]
+
+
+def _stage(manifest, name, func, **kwargs):
+    """
+    Run func as stage of manifest (see Manifest.run_stage), or directly if manifest is None.
+    """
+    if manifest is None:
+        return func()
+    return manifest.run_stage(name, func, **kwargs)
+
+
+def _write_datacube(settings, source, layername, files, agg=None, period_days=None):
+    """
+    Write time stack of layer to Zarr store of source, if enabled with setting output_zarr.
+
+    files is either a list of GeoTIFFs with one time step each (date after last underscore of
+    file name) or a multi-band GeoTIFF with one band per time step (date as band description).
+    """
+    if not getattr(settings, "output_zarr", False) or not datacube.available():
+        return None
+    store = datacube.store_path(settings.outpath, source)
+    attrs = dict(source=source, layer=layername, aggregation=agg, period_days=period_days)
+    try:
+        if isinstance(files, str):
+            datacube.write_multiband(files, store, layername, layername, attrs=attrs)
         else:
-            # run data extraction for each time interval
-            date_start_list = [datetime.strptime(settings.date_min, "%Y-%m-%d") + 
-            timedelta(days=i*period_days) for i in range(settings.time_intervals)]
-            date_end_list = [datetime.strptime(settings.date_min, "%Y-%m-%d") + 
-            timedelta(days=i*period_days) for i in range(1, settings.time_intervals+1)]
-            # clip end date to date_max
-            date_end_list[-1] = min(date_end_list[-1], datetime.strptime(settings.date_max, "%Y-%m-%d"))
-
-            if settings.target_sources['GEE']['preprocess']['reduce'] is None:
-                agg_type = "median"
-            else:
-                agg_type = settings.target_sources['GEE']['preprocess']['reduce']
-            # Check if agg_type is a list
-            if isinstance(agg_type, list):
-                agg_type = agg_type[0]
-
-            # run eeharvest extraction for each time interval
-            outfnames = []
-            layernames = []
-            agg_list = []
-            layer_titles = []
-            for i in range(settings.time_intervals):
+            datacube.write_files(files, store, layername, layername, attrs=attrs)
+        utils.msg_success(f"{source} {layername} time stack saved in {store}")
+    except Exception as e:
+        utils.msg_warn(f"Could not write {layername} to {store}: {e}")
+    return store
+
+
+def harvest_gee(settings, path_to_config, period_days, manifest=None):
+    """
+    Download and process Google Earth Engine data with eeharvest.
+
+    Returns
+    -------
+    list of log entries (keyword arguments for update_logtable)
+    """
+    cprint("\n⌛ Downloading Google Earth Engine data...", attrs=["bold"])
+    # get data from GEE with eeharvest
+    #gee = eeharvester.collect(config=path_to_config)
+    #gee.preprocess()
+    #gee.download()
+    # use auto function to download and preprocess
+
+    if period_days is None:
+        """
+        If no time intervals are specified and reduce is not set, download all datasets.
+        If no time intervals are specified, but reduce is set,
+        download the temporal reduced (aggregated) set over the entire time range.
+        """
+        gee_outpath = os.path.join(settings.outpath,'ee')
+        gee = eeharvester.auto(config=path_to_config, outpath=gee_outpath)
+        # add settings.outpath to all entries in list of gee.filenames
+        # if gee.filenames is a list of strings
+        if not isinstance(gee.filenames, list):
+            # convert to list
+            gee.filenames = [gee.filenames]
+        # get list of filenames in the directory
+        gee_filenames = []
+        # Walk through the directory and its subdirectories to find full paths
+        for root, _, files in os.walk(gee_outpath):
+            for file in files:
+                if file in gee.filenames:
+                    # Join the root and file to get the full path
+                    file_path = os.path.join(root, file)
+                    gee_filenames.append(file_path)
+        outfnames =  gee_filenames
+        agg_list = [None] * len(outfnames)
+        layernames = [Path(filename).resolve().stem for filename in gee_filenames]
+        layer_titles = layernames
+    else:
+        # run data extraction for each time interval
+        date_start_list = [datetime.strptime(settings.date_min, "%Y-%m-%d") +
+        timedelta(days=i*period_days) for i in range(settings.time_intervals)]
+        date_end_list = [datetime.strptime(settings.date_min, "%Y-%m-%d") +
+        timedelta(days=i*period_days) for i in range(1, settings.time_intervals+1)]
+        # clip end date to date_max
+        date_end_list[-1] = min(date_end_list[-1], datetime.strptime(settings.date_max, "%Y-%m-%d"))
+
+        if settings.target_sources['GEE']['preprocess']['reduce'] is None:
+            agg_type = "median"
+        else:
+            agg_type = settings.target_sources['GEE']['preprocess']['reduce']
+        # Check if agg_type is a list
+        if isinstance(agg_type, list):
+            agg_type = agg_type[0]
+
+        # run eeharvest extraction for each time interval
+        outfnames = []
+        layernames = []
+        agg_list = []
+        layer_titles = []
+        for i in range(settings.time_intervals):
+
+            def _harvest_interval(i=i):
                 # update settings.date_min and settings.date_max in config file
                 # make temporary copy of config file
                 tmp_config = path_to_config.replace(".yaml", "_tmp.yaml")
                 shutil.copy(path_to_config, tmp_config)
                 # update config file
                 with open(tmp_config, "r") as f:
-                    config = yaml.load(f, Loader=yaml.SafeLoader)   
+                    config = yaml.load(f, Loader=yaml.SafeLoader)
                 config['date_min'] = date_start_list[i].date() #.strftime("%Y-%m-%d") # can't be string since eeharvest can't strings
                 config['date_max'] = date_end_list[i].date() #.strftime("%Y-%m-%d")
                 if config['target_sources']['GEE']['preprocess']['reduce'] is None:
@@ -203,7 +463,7 @@ def run(path_to_config, log_name="download_summary", preview=False, return_df=Fa
                     gee = eeharvester.auto(config=tmp_config, outpath=gee_outpath)
                 except Exception as e:
                     print(e)
-                    continue
+                    return None
                 if not isinstance(gee.filenames, list):
                     # convert to list
                     gee.filenames = [gee.filenames]
@@ -215,41 +475,74 @@ def run(path_to_config, log_name="download_summary", preview=False, return_df=Fa
                             # Join the root and file to get the full path
                             file_path = os.path.join(root, file)
                             gee_filenames.append(file_path)
-                layers = [Path(filename).resolve().stem for filename in gee_filenames]
-                outfnames += gee_filenames
-                layernames += layers
-                agg_list += [agg_type] * len(gee_filenames)
-                layer_titles += [layer + "_" + agg_type + "_" + date_start_list[i].strftime("%Y-%m-%d") + 
-                "-to-" + date_end_list[i].strftime("%Y-%m-%d") for layer in layers]
-                
                 # remove temporary config file
                 os.remove(tmp_config)
-
-        if len(outfnames) > 0:
-            # rename outfname files to layer_titles + .tif
-            for i in range(len(outfnames)):
-                os.rename(outfnames[i], os.path.join(os.path.dirname(outfnames[i]), layer_titles[i] + ".tif"))
-                outfnames[i] = os.path.join(os.path.dirname(outfnames[i]), layer_titles[i] + ".tif")
-
-            download_log = update_logtable(
-                download_log,
-                outfnames,
-                layernames,
-                "GEE",
-                settings,
-                layertitles=layer_titles,
-                agfunctions=agg_list,
-                loginfos="downloaded",
+                # rename files to layer title + .tif, so that the next interval does not overwrite them
+                layers = []
+                for filename in gee_filenames:
+                    layer = Path(filename).resolve().stem
+                    layer_title = (layer + "_" + agg_type + "_" + date_start_list[i].strftime("%Y-%m-%d") +
+                    "-to-" + date_end_list[i].strftime("%Y-%m-%d"))
+                    outfname = os.path.join(os.path.dirname(filename), layer_title + ".tif")
+                    os.rename(filename, outfname)
+                    layers.append([layer, layer_title, outfname])
+                return layers
+
+            # intervals that were downloaded in a previous run are skipped if resuming
+            layers = _stage(
+                manifest,
+                f"GEE/interval_{i}",
+                _harvest_interval,
+                inputs=dict(
+                    _source_inputs(settings, "GEE", period_days),
+                    date_start=date_start_list[i].strftime("%Y-%m-%d"),
+                    date_end=date_end_list[i].strftime("%Y-%m-%d"),
+                ),
+                outputs=lambda layers: [outfname for _, _, outfname in layers or []],
             )
+            if layers is None:
+                continue
+            layernames += [layer for layer, _, _ in layers]
+            layer_titles += [layer_title for _, layer_title, _ in layers]
+            outfnames += [outfname for _, _, outfname in layers]
+            agg_list += [agg_type] * len(layers)
+
+    if len(outfnames) == 0:
+        return []
+
+    if period_days is None:
+        # rename outfname files to layer_titles + .tif
+        for i in range(len(outfnames)):
+            os.rename(outfnames[i], os.path.join(os.path.dirname(outfnames[i]), layer_titles[i] + ".tif"))
+            outfnames[i] = os.path.join(os.path.dirname(outfnames[i]), layer_titles[i] + ".tif")
+
+    return [dict(
+        filenames=outfnames,
+        layernames=layernames,
+        datasource="GEE",
+        layertitles=layer_titles,
+        agfunctions=agg_list,
+        loginfos="downloaded",
+    )]
+
+
+def harvest_dea(settings, path_to_config, period_days, manifest=None):
+    """
+    Download and temporally aggregate DEA data.
 
-    # DEA
-    if "DEA" in list_sources:
-        cprint("\n⌛ Downloading DEA data...", attrs=["bold"])
-        # get data from DEA
-        dea_layernames = settings.target_sources["DEA"]
-        outpath_dea = os.path.join(settings.outpath, "dea")
-        # put into subdirectory
-        files_dea = getdata_dea.get_dea_layers_daterange(
+    Returns
+    -------
+    list of log entries (keyword arguments for update_logtable)
+    """
+    cprint("\n⌛ Downloading DEA data...", attrs=["bold"])
+    # get data from DEA
+    dea_layernames = settings.target_sources["DEA"]
+    outpath_dea = os.path.join(settings.outpath, "dea")
+    # put into subdirectory
+    files_dea = _stage(
+        manifest,
+        "DEA/download",
+        lambda: getdata_dea.get_dea_layers_daterange(
             dea_layernames,
             settings.date_min,
             settings.date_max,
@@ -258,309 +551,322 @@ def run(path_to_config, log_name="download_summary", preview=False, return_df=Fa
             outpath_dea,
             crs="EPSG:4326",
             format_out="GeoTIFF",
-        )
-        if period_days is not None:
-            # aggregate temporal data
-            outfname_dea_list = []
-            layer_list = []
-            layer_titles = []
-            agg_list = []
-            for layername in dea_layernames:
-                # get files for layername 
-                #files_layer = [os.path.basename(x) for x in files_dea if layername in x]
-                files_layer = [x for x in files_dea if layername in x]
-
-                # Check if there are multiple files for the same layer, 
-                # if not assume no temporal aggregation and skip loop
-                if len(files_layer) == 1:
-                    outfname_dea_list += files_layer
-                    layer_titles += [layername]
-                    layer_list += [layername]
-                    agg_list += ['None']
-                    continue
-
-                xdr = temporal.multiband_raster_to_xarray(files_layer)
-
-                # replace values with nan_value with nan so that aggregation works properly
-                nan_value = xdr.attrs["_FillValue"]
-                xdr = xdr.where(xdr != nan_value, np.nan)
-                # Check other missing values (DEA)
-                nan_dea = -999.
-                xdr = xdr.where(xdr > nan_dea, np.nan)
-
-                """
-                Aggregate over temporal period by using median along the time dimension.
-                Note that some DEA layers may have quality flags but these are not applied here because it is layer-specific.
-                """
-                outfname_list, agg_list = temporal.aggregate_temporal(
-                    xdr,
-                    period=period_days, 
-                    agg=["median"], 
-                    outfile=os.path.join(settings.outpath,f"DEA_{layername}"), 
-                    buffer = None)
-                outfname_dea_list += outfname_list
-
-                # create layer titles with proper date range format
-                for filename in outfname_list:
-                    # get date from filename without extension
-                    date_start = os.path.splitext(os.path.basename(filename).rsplit('_')[-1])[0]
-                    # convert date string YYYY-MM-D to datetime object
-                    date_start = datetime.strptime(date_start, "%Y-%m-%d")
-                    date_end = date_start + timedelta(days=period_days)
-                    date_str = date_start.strftime("%Y-%m-%d") + "-to-" + date_end.strftime("%Y-%m-%d")
-                    new_name = "DEA_" + layername + "_median_" + date_str
-                    layer_titles += [new_name]
-                layer_list += [layername]*len(outfname_list)
-            agg_list = ['median']*len(layer_titles)
-        else:
-            outfname_dea_list = files_dea
-            # get string dea_layernames from filenames in files_dea
-            layer_list = []
-            for fname in files_dea:
-                for layername in dea_layernames:
-                    if layername in fname:
-                        layer_list.append(layername)
-                        break
-            layer_titles = [os.path.basename(path).rsplit('.')[0] for path in files_dea]
-            agg_list = ['None']*len(layer_titles)
-
-        # Update download log table
-        download_log = update_logtable(
-            download_log,
-            outfname_dea_list,
-            layer_list,
-            'DEA',
-            settings,
-            layertitles=layer_titles,
-            agfunctions = agg_list,
-            loginfos='downloaded'
-        )
+        ),
+        inputs=_source_inputs(settings, "DEA", period_days),
+        outputs=lambda files: files,
+    )
+    if period_days is not None:
+        # aggregate temporal data
+        outfname_dea_list = []
+        layer_list = []
+        layer_titles = []
+        agg_list = []
+        for layername in dea_layernames:
+            # get files for layername
+            #files_layer = [os.path.basename(x) for x in files_dea if layername in x]
+            files_layer = [x for x in files_dea if layername in x]
+
+            # Check if there are multiple files for the same layer,
+            # if not assume no temporal aggregation and skip loop
+            if len(files_layer) == 1:
+                outfname_dea_list += files_layer
+                layer_titles += [layername]
+                layer_list += [layername]
+                agg_list += ['None']
+                continue
+
+            # values with _FillValue (fill_nan) and other missing values (DEA, nodata_max)
+            # are replaced with nan during aggregation so that aggregation works properly
+            nan_dea = -999.
 
-    # DEM
-    if "DEM" in list_sources:
-        cprint("\n⌛ Downloading DEM data...", attrs=["bold"])
-        dem_layernames = settings.target_sources["DEM"]
-        try:
-            files_dem = getdata_dem.get_dem_layers(
-                dem_layernames,
-                settings.outpath,
-                settings.target_bbox,
-                settings.target_res,
+            """
+            Aggregate over temporal period by using median along the time dimension.
+            Note that some DEA layers may have quality flags but these are not applied here because it is layer-specific.
+            """
+            outfname_list, agg_list = _stage(
+                manifest,
+                f"DEA/aggregate/{layername}",
+                lambda files_layer=files_layer, layername=layername: temporal.aggregate_temporal(
+                    temporal.multiband_raster_to_xarray(files_layer),
+                    period=period_days,
+                    agg=["median"],
+                    outfile=os.path.join(settings.outpath,f"DEA_{layername}"),
+                    buffer = None,
+                    nodata_max = nan_dea),
+                inputs=dict(period=period_days, agg="median", outpath=settings.outpath),
+                input_files=files_layer,
+                outputs=lambda result: result[0],
             )
-        except Exception as e:
-            print(e)
-        # Check if output if False (no data available) and skip if so
-        if (files_dem == [False]) or files_dem is None:
-            pass
-        else:
-            # Add extracted data to log dataframe
-            download_log = update_logtable(
-                download_log,
-                files_dem,
-                dem_layernames,
-                'DEM',
-                settings,
-                layertitles=dem_layernames,
-                loginfos='downloaded')
-
-    if "Landscape" in list_sources:
-        cprint("\n⌛ Downloading Landscape data...", attrs=["bold"])
-        # get data from Landscape
-        layernames = settings.target_sources["Landscape"]
-        layertitles = ["landscape_" + layername for layername in layernames]
-
-        files_ls = getdata_landscape.get_landscape_layers(
-            layernames,
-            settings.target_bbox,
+            outfname_dea_list += outfname_list
+            _write_datacube(settings, "DEA", layername, outfname_list, agg="median", period_days=period_days)
+
+            # create layer titles with proper date range format
+            for filename in outfname_list:
+                # get date from filename without extension
+                date_start = os.path.splitext(os.path.basename(filename).rsplit('_')[-1])[0]
+                # convert date string YYYY-MM-D to datetime object
+                date_start = datetime.strptime(date_start, "%Y-%m-%d")
+                date_end = date_start + timedelta(days=period_days)
+                date_str = date_start.strftime("%Y-%m-%d") + "-to-" + date_end.strftime("%Y-%m-%d")
+                new_name = "DEA_" + layername + "_median_" + date_str
+                layer_titles += [new_name]
+            layer_list += [layername]*len(outfname_list)
+        agg_list = ['median']*len(layer_titles)
+    else:
+        outfname_dea_list = files_dea
+        # get string dea_layernames from filenames in files_dea
+        layer_list = []
+        for fname in files_dea:
+            for layername in dea_layernames:
+                if layername in fname:
+                    layer_list.append(layername)
+                    break
+        layer_titles = [os.path.basename(path).rsplit('.')[0] for path in files_dea]
+        agg_list = ['None']*len(layer_titles)
+        for layername in dea_layernames:
+            files_layer = [path for path, layer in zip(files_dea, layer_list) if layer == layername]
+            if len(files_layer) > 1:
+                _write_datacube(settings, "DEA", layername, files_layer)
+
+    return [dict(
+        filenames=outfname_dea_list,
+        layernames=layer_list,
+        datasource='DEA',
+        layertitles=layer_titles,
+        agfunctions = agg_list,
+        loginfos='downloaded'
+    )]
+
+
+def harvest_dem(settings, path_to_config, period_days, manifest=None):
+    """
+    Download DEM data and calculate derived terrain layers.
+
+    Returns
+    -------
+    list of log entries (keyword arguments for update_logtable)
+    """
+    cprint("\n⌛ Downloading DEM data...", attrs=["bold"])
+    dem_layernames = settings.target_sources["DEM"]
+    files_dem = None
+    try:
+        files_dem = getdata_dem.get_dem_layers(
+            dem_layernames,
             settings.outpath,
-            resolution=settings.target_res,
+            settings.target_bbox,
+            settings.target_res,
         )
-        # Add extracted data to log dataframe
-        download_log = update_logtable(
-            download_log,
-            files_ls,
+    except Exception as e:
+        print(e)
+    if files_dem is None:
+        return []
+    # Output files of recognised layer names, skip layers without output (no data available)
+    layernames = [name for name in dem_layernames if name == "DEM" or name in getdata_dem.TERRAIN_LAYERS]
+    layers = [(fname, name) for fname, name in zip(files_dem, layernames) if fname]
+    if not layers:
+        return []
+    # Add extracted data to log dataframe
+    return [dict(
+        filenames=[fname for fname, _ in layers],
+        layernames=[name for _, name in layers],
+        datasource='DEM',
+        layertitles=[name for _, name in layers],
+        loginfos='downloaded')]
+
+
+def harvest_landscape(settings, path_to_config, period_days, manifest=None):
+    """
+    Download Landscape data.
+
+    Returns
+    -------
+    list of log entries (keyword arguments for update_logtable)
+    """
+    cprint("\n⌛ Downloading Landscape data...", attrs=["bold"])
+    # get data from Landscape
+    layernames = settings.target_sources["Landscape"]
+    layertitles = ["landscape_" + layername for layername in layernames]
+
+    files_ls = getdata_landscape.get_landscape_layers(
+        layernames,
+        settings.target_bbox,
+        settings.outpath,
+        resolution=settings.target_res,
+    )
+    # Add extracted data to log dataframe
+    return [dict(
+        filenames=files_ls,
+        layernames=layernames,
+        datasource="Landscape",
+        layertitles=layertitles,
+        loginfos="downloaded",
+    )]
+
+
+def harvest_radiometric(settings, path_to_config, period_days, manifest=None):
+    """
+    Download Radiometric data.
+
+    Returns
+    -------
+    list of log entries (keyword arguments for update_logtable)
+    """
+    cprint("\n⌛ Downloading Radiometric data...", attrs=["bold"])
+    # get data from Radiometric
+    # Download radiometrics
+    layernames = settings.target_sources["Radiometric"]
+    try:
+        files_rd = getdata_radiometric.get_radiometric_layers(
+            settings.outpath,
             layernames,
-            "Landscape",
-            settings,
-            layertitles=layertitles,
-            loginfos="downloaded",
+            bbox=settings.target_bbox,
+            resolution=settings.target_res,
         )
-    if "Radiometric" in list_sources:
-        cprint("\n⌛ Downloading Radiometric data...", attrs=["bold"])
-        # get data from Radiometric
-        # Download radiometrics
-        layernames = settings.target_sources["Radiometric"]
-        try:
-            files_rd = getdata_radiometric.get_radiometric_layers(
-                settings.outpath,
-                layernames,
-                bbox=settings.target_bbox,
-                resolution=settings.target_res,
-            )
-        except Exception as e:
-            print(e)
-        var_exists = "files_rd" in locals() or "files_rd" in globals()
-        if var_exists:
-            # Add extracted data to log dataframe
-            download_log = update_logtable(
-                download_log,
-                files_rd,
-                layernames,
-                "Radiometric",
-                settings,
-                layertitles=layernames,
-                loginfos="downloaded",
-            )
-        else:
-            pass
-    if "SILO" in list_sources:
-        cprint("\n⌛ Downloading SILO data.\
-            This will take a couple of minutes, depending on your internet speed...", attrs=["bold"])
-        # get data from SILO
-        fnames_out_silo = []
-        silo_layernames = list(settings.target_sources["SILO"].keys())
-        # print(silo_layernames)
-        try:
-            # run the download
-            files_silo = os.path.join(settings.outpath, "silo")
-            fnames_out = getdata_silo.get_SILO_layers(
+    except Exception as e:
+        print(e)
+        return []
+    # Add extracted data to log dataframe
+    return [dict(
+        filenames=files_rd,
+        layernames=layernames,
+        datasource="Radiometric",
+        layertitles=layernames,
+        loginfos="downloaded",
+    )]
+
+
+def harvest_silo(settings, path_to_config, period_days, manifest=None):
+    """
+    Download and temporally aggregate SILO data.
+
+    Returns
+    -------
+    list of log entries (keyword arguments for update_logtable)
+    """
+    cprint("\n⌛ Downloading SILO data.\
+        This will take a couple of minutes, depending on your internet speed...", attrs=["bold"])
+    # get data from SILO
+    fnames_out_silo = []
+    silo_layernames = list(settings.target_sources["SILO"].keys())
+    # print(silo_layernames)
+    try:
+        # run the download
+        files_silo = os.path.join(settings.outpath, "silo")
+        fnames_out = _stage(
+            manifest,
+            "SILO/download",
+            lambda: getdata_silo.get_SILO_layers(
                 silo_layernames,
                 settings.date_min,
                 settings.date_max,
                 files_silo,
                 bbox=settings.target_bbox,
                 format_out="tif"
+            ),
+            inputs=_source_inputs(settings, "SILO", period_days),
+            outputs=lambda files: files,
+        )
+        # Save the layer name
+        fnames_out_silo += fnames_out
+    except Exception as e:
+        print(e)
+    # aggregate the data along time windows if period_days is not None
+    if period_days is not None:
+        #try:
+        outfname_list = []
+        layername_list = []
+        aggfunction_list = []
+        layer_titles = []
+        for i, fname in enumerate(fnames_out_silo):
+            agg = settings.target_sources['SILO'][silo_layernames[i]]
+            outfnames, agg_list = _stage(
+                manifest,
+                f"SILO/aggregate/{silo_layernames[i]}",
+                lambda fname=fname, agg=agg: temporal.aggregate_temporal(
+                    temporal.combine_rasters_temporal(fname, channel_name="band", attribute_name="long_name"),
+                    period=period_days,
+                    agg=[agg],
+                    outfile=f"{fname.split('.')[0]}",
+                    buffer = None),
+                inputs=dict(period=period_days, agg=agg),
+                input_files=[fname],
+                outputs=lambda result: result[0],
             )
-            # Save the layer name
-            fnames_out_silo += fnames_out
-        except Exception as e:
-            print(e)
-        # aggregate the data along time windows if period_days is not None
-        if period_days is not None:
-            #try:
-            outfname_list = []
-            layername_list = []
-            aggfunction_list = []
-            layer_titles = []
-            for i, fname in enumerate(fnames_out_silo):
-                xdr = temporal.combine_rasters_temporal(fname, channel_name="band", attribute_name="long_name")
-                outfnames, agg_list = temporal.aggregate_temporal(
-                    xdr,
-                    period=period_days, 
-                    agg=[settings.target_sources['SILO'][silo_layernames[i]]], 
-                    outfile=f"{fname.split('.')[0]}", 
-                    buffer = None)
-                outfname_list += outfnames
-                layername_list += [silo_layernames[i]]*len(outfnames)
-                aggfunction_list += agg_list
-
-                # define proper titles for the layers
-                layername = silo_layernames[i]
-                for filename in outfnames: 
-                    # get date from filename without extension
-                    date_start = os.path.splitext(os.path.basename(filename).rsplit('_')[-1])[0]
-                    # convert date string YYYY-MM-D to datetime object
-                    date_start = datetime.strptime(date_start, "%Y-%m-%d")
-                    date_end = date_start + timedelta(days=period_days)
-                    date_str = date_start.strftime("%Y-%m-%d") + "-to-" + date_end.strftime("%Y-%m-%d")
-                    new_name = "SILO_" + layername + "_" + settings.target_sources['SILO'][silo_layernames[i]] + "_" + date_str
-                    layer_titles += [new_name]
-            #except Exception as e:
-            #   print(e)
-        else:
-            outfname_list = fnames_out_silo
-            layername_list = silo_layernames
-            aggfunction_list = ['']*len(fnames_out_silo)
-            layer_titles = ["SILO_" + layername for layername in silo_layernames]
-        var_exists = "files_silo" in locals() or "files_silo" in globals()
-        if var_exists:
-            # Add download info to log dataframe
-            download_log = update_logtable(
-                download_log,
-                #fnames_out_silo,
-                filenames = outfname_list,
-                layernames = layername_list,
-                datasource = "SILO",
-                settings = settings,
-                layertitles=[os.path.basename(fname).split('.')[0] for fname in outfname_list],
-                agfunctions = aggfunction_list,
-                loginfos="downloaded",
-            )
-        else:
-            pass
-    if "SLGA" in list_sources:
-        cprint("\n⌛ Downloading SLGA data...", attrs=["bold"])
-        # get data from SLGA
-        slga_layernames = list(settings.target_sources["SLGA"].keys())
-        # get min and max depth for each layername
-        depth_min = []
-        depth_max = []
-        for layername in slga_layernames:
-            depth_bounds = settings.target_sources["SLGA"][layername]
-            dmin, dmax = getdata_slga.identifier2depthbounds(depth_bounds)
-            depth_min.append(dmin)
-            depth_max.append(dmax)
-        try:
-            files_slga = getdata_slga.get_slga_layers(
-                slga_layernames,
-                settings.target_bbox,
-                settings.outpath,
-                depth_min=depth_min,
-                depth_max=depth_max,
-                get_ci=True,
-            )
-        except Exception as e:
-            print(e)
-        var_exists = "files_slga" in locals() or "files_slga" in globals()
-        if var_exists:
-            if len(files_slga) != len(slga_layernames):
-                # get filename stems of files_slga
-                slga_layernames = [Path(f).stem for f in files_slga]
-            download_log = update_logtable(
-                download_log,
-                files_slga,
-                slga_layernames,
-                "SLGA",
-                settings,
-                layertitles=[],
-                loginfos="downloaded",
-            )
-        else:
-            pass
-
-    # save log to file
-    download_log.to_csv(os.path.join(settings.outpath, log_name + ".csv"), index=False)
+            outfname_list += outfnames
+            layername_list += [silo_layernames[i]]*len(outfnames)
+            _write_datacube(settings, "SILO", silo_layernames[i], outfnames, agg=agg, period_days=period_days)
+            aggfunction_list += agg_list
+
+            # define proper titles for the layers
+            layername = silo_layernames[i]
+            for filename in outfnames:
+                # get date from filename without extension
+                date_start = os.path.splitext(os.path.basename(filename).rsplit('_')[-1])[0]
+                # convert date string YYYY-MM-D to datetime object
+                date_start = datetime.strptime(date_start, "%Y-%m-%d")
+                date_end = date_start + timedelta(days=period_days)
+                date_str = date_start.strftime("%Y-%m-%d") + "-to-" + date_end.strftime("%Y-%m-%d")
+                new_name = "SILO_" + layername + "_" + settings.target_sources['SILO'][silo_layernames[i]] + "_" + date_str
+                layer_titles += [new_name]
+        #except Exception as e:
+        #   print(e)
+    else:
+        outfname_list = fnames_out_silo
+        layername_list = silo_layernames
+        aggfunction_list = ['']*len(fnames_out_silo)
+        layer_titles = ["SILO_" + layername for layername in silo_layernames]
+        for layername, fname in zip(silo_layernames, fnames_out_silo):
+            _write_datacube(settings, "SILO", layername, fname)
+    # Add download info to log dataframe
+    return [dict(
+        #fnames_out_silo,
+        filenames = outfname_list,
+        layernames = layername_list,
+        datasource = "SILO",
+        layertitles=[os.path.basename(fname).split('.')[0] for fname in outfname_list],
+        agfunctions = aggfunction_list,
+        loginfos="downloaded",
+    )]
+
+
+def harvest_slga(settings, path_to_config, period_days, manifest=None):
+    """
+    Download SLGA soil data.
 
-    # extract filename from settings.infile
-    # Select all processed data
-    df_sel = download_log.copy()
-    rasters = df_sel["filename_out"].values.tolist()
-    titles = df_sel["layertitle"].values.tolist()
-    if points_available:
-        fn = Path(settings.infile).resolve().name
-        cprint(
-            f"\nExtracting data points for {fn}  -----", "magenta", attrs=["bold"])
-        # Extract datatable from rasters given input coordinates
-        # gdf = utils.raster_query(longs, lats, rasters, titles) # old slower version
-        gdf = utils.extract_values_from_rasters(coords, rasters)
-        # Save as geopackage
-        gdf.to_file(os.path.join(settings.outpath,
-                    "results.gpkg"), driver="GPKG")
-        # Save the results table to a csv as well
-        gdf.drop("geometry", axis=1).to_csv(
-            os.path.join(settings.outpath, "results.csv"), index=True, mode="w"
+    Returns
+    -------
+    list of log entries (keyword arguments for update_logtable)
+    """
+    cprint("\n⌛ Downloading SLGA data...", attrs=["bold"])
+    # get data from SLGA
+    slga_layernames = list(settings.target_sources["SLGA"].keys())
+    # get min and max depth for each layername
+    depth_min = []
+    depth_max = []
+    for layername in slga_layernames:
+        depth_bounds = settings.target_sources["SLGA"][layername]
+        dmin, dmax = getdata_slga.identifier2depthbounds(depth_bounds)
+        depth_min.append(dmin)
+        depth_max.append(dmax)
+    try:
+        files_slga = getdata_slga.get_slga_layers(
+            slga_layernames,
+            settings.target_bbox,
+            settings.outpath,
+            depth_min=depth_min,
+            depth_max=depth_max,
+            get_ci=True,
         )
-        utils.msg_success(
-            f"Data points extracted to {settings.outpath}results.gpkg")
-
-    if preview and points_available:
-        utils.plot_rasters(rasters, longs, lats, titles)
-    elif preview and not points_available:
-        utils.plot_rasters(rasters, titles=titles)
-
-    cprint("\n🎉 🎉 🎉 Harvest complete 🎉 🎉 🎉", "magenta", attrs=["bold"])
-
-    if return_df and points_available:
-        return gdf
-    else:
-        return None
+    except Exception as e:
+        print(e)
+        return []
+    if len(files_slga) != len(slga_layernames):
+        # get filename stems of files_slga
+        slga_layernames = [Path(f).stem for f in files_slga]
+    return [dict(
+        filenames=files_slga,
+        layernames=slga_layernames,
+        datasource="SLGA",
+        layertitles=[],
+        loginfos="downloaded",
+    )]
@@ -0,0 +1,150 @@
+"""
+Log table of downloaded and processed rasters, stored in an embedded SQLite database.
+
+Each output file of a harvest run is recorded with layer name, aggregation function, data
+source, layer title and log information (see utils.update_logtable). Entries are appended
+in transactions, and the uniqueness of output file names is enforced by an index, so that
+the cost of adding entries does not grow with the number of files already logged. The
+database uses write-ahead logging (WAL), so that multiple threads (e.g. source workers) or
+processes can add entries safely while the table is read.
+
+The table is exported as DataFrame or CSV file once at the end of a run, e.g.:
+
+    from geodata_harvester.logtable import LogTable
+    log = LogTable("results/df_log.sqlite")
+    utils.update_logtable(log, filenames, layernames, "SILO", settings)
+    log.to_csv("results/download_summary.csv")
+    log.close()
+
+This package is part of the Data Harvester project developed for the Agricultural Research Federation (AgReFed).
+
+Copyright 2023 Sydney Informatics Hub (SIH), The University of Sydney
+
+This open-source software is released under the LGPL-3.0 License.
+"""
+
+import os
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+# Columns of log table (same as DataFrame of utils.init_logtable)
+LOG_COLUMNS = ["layername", "agfunction", "dataset", "layertitle", "filename_out", "loginfo"]
+
+# Name of log database in output folder of a run
+LOG_DB_NAME = "df_log.sqlite"
+
+
+class LogTable:
+    """
+    Log table of a harvest run backed by SQLite.
+
+    Parameters
+    ----------
+    fname : str
+        file name of database, or ":memory:" for a table in memory
+    reset : bool
+        if True (Default), entries of a previous run in the database are removed
+    timeout : float
+        seconds to wait for a lock held by another connection (Default: 30)
+    """
+
+    def __init__(self, fname=":memory:", reset=True, timeout=30):
+        self.fname = fname
+        if fname != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(fname)), exist_ok=True)
+        self._lock = threading.Lock()
+        # transactions are started explicitly (isolation_level=None)
+        self._conn = sqlite3.connect(fname, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        columns = ", ".join(f"{col} TEXT" for col in LOG_COLUMNS)
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS log (id INTEGER PRIMARY KEY AUTOINCREMENT, {columns})")
+        self._conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_filename_out ON log (filename_out)")
+        if reset:
+            self._conn.execute("DELETE FROM log")
+
+    def add(self, entries, force=False):
+        """
+        Append entries in one transaction.
+
+        Parameters
+        ----------
+        entries : dict
+            list of values for each column of LOG_COLUMNS (all of same length)
+        force : bool
+            if True, existing entries with the same output file names are replaced.
+            If False (Default), no entries are added if any output file name exists.
+
+        Returns
+        -------
+        True if entries were added
+        """
+        rows = list(zip(*[[_sql_value(value) for value in entries[col]] for col in LOG_COLUMNS]))
+        filenames = [row[LOG_COLUMNS.index("filename_out")] for row in rows]
+        placeholders = ", ".join("?" * len(LOG_COLUMNS))
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                existing = [
+                    f for f in filenames
+                    if f is not None and cur.execute("SELECT 1 FROM log WHERE filename_out = ?", (f,)).fetchone()
+                ]
+                if existing and not force:
+                    cur.execute("ROLLBACK")
+                    for f in existing:
+                        print("Error: " + str(f) + " exists in df_log! Dataframe not updated.\nCheck your inputs or overwrite with force=True")
+                    return False
+                for f in existing:
+                    print("Warning: " + str(f) + " exists in df_log and has been overitten by force=True")
+                    cur.execute("DELETE FROM log WHERE filename_out = ?", (f,))
+                cur.executemany(f"INSERT INTO log ({', '.join(LOG_COLUMNS)}) VALUES ({placeholders})", rows)
+                cur.execute("COMMIT")
+            except sqlite3.IntegrityError:
+                # duplicate output file names within entries
+                cur.execute("ROLLBACK")
+                print("Error: duplicate filenames in entries! Dataframe not updated.")
+                return False
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+        return True
+
+    def to_dataframe(self):
+        """
+        Return log table as DataFrame (in order of insertion).
+        """
+        with self._lock:
+            return pd.read_sql_query(f"SELECT {', '.join(LOG_COLUMNS)} FROM log ORDER BY id", self._conn)
+
+    def to_csv(self, fname):
+        """
+        Save log table as CSV file.
+        """
+        self.to_dataframe().to_csv(fname, index=False)
+        return fname
+
+    def close(self):
+        """
+        Close database connection.
+        """
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM log").fetchone()[0]
+
+
+def _sql_value(value):
+    """
+    Internal function, converts value to type supported by SQLite (None, number or string).
+    """
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    return str(value)
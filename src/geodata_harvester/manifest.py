@@ -0,0 +1,184 @@
+"""
+Checkpoint manifest for resumable harvest runs.
+
+The manifest is a JSON file in the output folder of a run that records for each completed
+stage (e.g. download of a data source, temporal aggregation of a layer, alignment of a file)
+a key of its inputs, its result and the output files with size, modification time and checksum.
+The manifest is written atomically (temporary file + rename) after each completed stage, so
+stages that produce one file (e.g. GEE intervals, aligned layers) are checkpointed per file.
+Checksums are only computed if resume=True; otherwise files are recorded with size and
+modification time only, and a file with a different modification time counts as changed.
+
+If a run is restarted with resume=True, stages whose inputs and output files are unchanged
+are skipped and their recorded results are returned instead, so that only the stages that
+failed or did not run yet are executed again, e.g.:
+
+    from geodata_harvester import harvest
+    harvest.run(path_to_config, resume=True)
+
+This package is part of the Data Harvester project developed for the Agricultural Research Federation (AgReFed).
+
+Copyright 2023 Sydney Informatics Hub (SIH), The University of Sydney
+
+This open-source software is released under the LGPL-3.0 License.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+
+from geodata_harvester import utils
+from geodata_harvester.cache import cache_key
+
+MANIFEST_NAME = "harvest_manifest.json"
+
+
+class Manifest:
+    """
+    Checkpoint manifest of a harvest run.
+
+    Parameters
+    ----------
+    outpath : str
+        output folder of the run, the manifest is saved as outpath/harvest_manifest.json
+    resume : bool
+        if True, the manifest of a previous run is loaded and completed stages are skipped.
+        If False (Default), a new manifest is started.
+    """
+
+    def __init__(self, outpath, resume=False):
+        self.fname = os.path.join(outpath, MANIFEST_NAME)
+        self.resume = resume
+        self._lock = threading.Lock()
+        self.data = {"stages": {}, "files": {}}
+        if resume and os.path.exists(self.fname):
+            try:
+                with open(self.fname) as f:
+                    self.data = json.load(f)
+            except (OSError, ValueError):
+                utils.msg_warn(f"Could not read {self.fname}, starting new manifest")
+
+    def run_stage(self, name, func, inputs=None, input_files=None, outputs=None):
+        """
+        Run stage, or return result of previous run if the stage is completed and unchanged.
+
+        Parameters
+        ----------
+        name : str
+            unique name of stage, e.g. "SILO/aggregate/daily_rain"
+        func : function
+            function without arguments that runs the stage, its result must be JSON serialisable
+        inputs : dict, optional
+            input parameters of stage (e.g. settings)
+        input_files : list, optional
+            input files of stage, which are compared by checksum
+        outputs : function, optional
+            function that returns list of output files for the result of func.
+            Stages without output files (or with missing output files) are not recorded,
+            so that they are run again.
+
+        Returns
+        -------
+        result of func
+        """
+        key = self._inputs_key(inputs, input_files)
+        if self.is_complete(name, key):
+            utils.msg_info(f"Skipping {name}, completed in previous run")
+            return self.data["stages"][name]["result"]
+        result = func()
+        files = outputs(result) if outputs is not None else []
+        if (len(files) > 0) and all(os.path.exists(path) for path in files):
+            self.complete(name, key, files, result)
+        return result
+
+    def is_complete(self, name, key):
+        """
+        Return True if resuming and stage was completed with same inputs key and unchanged outputs.
+        """
+        if not self.resume:
+            return False
+        with self._lock:
+            stage = self.data["stages"].get(name)
+        if (stage is None) or (stage["inputs"] != key):
+            return False
+        for path in stage["outputs"]:
+            if not self._unchanged(path):
+                return False
+        return True
+
+    def complete(self, name, key, files, result):
+        """
+        Record completed stage with output files and save manifest.
+        """
+        records = {path: self._fingerprint(path) for path in files}
+        with self._lock:
+            self.data["files"].update(records)
+            self.data["stages"][name] = {
+                "inputs": key,
+                "outputs": list(records.keys()),
+                "result": result,
+                "completed": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
+            self._save()
+
+    def _inputs_key(self, inputs, input_files):
+        """
+        Return key of input parameters and checksums of input files
+        (size and modification time of files without checksum).
+        """
+        checksums = []
+        for path in input_files or []:
+            record = self._fingerprint(path)
+            checksums.append(record["sha1"] or [record["size"], record["mtime_ns"]])
+        return cache_key(inputs=inputs, input_files=list(input_files or []), checksums=checksums)
+
+    def _unchanged(self, path):
+        """
+        Return True if file exists and matches its record.
+        """
+        with self._lock:
+            record = self.data["files"].get(path)
+        if (record is None) or not os.path.exists(path):
+            return False
+        stat = os.stat(path)
+        if stat.st_size != record["size"]:
+            return False
+        if stat.st_mtime_ns == record["mtime_ns"]:
+            return True
+        return (record["sha1"] is not None) and (_sha1(path) == record["sha1"])
+
+    def _fingerprint(self, path):
+        """
+        Return record of file with size, modification time and checksum (None if not resuming).
+        The checksum of a recorded file is only computed again if size or modification time changed.
+        """
+        stat = os.stat(path)
+        with self._lock:
+            record = self.data["files"].get(path)
+        if (record is not None) and (record["size"] == stat.st_size) and (record["mtime_ns"] == stat.st_mtime_ns):
+            return record
+        sha1 = _sha1(path) if self.resume else None
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": sha1}
+
+    def _save(self):
+        """
+        Write manifest to file atomically (call with lock held).
+        """
+        os.makedirs(os.path.dirname(self.fname) or ".", exist_ok=True)
+        fname_tmp = f"{self.fname}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(fname_tmp, "w") as f:
+            json.dump(self.data, f, indent=1, default=str)
+        os.replace(fname_tmp, self.fname)
+
+
+def _sha1(path, blocksize=2**20):
+    """
+    Return sha1 checksum of file.
+    """
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            h.update(block)
+    return h.hexdigest()
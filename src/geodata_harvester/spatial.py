@@ -11,11 +11,23 @@ _coreg_buffer(internal): Queries values of a raster around a point buffer
     region.
 raster_buffer: Given a longitude,latitude point, a raster file, and a buffer
     region, find the values of all points in circular buffer.
+_buffer_stats_kernel(internal): Compiled statistics of circular buffers around
+    many points of an array.
+_buffer_radii(internal): Radius of buffers in rows and columns for radius in
+    pixels or meters.
+raster_buffer_stats: Given many longitude,latitude points, a raster file, and a
+    buffer radius, return statistics of the values in each circular buffer.
 _get_features(internal): Parse features from GeoDataFrame format to Rasterio
     format
 _coreg_polygon(internal): Crops a raster to a polygon shape.
 raster_polygon_buffer: Given list of longitudes and latitudes defining a
     polygon, crop raster file, return the values of all points in the polygon.
+_rasterize_zones(internal): Rasterize polygons once per raster grid, with
+    coverage fractions of pixels on polygon boundaries.
+_zonal_reduce(internal): Per-zone statistics of raster values with bincount
+    reductions.
+zonal_stats: Given a GeoDataFrame of polygons and a list of raster files,
+    return statistics of each raster within each polygon as DataFrame.
 """
 
 from glob import glob
@@ -26,6 +38,8 @@ import rasterio
 from rasterio.mask import mask
 from rasterio.warp import calculate_default_transform, reproject, Resampling
 from rasterio.plot import show
+from rasterio.windows import Window, from_bounds
+from rasterio.features import rasterize
 
 import numpy as np
 import pandas as pd
@@ -39,8 +53,9 @@ from matplotlib.ticker import FormatStrFormatter
 
 from numba import jit
 
-from geodata_harvester import utils
+from geodata_harvester import utils, arc2meter
 
+import shapely
 from shapely.geometry import Polygon
 from fiona.crs import from_epsg
 import json
@@ -154,6 +169,154 @@ def raster_buffer(long, lat, raster, buffer):
     return(values)
 
 
+# Statistics returned by raster_buffer_stats
+BUFFER_STATS = ["mean", "median", "std", "min", "max", "count"]
+
+
+@jit(nopython=True)
+def _buffer_stats_kernel(data, rows, cols, ry, rx, nodata, row_off, col_off, nrows, ncols, out):
+    """
+    Statistics of the values within circular buffers around points of a raster.
+    Pixels are selected as in _points_in_circle, the radius in columns can differ
+    from the radius in rows (e.g. for radius in meters on a geographic grid).
+    Nodata and nan values are excluded.
+
+    INPUTS
+    data: two-dimensional float64 array, window of raster starting at row_off, col_off
+    rows, cols: row and column indices of centre points in raster
+    ry, rx: radius of buffers in rows and columns
+    nodata: nodata value of raster (nan if none)
+    row_off, col_off: index of first row and column of window in raster
+    nrows, ncols: number of rows and columns of raster
+    out: array with shape (number of points, 6) for mean, median, std, min, max, count
+
+    RETURNS
+    None, results are written to out.
+    """
+    # buffer for values of one circle
+    size = int((2 * np.ceil(ry.max()) + 1) * (2 * np.ceil(rx.max()) + 1))
+    values = np.empty(max(size, 1))
+    for k in range(len(rows)):
+        i0, j0 = rows[k], cols[k]
+        n = 0
+        for i in range(int(np.ceil(i0 - ry[k])), int(np.ceil(i0 + ry[k]))):
+            ri = np.sqrt(ry[k]**2 - (i - i0)**2) * (rx[k] / ry[k])
+            for j in range(int(np.ceil(j0 - ri)), int(np.ceil(j0 + ri))):
+                if (i >= 0 and i < nrows) and (j >= 0 and j < ncols):
+                    value = data[i - row_off, j - col_off]
+                    if not (np.isnan(value) or value == nodata):
+                        values[n] = value
+                        n += 1
+        if n == 0:
+            out[k, :5] = np.nan
+        else:
+            v = values[:n]
+            out[k, 0] = v.mean()
+            out[k, 1] = np.median(v)
+            out[k, 2] = v.std()
+            out[k, 3] = v.min()
+            out[k, 4] = v.max()
+        out[k, 5] = n
+
+
+def _buffer_radii(src, lats, radius, units):
+    """
+    Radius of circular buffers in rows and columns of a raster.
+
+    INPUTS
+    src: rasterio dataset
+    lats: latitudes (or y coordinates) of points
+    radius: radius in pixels or meters
+    units: "pixels" or "meters". For geographic rasters, the size of pixels in meters
+        is calculated for the latitude of each point (see arc2meter).
+
+    RETURNS
+    ry, rx: arrays of radius in rows and columns
+    """
+    npoints = len(lats)
+    if units == "pixels":
+        return np.full(npoints, float(radius)), np.full(npoints, float(radius))
+    if units != "meters":
+        raise ValueError(f"units {units} not recognised, must be 'pixels' or 'meters'")
+    res_x, res_y = abs(src.transform.a), abs(src.transform.e)
+    if src.crs is None or src.crs.is_geographic:
+        meter_x, meter_y = arc2meter.calc_arc2meter(1, np.asarray(lats, dtype=float))
+        pixel_x, pixel_y = res_x * 3600 * meter_x, np.full(npoints, res_y * 3600 * meter_y)
+    else:
+        factor = src.crs.linear_units_factor[1]
+        pixel_x, pixel_y = np.full(npoints, res_x * factor), np.full(npoints, res_y * factor)
+    return radius / pixel_y, radius / pixel_x
+
+
+def raster_buffer_stats(longs, lats, raster, radius, units="pixels", band=1, max_memory_mb=256):
+    """
+    given many longitude,latitude points, a raster file, and a buffer radius,
+        return statistics of the values in the circular buffer of each point.
+
+    The raster is opened once. If the window enclosing all buffers fits within max_memory_mb,
+    it is read at once, otherwise points are processed in groups of nearby rows and only the
+    window of each group is read. The statistics are computed with a compiled kernel.
+
+    INPUTS:
+    longs: list or array of longitudes (x coordinates in crs of raster)
+    lats: list or array of latitudes (y coordinates in crs of raster)
+    raster: file path/name (as string)
+    radius: radius of buffer in pixels or meters
+    units: "pixels" (Default) or "meters"
+    band: band index (1-based)
+    max_memory_mb: memory budget in MB for reading raster data
+
+    RETURNS
+    stats: dict of arrays (one value per point) with mean, median, std, min, max and
+        count (number of valid pixels) of values within buffer. nan if count is 0.
+    """
+    longs = np.atleast_1d(np.asarray(longs, dtype=float))
+    lats = np.atleast_1d(np.asarray(lats, dtype=float))
+    if len(longs) != len(lats):
+        raise ValueError("Longitude and Latitude list should be equal in length")
+    out = np.full((len(longs), len(BUFFER_STATS)), np.nan)
+    with rasterio.open(raster) as src:
+        gt = src.transform
+        # row/column index of points (as utils._get_coords_at_point)
+        rows = np.trunc((lats - gt[5]) / gt[4]).astype(np.int64)
+        cols = np.trunc((longs - gt[2]) / gt[0]).astype(np.int64)
+        ry, rx = _buffer_radii(src, lats, radius, units)
+        nodata = np.nan if src.nodata is None else float(src.nodata)
+        # rows and columns covered by buffers, within raster
+        row_min = np.clip(rows - np.ceil(ry).astype(np.int64), 0, src.height - 1)
+        row_max = np.clip(rows + np.ceil(ry).astype(np.int64), 0, src.height - 1)
+        col_min = np.clip(cols - np.ceil(rx).astype(np.int64), 0, src.width - 1)
+        col_max = np.clip(cols + np.ceil(rx).astype(np.int64), 0, src.width - 1)
+        max_pixels = max(1, max_memory_mb * 1024**2 // 8)
+        # Groups of points sorted by row, with enclosing window within memory budget
+        order = np.argsort(rows, kind="stable")
+        start = 0
+        while start < len(order):
+            end = start + 1
+            r0, r1 = row_min[order[start]], row_max[order[start]]
+            c0, c1 = col_min[order[start]], col_max[order[start]]
+            while end < len(order):
+                k = order[end]
+                nr0, nr1 = min(r0, row_min[k]), max(r1, row_max[k])
+                nc0, nc1 = min(c0, col_min[k]), max(c1, col_max[k])
+                if (nr1 - nr0 + 1) * (nc1 - nc0 + 1) > max_pixels:
+                    break
+                r0, r1, c0, c1 = nr0, nr1, nc0, nc1
+                end += 1
+            idx = order[start:end]
+            data = src.read(band, window=Window(c0, r0, c1 - c0 + 1, r1 - r0 + 1)).astype(np.float64)
+            group_out = np.empty((len(idx), len(BUFFER_STATS)))
+            _buffer_stats_kernel(
+                data, rows[idx], cols[idx], ry[idx], rx[idx], nodata,
+                r0, c0, src.height, src.width, group_out,
+            )
+            out[idx] = group_out
+            start = end
+    stats = {name: out[:, i] for i, name in enumerate(BUFFER_STATS)}
+    stats["count"] = stats["count"].astype(np.int64)
+    return stats
+
+
 def _get_features(gdf):
     """
     Function to parse features from GeoDataFrame in such a manner that
@@ -161,7 +324,7 @@ def _get_features(gdf):
 
     gdf: geodataframe of a geometry polygon.
     """
-    return [json.loads(gdf.to_json())['features'][0]['geometry']]
+    return [gdf.geometry.iloc[0].__geo_interface__]
 
 
 def _coreg_polygon(data, polygon):
@@ -211,3 +374,319 @@ def raster_polygon_buffer(lngs, lats, raster):
     values = _coreg_polygon(raster, polygon)
 
     return(values)
+
+
+# Statistics returned by zonal_stats
+ZONAL_STATS = ["count", "sum", "mean", "std", "min", "max", "weighted_mean", "coverage"]
+
+
+@jit(nopython=True)
+def _clip_ring_area(xs, ys, x0, y0, x1, y1):
+    """
+    Area of a polygon ring clipped to a rectangle (Sutherland-Hodgman clipping).
+
+    INPUTS
+    xs, ys: coordinates of closed ring (last point equal to first point)
+    x0, y0, x1, y1: bounds of rectangle
+
+    RETURNS
+    area of ring within rectangle
+    """
+    px = xs[:-1].copy()
+    py = ys[:-1].copy()
+    for edge in range(4):
+        m = len(px)
+        if m == 0:
+            return 0.0
+        qx = np.empty(2 * m)
+        qy = np.empty(2 * m)
+        k = 0
+        for idx in range(m):
+            cx, cy = px[idx], py[idx]
+            sx, sy = px[idx - 1], py[idx - 1]
+            if edge == 0:
+                c_in, s_in = cx >= x0, sx >= x0
+            elif edge == 1:
+                c_in, s_in = cx <= x1, sx <= x1
+            elif edge == 2:
+                c_in, s_in = cy >= y0, sy >= y0
+            else:
+                c_in, s_in = cy <= y1, sy <= y1
+            if c_in != s_in:
+                # intersection of segment with edge of rectangle
+                if edge < 2:
+                    xe = x0 if edge == 0 else x1
+                    qx[k] = xe
+                    qy[k] = sy + (xe - sx) * (cy - sy) / (cx - sx)
+                else:
+                    ye = y0 if edge == 2 else y1
+                    qx[k] = sx + (ye - sy) * (cx - sx) / (cy - sy)
+                    qy[k] = ye
+                k += 1
+            if c_in:
+                qx[k] = cx
+                qy[k] = cy
+                k += 1
+        px = qx[:k]
+        py = qy[:k]
+    area = 0.0
+    m = len(px)
+    for idx in range(m):
+        area += px[idx - 1] * py[idx] - px[idx] * py[idx - 1]
+    return abs(area) / 2
+
+
+@jit(nopython=True)
+def _boundary_coverage(boundary, zone_windows, zone_ring_offsets, ring_offsets, ring_sign, ring_bounds, xs, ys):
+    """
+    Fraction of boundary pixels covered by each zone, in pixel coordinates
+    (pixel at row i and column j covers [j, j + 1] x [i, i + 1]).
+
+    INPUTS
+    boundary: bool array (height, width), True for pixels on polygon boundaries
+    zone_windows: int array (number of zones, 4) of first and last + 1 row and column of zones
+    zone_ring_offsets: index of first ring of each zone (+ total number of rings)
+    ring_offsets: index of first coordinate of each ring (+ total number of coordinates)
+    ring_sign: 1 for exterior rings, -1 for holes
+    ring_bounds: array (number of rings, 4) of xmin, ymin, xmax, ymax of rings
+    xs, ys: coordinates of all rings in pixel units
+
+    RETURNS
+    rows, cols, zone, weight: boundary pixels within window of each zone and covered fraction
+    """
+    n = 0
+    for z in range(len(zone_windows)):
+        r0, r1, c0, c1 = zone_windows[z]
+        for i in range(r0, r1):
+            for j in range(c0, c1):
+                if boundary[i, j]:
+                    n += 1
+    rows = np.empty(n, dtype=np.int64)
+    cols = np.empty(n, dtype=np.int64)
+    zone = np.empty(n, dtype=np.int64)
+    weight = np.zeros(n)
+    k = 0
+    for z in range(len(zone_windows)):
+        r0, r1, c0, c1 = zone_windows[z]
+        for i in range(r0, r1):
+            for j in range(c0, c1):
+                if not boundary[i, j]:
+                    continue
+                area = 0.0
+                for r in range(zone_ring_offsets[z], zone_ring_offsets[z + 1]):
+                    xmin, ymin, xmax, ymax = ring_bounds[r]
+                    if xmax <= j or xmin >= j + 1 or ymax <= i or ymin >= i + 1:
+                        continue
+                    o0, o1 = ring_offsets[r], ring_offsets[r + 1]
+                    area += ring_sign[r] * _clip_ring_area(xs[o0:o1], ys[o0:o1], j, i, j + 1, i + 1)
+                rows[k], cols[k], zone[k], weight[k] = i, j, z, area
+                k += 1
+    return rows, cols, zone, weight
+
+
+def _rasterize_zones(geoms, transform, width, height):
+    """
+    Rasterize polygons (zones) onto a raster grid.
+
+    Each pixel whose centre lies within a polygon is labelled with the index of the polygon
+    (+1, 0 for pixels outside of all polygons). For pixels on polygon boundaries, the fraction
+    of the pixel area covered by each intersecting polygon is calculated, so that partly covered
+    pixels (including pixels whose centre is outside) can be weighted by area.
+
+    INPUTS
+    geoms: array of shapely polygons or multipolygons in crs of raster
+    transform: affine transform of grid (north-up)
+    width, height: number of columns and rows of grid
+
+    RETURNS
+    zones: dict with
+        labels: int32 array (height, width) of zone index + 1 (centre of pixel in zone)
+        boundary: bool array (height, width), True for pixels on polygon boundaries
+        rows, cols, zone, weight: pixel indices, zone index and covered fraction of pixels
+            on boundaries (one entry per intersecting pixel and zone)
+    """
+    nzones = len(geoms)
+    shapes = [(geom, i + 1) for i, geom in enumerate(geoms) if geom is not None and not geom.is_empty]
+    out_shape = (height, width)
+    labels = rasterize(shapes, out_shape=out_shape, transform=transform, fill=0, dtype="int32")
+    boundaries = [geom.boundary for geom, _ in shapes]
+    if boundaries:
+        boundary = rasterize(boundaries, out_shape=out_shape, transform=transform, fill=0,
+                             default_value=1, all_touched=True, dtype="uint8").astype(bool)
+    else:
+        boundary = np.zeros(out_shape, dtype=bool)
+
+    # Rings of all zones (exterior rings and holes) in pixel coordinates
+    parts, part_zone = shapely.get_parts(geoms, return_index=True)
+    rings, ring_part = shapely.get_rings(parts, return_index=True)
+    ring_sign = np.where(np.diff(ring_part, prepend=-1) != 0, 1.0, -1.0)
+    zone_ring_offsets = np.concatenate([[0], np.cumsum(np.bincount(part_zone[ring_part], minlength=nzones))])
+    coords, ring_idx = shapely.get_coordinates(rings, return_index=True)
+    ring_offsets = np.concatenate([[0], np.cumsum(np.bincount(ring_idx, minlength=len(rings)))])
+    xs = (coords[:, 0] - transform.c) / transform.a
+    ys = (coords[:, 1] - transform.f) / transform.e
+    ring_bounds = np.zeros((len(rings), 4))
+    if len(rings) > 0:
+        starts = ring_offsets[:-1]
+        ring_bounds = np.column_stack([np.minimum.reduceat(xs, starts), np.minimum.reduceat(ys, starts),
+                                       np.maximum.reduceat(xs, starts), np.maximum.reduceat(ys, starts)])
+    # Window of pixels of each zone within grid
+    zone_windows = np.zeros((nzones, 4), dtype=np.int64)
+    for z in range(nzones):
+        r = slice(zone_ring_offsets[z], zone_ring_offsets[z + 1])
+        if r.start == r.stop:
+            continue
+        zone_windows[z] = [
+            np.clip(np.floor(ring_bounds[r, 1].min()), 0, height), np.clip(np.ceil(ring_bounds[r, 3].max()), 0, height),
+            np.clip(np.floor(ring_bounds[r, 0].min()), 0, width), np.clip(np.ceil(ring_bounds[r, 2].max()), 0, width),
+        ]
+    rows, cols, zone, weight = _boundary_coverage(
+        boundary, zone_windows, zone_ring_offsets, ring_offsets, ring_sign, ring_bounds, xs, ys
+    )
+    keep = weight > 1e-12
+    return dict(
+        labels=labels,
+        boundary=boundary,
+        rows=rows[keep],
+        cols=cols[keep],
+        zone=zone[keep],
+        weight=np.minimum(weight[keep], 1.0),
+    )
+
+
+def _zonal_reduce(values, valid, zones, row_off, nzones, acc):
+    """
+    Accumulate per-zone statistics of a block of rows of raster values with bincount reductions.
+
+    INPUTS
+    values: float64 array (nrows, width) of raster values of block
+    valid: bool array of valid (not nodata) values
+    zones: zones of grid (see _rasterize_zones)
+    row_off: index of first row of block in grid
+    nzones: number of zones
+    acc: dict of accumulated arrays (one value per zone): n, sum, mean, m2, min, max, wsum, w,
+        updated in place
+    """
+    nrows = values.shape[0]
+    labels = zones["labels"][row_off:row_off + nrows]
+    # pixels with centre in zone
+    sel = (labels > 0) & valid
+    z = labels[sel] - 1
+    v = values[sel]
+    n_b = np.bincount(z, minlength=nzones).astype(np.float64)
+    sum_b = np.bincount(z, weights=v, minlength=nzones)
+    acc["sum"] += sum_b
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_b = sum_b / n_b
+    m2_b = np.bincount(z, weights=(v - mean_b[z])**2, minlength=nzones)
+    # combine with previous blocks (parallel variance algorithm)
+    n = acc["n"] + n_b
+    has = n_b > 0
+    delta = np.where(has, mean_b, 0) - acc["mean"]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ratio = np.where(has, n_b / n, 0)
+    acc["m2"] += np.where(has, m2_b + delta**2 * acc["n"] * ratio, 0)
+    acc["mean"] += delta * ratio
+    acc["n"] = n
+    np.fmin.at(acc["min"], z, v)
+    np.fmax.at(acc["max"], z, v)
+    # area weights: 1 for pixels inside zones, covered fraction for boundary pixels
+    inner = sel & ~zones["boundary"][row_off:row_off + nrows]
+    acc["wsum"] += np.bincount(labels[inner] - 1, weights=values[inner], minlength=nzones)
+    acc["w"] += np.bincount(labels[inner] - 1, minlength=nzones)
+    in_block = (zones["rows"] >= row_off) & (zones["rows"] < row_off + nrows)
+    rows, cols = zones["rows"][in_block] - row_off, zones["cols"][in_block]
+    zone, weight = zones["zone"][in_block], zones["weight"][in_block]
+    ok = valid[rows, cols]
+    acc["wsum"] += np.bincount(zone[ok], weights=weight[ok] * values[rows[ok], cols[ok]], minlength=nzones)
+    acc["w"] += np.bincount(zone[ok], weights=weight[ok], minlength=nzones)
+
+
+def _zones_window(src, bounds):
+    """
+    Window of whole pixels of raster enclosing bounds, within raster (None if outside).
+    """
+    window = from_bounds(*bounds, transform=src.transform)
+    col0, row0 = max(int(np.floor(window.col_off)), 0), max(int(np.floor(window.row_off)), 0)
+    col1 = min(int(np.ceil(window.col_off + window.width)), src.width)
+    row1 = min(int(np.ceil(window.row_off + window.height)), src.height)
+    if col1 <= col0 or row1 <= row0:
+        return None
+    return Window(col0, row0, col1 - col0, row1 - row0)
+
+
+def zonal_stats(gdf, raster_files, zone_col=None, max_memory_mb=256):
+    """
+    Given a GeoDataFrame of polygons (zones, e.g. paddock boundaries) and a list of raster
+        files, return statistics of the values of each raster band within each zone.
+
+    The zones are rasterized once per raster grid (rasters on the same grid share the
+    rasterization), and the statistics of all zones are computed together with bincount
+    reductions over windows of rows that fit within max_memory_mb. Only the window
+    enclosing all zones is read from each raster.
+
+    Statistics (nodata values are excluded):
+        count, sum, mean, std, min, max: of pixels whose centre is within the zone
+        weighted_mean: mean weighted by the area of each pixel covered by the zone
+            (including partly covered pixels)
+        coverage: number of pixels covered by the zone with valid values (sum of weights)
+    Pixels whose centre is within multiple overlapping zones are counted for the last zone only.
+
+    INPUTS:
+    gdf: GeoDataFrame with polygon geometries (reprojected to crs of rasters if crs is set)
+    raster_files: list of raster file paths/names
+    zone_col: column of gdf with zone identifiers (Default: index of gdf)
+    max_memory_mb: memory budget in MB for reading raster data
+
+    RETURNS
+    df: DataFrame with one row per zone, raster and band, with columns zone, layer (file name
+        without extension), band and statistics (see ZONAL_STATS)
+    """
+    zone_ids = gdf.index.values if zone_col is None else gdf[zone_col].values
+    nzones = len(gdf)
+    grid_cache = {}
+    results = []
+    for raster_file in raster_files:
+        layer = Path(raster_file).stem
+        with rasterio.open(raster_file) as src:
+            zones_gdf = gdf if (gdf.crs is None or src.crs is None) else gdf.to_crs(src.crs)
+            # window of raster enclosing all zones
+            window = _zones_window(src, zones_gdf.total_bounds)
+            for band in range(1, src.count + 1):
+                acc = dict(
+                    n=np.zeros(nzones), sum=np.zeros(nzones), mean=np.zeros(nzones), m2=np.zeros(nzones),
+                    min=np.full(nzones, np.nan), max=np.full(nzones, np.nan),
+                    wsum=np.zeros(nzones), w=np.zeros(nzones),
+                )
+                if window is not None:
+                    transform = src.window_transform(window)
+                    width, height = int(window.width), int(window.height)
+                    key = (src.crs.to_wkt() if src.crs else None, transform, width, height)
+                    if key not in grid_cache:
+                        grid_cache[key] = _rasterize_zones(np.asarray(zones_gdf.geometry.values), transform, width, height)
+                    zones = grid_cache[key]
+                    nrows = max(1, min(height, int(max_memory_mb * 2**20 // (8 * 4 * width))))
+                    for row in range(0, height, nrows):
+                        block = Window(window.col_off, window.row_off + row, width, min(nrows, height - row))
+                        data = src.read(band, window=block, masked=True)
+                        values = data.filled(np.nan).astype(np.float64)
+                        valid = ~np.ma.getmaskarray(data) & ~np.isnan(values)
+                        _zonal_reduce(values, valid, zones, row, nzones, acc)
+                has = acc["n"] > 0
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    results.append(pd.DataFrame({
+                        "zone": zone_ids,
+                        "layer": layer,
+                        "band": band,
+                        "count": acc["n"].astype(np.int64),
+                        "sum": np.where(has, acc["sum"], np.nan),
+                        "mean": acc["sum"] / acc["n"],
+                        "std": np.sqrt(acc["m2"] / acc["n"]),
+                        "min": acc["min"],
+                        "max": acc["max"],
+                        "weighted_mean": acc["wsum"] / acc["w"],
+                        "coverage": acc["w"],
+                    }))
+    if not results:
+        return pd.DataFrame(columns=["zone", "layer", "band"] + ZONAL_STATS)
+    return pd.concat(results, ignore_index=True)
@@ -7,11 +7,14 @@ combine_rasters_temporal: Concatenates files by time returns xarray.
 aggregate_temporal: Aggregates xarrays by specified function and time period.
 temporal_crop: Cuts an xarray object by start and end times.
 aggregate_temporal: Make a data aggregation (mean, median, sum, etc) through time on an xarray.
+aggregate_stats: Computes multiple statistics along one axis of an array in a single pass.
 
 --Helper function list--
 
 get_date_after_last_underscore: Extract the date from the file name after the last underscore.
 get_mask_array: Return mask of the data, e.g. for cloud-cover.
+get_time_groups: Group time steps by time period.
+aggregate_chunked: Aggregates time steps of an xarray in chunks of rows.
 """
 
 import numpy as np
@@ -20,6 +23,17 @@ import rioxarray
 import xarray as xr
 import datetime
 
+from geodata_harvester import geotiff
+
+try:
+    import dask  # noqa: F401
+    # Open rasters lazily as dask arrays, one band per chunk and automatic chunk sizes in y and x
+    # (multiples of the internal raster blocks)
+    _chunks = {"band": 1, "y": "auto", "x": "auto"}
+except ImportError:
+    # Without dask, data is loaded into memory when rasters are concatenated
+    _chunks = None
+
 
 def combine_rasters_temporal(
     file_list, channel_name="band", attribute_name="long_name"
@@ -27,6 +41,7 @@ def combine_rasters_temporal(
     """
     Combines multiple tif files into single xarray object. 
     Assumes additional channels contain sequential time step data. 
+    If dask is installed, the files are opened lazily in chunks and only read when needed.
     If multiple files in file_list, files must be in temporal order and same data type.
     Also assumes files are of the same shape (x,y,t).
 
@@ -61,7 +76,7 @@ def combine_rasters_temporal(
     attrs = ()
     first = True
     for x in file_list:
-        xds = rioxarray.open_rasterio(x)
+        xds = rioxarray.open_rasterio(x, chunks=_chunks)
 
         if channel_name not in xds.coords:
             raise ValueError(
@@ -106,6 +121,7 @@ def combine_rasters_temporal(
 def multiband_raster_to_xarray(file_list, date_list = None, mask_bandname = None):
     """
     Converts a stack of multiband raster with different dates to an xarray object.
+    If dask is installed, the files are opened lazily in chunks and only read when needed.
     
     Parameters
     ----------
@@ -126,7 +142,7 @@ def multiband_raster_to_xarray(file_list, date_list = None, mask_bandname = None
 
     for file, date in zip(file_list, date_list):
         # Read the raster file using rioxarray
-        xds = rioxarray.open_rasterio(file)
+        xds = rioxarray.open_rasterio(file, chunks=_chunks)
 
         # Assign the time coordinate
         xds = xds.assign_coords({"time": pd.to_datetime(date)})
@@ -162,7 +178,7 @@ def temporal_crop(xdr, start_time, end_time):
 
 
 def aggregate_temporal(xdr,
-    period="yearly", agg=["mean"], outfile="temporal_agg", buffer = None, fill_nan = True):
+    period="yearly", agg=["mean"], outfile="temporal_agg", buffer = None, fill_nan = True, nodata_max = None):
     """
     Make a data aggregation (mean, median, sum, etc) through time on an xarray.
     Expects xarray coordinates to be x, y, time. Saves every aggregation for
@@ -188,6 +204,10 @@ def aggregate_temporal(xdr,
     buffer: integer time period in same units as period to buffer into the future.
     fill_nan: boolean. If True (Default), will automatically try to find the value for missing data 
         from header and fills with nan before aggregating. If False, will not fill nan.
+    nodata_max: float, optional. Values less than or equal to nodata_max are treated as missing data.
+
+    Missing values are masked chunk by chunk during the aggregation,
+    so no masked copy of the full data is created.
 
     Returns
     -------
@@ -196,20 +216,21 @@ def aggregate_temporal(xdr,
 
     """
 
+    nodata = None
     if fill_nan:
         # Define the possible attribute names for fill values
         nodata_names = ["_FillValue", "missing_value", "nodata", "nodatavalue"]
         nodata_name_found = False
         for nodata_name in nodata_names:
             if nodata_name in xdr.attrs:
-                xdr = xdr.where(xdr != xdr.attrs[nodata_name], np.nan)
+                nodata = xdr.attrs[nodata_name]
                 nodata_name_found = True
                 break
         # Check for case-insensitive nodata names
         if not nodata_name_found:
             for key, value in xdr.attrs.items():
                 if key.lower() in [attr.lower() for attr in nodata_names]:
-                    xdr = xdr.where(xdr != value, np.nan)
+                    nodata = value
                     nodata_name_found = True
                     break
 
@@ -223,83 +244,226 @@ def aggregate_temporal(xdr,
         #print("Finding", aggcheck, " out of possible", agg_types)
         #print("for", period, " period.")
 
-    # Group by the appropriate time period
-    if period == "yearly":
-        xdr_groups = xdr.groupby("time.year")
+    # Group time steps by the appropriate time period
+    time_groups = get_time_groups(xdr.time.values, period, buffer)
 
-        if buffer != None:
-            xx = xdr_groups.apply(lambda x: x.isel(time=slice(0,buffer)))
-            xdr_groups = xx.groupby("time.year")
+    # Keep track of the names of all files produced
+    outfname_list = []
+    agg_list = []
 
-    elif period == "monthly":
-        xdr_groups = xdr.groupby("time.month")
+    # All statistics of a time period are computed in a single pass over the data (see aggregate_stats)
+    for label, idx in time_groups:
+        aggdict = aggregate_chunked(xdr, idx, aggcheck, nodata=nodata, nodata_max=nodata_max)
+        for a in aggcheck:
+            outfname = outfile + "_" + a + "_" + label + ".tif"
+            geotiff.write_xarray(aggdict[a], outfname)
+            outfname_list.append(outfname)
+            agg_list.append(a)
+
+            print(a, "of", label, "saved in:", outfname)
+
+    # Sort output by aggregation method
+    order = sorted(range(len(agg_list)), key=lambda i: aggcheck.index(agg_list[i]))
+    outfname_list = [outfname_list[i] for i in order]
+    agg_list = [agg_list[i] for i in order]
+
+    return outfname_list, agg_list
 
-        if buffer != None:
-            xx = xdr_groups.apply(lambda x: x.isel(time=slice(0,buffer)))
-            xdr_groups = xx.groupby("time.month")
 
+def get_time_groups(times, period, buffer=None):
+    """
+    Group time steps by time period.
+
+    Parameters
+    ----------
+    times : array of datetime64 time steps
+    period : string or int. Time period, 'yearly', 'monthly', or number of periods.
+    buffer: integer number of time steps to keep at the start of each period (optional).
+
+    Returns
+    -------
+    time_groups : list of tuples (label, array of time indices), sorted by label.
+        Labels are the year ('yearly'), the zero-padded month ('monthly')
+        or the start date of the time bin (int period).
+        Empty time bins are included with an empty index array.
+    """
+    xidx = xr.DataArray(np.arange(len(times)), coords={"time": times}, dims="time")
+    if period == "yearly":
+        groups = [(str(label), grp.values) for label, grp in xidx.groupby("time.year")]
+    elif period == "monthly":
+        groups = [(str(label).zfill(2), grp.values) for label, grp in xidx.groupby("time.month")]
     elif type(period) == int:
-        time_start = xdr.time.values[0].astype('datetime64[s]').tolist()
-        time_end = xdr.time.values[-1].astype('datetime64[s]').tolist()
+        time_start = times[0].astype('datetime64[s]').tolist()
+        time_end = times[-1].astype('datetime64[s]').tolist()
         bins = (time_end - time_start).days // period
         #bins = int(np.floor(len(xdr) / period)) # this only works if len(xdr) is in days
         if bins == 0:
             # If the period is smaller than the time step, use the time step as the period
             bins = 1
-        xdr_groups = xdr.groupby_bins("time", bins)
-
-        if buffer != None:
-            xx = xdr_groups.apply(lambda x: x.isel(time=slice(0,buffer)))
-            xdr_groups = xx.groupby_bins("time", period)
-
-
     else:
         raise ValueError(
             "Invalid temporal period. Expected any of: 'yearly', 'monthly', or an integer period"
         )
+    if (period == "yearly") | (period == "monthly"):
+        if buffer != None:
+            groups = [(label, idx[:buffer]) for label, idx in groups]
+        return groups
+
+    xgroups = xidx.groupby_bins("time", bins)
+    if buffer != None:
+        xx = xr.concat([grp.isel(time=slice(0, buffer)) for _, grp in xgroups], dim="time")
+        xgroups = xx.groupby_bins("time", period)
+    # Include empty bins
+    members = {label: grp.values for label, grp in xgroups}
+    labels = xgroups.count()["time_bins"].values
+    return [
+        (str(label)[1:11], members.get(label, np.array([], dtype=int)))
+        for label in labels
+    ]
+
+
+def aggregate_chunked(xdr, idx, aggs, nodata=None, nodata_max=None, max_chunk_mb=256):
+    """
+    Compute multiple statistics over the time steps idx of xarray in chunks along the y dimension.
 
-    aggdict = {}
-    for agg_type in aggcheck:
-        if agg_type == "mean":
-            aggdict["mean"] = xdr_groups.mean()
-        elif agg_type == "median":
-            aggdict["median"] = xdr_groups.median()
-        elif agg_type == "sum":
-            aggdict["sum"] = xdr_groups.sum()
-        elif agg_type == "perc95":
-            aggdict["perc95"] = xdr_groups.quantile(q=0.95)
-        elif agg_type == "perc5":
-            aggdict["perc5"] = xdr_groups.quantile(q=0.05)
-        elif agg_type == "max":
-            aggdict["max"] = xdr_groups.max()
-        elif agg_type == "min":
-            aggdict["min"] = xdr_groups.min()
+    Only one chunk of data (all selected time steps for a block of rows) is loaded
+    into memory at a time, so that long time series do not need to fit into memory.
+    Missing values are replaced with nan in each chunk before aggregation.
 
+    Parameters
+    ----------
+    xdr : xarray object with dimensions time, y, x (and optionally band)
+    idx : array of time indices to aggregate
+    aggs : list of strings, aggregation methods (see aggregate_stats)
+    nodata : value for missing data (optional)
+    nodata_max : values less than or equal to nodata_max are treated as missing data (optional)
+    max_chunk_mb : maximum size of data chunk in MB
 
-    # Keep track of the names of all files produced
-    outfname_list = []
-    agg_list = []
+    Returns
+    -------
+    aggdict : dict of xarray objects (dimensions of xdr without time) for each aggregation method
+    """
+    # Template for output arrays
+    template = xdr.isel(time=0, drop=True)
+    ydim = "y" if "y" in xdr.dims else xdr.rio.y_dim
+    axis_time = xdr.get_axis_num("time")
+    axis_y = template.get_axis_num(ydim)
+    ny = xdr.sizes[ydim]
+    bytes_row = max(len(idx), 1) * np.dtype(xdr.dtype).itemsize * template.size // ny
+    nrows = int(max(1, min(ny, max_chunk_mb * 1024**2 // max(bytes_row, 1))))
+
+    results = {}
+    for y0 in range(0, ny, nrows):
+        chunk = xdr.isel({"time": idx, ydim: slice(y0, y0 + nrows)}).values
+        if (nodata is not None) | (nodata_max is not None):
+            chunk = _mask_nodata(chunk, nodata, nodata_max)
+        stats = aggregate_stats(chunk, aggs, axis=axis_time)
+        for a in aggs:
+            if a not in results:
+                results[a] = np.empty(template.shape, dtype=stats[a].dtype)
+            index = [slice(None)] * template.ndim
+            index[axis_y] = slice(y0, y0 + nrows)
+            results[a][tuple(index)] = stats[a]
+
+    return {
+        a: xr.DataArray(results[a], coords=template.coords, dims=template.dims, attrs=xdr.attrs)
+        for a in aggs
+    }
+
+
+def _mask_nodata(data, nodata=None, nodata_max=None):
+    """
+    Replace missing values in array with nan.
+    Integer data is converted to float64 (same as xarray.where).
+    """
+    if not np.issubdtype(data.dtype, np.floating):
+        data = data.astype(np.float64)
+    if nodata is not None:
+        data[data == nodata] = np.nan
+    if nodata_max is not None:
+        data[data <= nodata_max] = np.nan
+    return data
 
-    # For all the different aggregation methods
-    for a in aggcheck:
-        # For each period of time in each of the groups, save it out!
-        for p in aggdict[a]:
-
-            # Each temporal grouping results in different group labels
-            if period == "yearly":
-                label = str(p["year"].values)
-            elif period == "monthly":
-                label = str(p["month"].values).zfill(2)
-            elif type(period) == int:
-                label = str(p["time_bins"].values)[1:11]
-
-            p.rio.to_raster(outfile + "_" + a + "_" + label + ".tif")
-            outfname_list.append(outfile + "_" + a + "_" + label + ".tif")
-            agg_list.append(a)
 
-            print(a, "of", label, "saved in:", outfile + "_" + a + "_" + label + ".tif")
+def aggregate_stats(data, aggs, axis=0):
+    """
+    Compute multiple statistics along one axis in a single pass, ignoring nan values.
 
-    return outfname_list, agg_list
+    Sum and count are shared by 'sum' and 'mean', and all percentiles ('median', 'perc5',
+    'perc95') are computed from one sort of the data. Percentiles use linear interpolation
+    (same as numpy.nanquantile). Sums of all-nan values are 0, all other statistics are nan.
+    If there is no data along the axis, all statistics are nan.
+    Results have the same data type as floating point input data (float64 for integer input data).
+
+    Parameters
+    ----------
+    data : numpy array
+    aggs : list of strings, any of 'mean', 'median', 'sum', 'perc95', 'perc5', 'max', 'min'
+    axis : int, axis to aggregate over
+
+    Returns
+    -------
+    result : dict of numpy arrays for each aggregation method
+    """
+    quantiles = {"median": 0.5, "perc95": 0.95, "perc5": 0.05}
+    data = np.moveaxis(np.asarray(data), axis, 0)
+    is_float = np.issubdtype(data.dtype, np.floating)
+    if data.shape[0] == 0:
+        # No data (e.g. empty time period)
+        return {
+            a: np.full(data.shape[1:], np.nan, dtype=_stats_dtype(data.dtype))
+            for a in aggs
+        }
+    if is_float:
+        valid = ~np.isnan(data)
+        count = valid.sum(axis=0)
+    else:
+        count = np.full(data.shape[1:], data.shape[0])
+    empty = count == 0
+
+    result = {}
+    if ("sum" in aggs) | ("mean" in aggs):
+        if is_float:
+            total = np.where(valid, data, 0).sum(axis=0)
+        else:
+            total = data.sum(axis=0)
+        if "sum" in aggs:
+            result["sum"] = total
+        if "mean" in aggs:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                result["mean"] = np.where(empty, np.nan, total / np.maximum(count, 1))
+    for a, func in [("max", np.fmax), ("min", np.fmin)]:
+        if a in aggs:
+            result[a] = func.reduce(data, axis=0)
+    qaggs = [a for a in aggs if a in quantiles]
+    if len(qaggs) > 0:
+        # nan values are sorted to the end
+        data_sorted = np.sort(data, axis=0)
+        for a in qaggs:
+            nmax = np.maximum(count - 1, 0)
+            pos = quantiles[a] * nmax
+            lower = np.floor(pos).astype(np.int64)
+            upper = np.minimum(lower + 1, nmax)
+            val_lower = np.take_along_axis(data_sorted, lower[np.newaxis], axis=0)[0]
+            val_upper = np.take_along_axis(data_sorted, upper[np.newaxis], axis=0)[0]
+            t = pos - lower
+            diff = val_upper - val_lower
+            # linear interpolation as in numpy.quantile
+            value = np.where(t >= 0.5, val_upper - diff * (1 - t), val_lower + diff * t)
+            result[a] = np.where(empty, np.nan, value)
+    if is_float:
+        result = {a: result[a].astype(_stats_dtype(data.dtype), copy=False) for a in result}
+    return result
+
+
+def _stats_dtype(dtype):
+    """
+    Data type of statistic: all statistics keep the precision of floating point input data,
+    integer input data is promoted to float64.
+    """
+    if not np.issubdtype(dtype, np.floating):
+        return np.float64
+    return dtype
 
 
 def get_date_after_last_underscore(file_list):
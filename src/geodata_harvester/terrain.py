@@ -0,0 +1,415 @@
+"""
+Block-wise terrain analysis of DEMs.
+
+Terrain layers are computed from a DEM in windows of full-width rows with a halo of one
+row above and below each window, so that the central differences and 3 x 3 pixel neighbourhoods
+at the window edges use the same pixels as a computation over the whole raster. Only one window
+(plus halo) is held in memory at a time per worker, and the results are written window by window
+into tiled GeoTIFFs (see geotiff.py). This allows terrain layers for large 1 arc-second regions.
+
+Layers (see LAYERS), any subset of which is computed in one pass with derivatives():
+- slope: slope in degrees
+- aspect: aspect in degrees
+- curvature: negative Laplacian of the DEM in 1/100 m (positive for convex surfaces)
+- hillshade: shaded relief (0-255) for configured illumination
+- tpi: Topographic Position Index (m), elevation minus mean of the 8 neighbouring pixels
+- roughness: range of elevation (m) in 3 x 3 pixel window
+
+Slope and aspect are the same as computing the gradients of the whole DEM with xarray
+(DataArray.differentiate, as in previous versions of getdata_dem.calculate_slope_aspect):
+- DEM values are masked by nodata (nan) and converted to float32 or float64 as in rioxarray
+- gradients in x and y direction with central differences (one-sided at the raster edges)
+- conversion of degrees to meter with latitude-dependent scale (see arc2meter.py)
+All layers are set to 0 where the DEM is 0 (e.g. sea level).
+
+DEMs that are not in EPSG:4326 are first warped to EPSG:4326 (nearest neighbour).
+
+Output data type, number of workers (threads), memory per window and illumination for hillshade
+can be changed with configure(), e.g.:
+
+    from geodata_harvester import terrain
+    terrain.configure(dtype="float32", workers=4)
+    terrain.calculate("DEM.tif", "Slope_DEM.tif", layer="slope")
+    terrain.derivatives("DEM.tif", {"slope": "Slope_DEM.tif", "hillshade": "Hillshade_DEM.tif"})
+
+This package is part of the Data Harvester project developed for the Agricultural Research Federation (AgReFed).
+
+Copyright 2023 Sydney Informatics Hub (SIH), The University of Sydney
+
+This open-source software is released under the LGPL-3.0 License.
+"""
+
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import rasterio
+from rasterio.warp import calculate_default_transform
+from rasterio.windows import Window
+from rioxarray.rioxarray import affine_to_coords
+
+from geodata_harvester import arc2meter, geotiff, utils
+
+# Data type of output rasters ("float64" or "float32"), number of worker threads, maximum
+# memory in MB of the arrays of one window, and direction of illumination for hillshade (degrees)
+_config = {
+    "dtype": "float64",
+    "workers": 1,
+    "max_memory_mb": 256,
+    "hillshade_azimuth": 315,
+    "hillshade_altitude": 45,
+}
+
+# Number of full-size temporary arrays per window (DEM, gradients, neighbours, result), used for window size
+_NTEMP = 12
+
+
+def configure(dtype=None, workers=None, max_memory_mb=None, hillshade_azimuth=None, hillshade_altitude=None):
+    """
+    Configure block-wise terrain analysis.
+
+    Parameters
+    ----------
+    dtype : str, optional
+        data type of output rasters: "float64" (Default) or "float32"
+    workers : int, optional
+        number of windows processed concurrently (Default: 1)
+    max_memory_mb : float, optional
+        maximum memory of the arrays of one window in MB (Default: 256)
+    hillshade_azimuth : float, optional
+        azimuth of illumination for hillshade in degrees clockwise from north (Default: 315)
+    hillshade_altitude : float, optional
+        altitude of illumination for hillshade in degrees above horizon (Default: 45)
+    """
+    if dtype is not None:
+        if np.dtype(dtype) not in (np.float32, np.float64):
+            raise ValueError(f"dtype {dtype} not supported, must be 'float32' or 'float64'")
+        _config["dtype"] = np.dtype(dtype).name
+    if workers is not None:
+        _config["workers"] = max(1, int(workers))
+    if max_memory_mb is not None:
+        _config["max_memory_mb"] = max_memory_mb
+    if hillshade_azimuth is not None:
+        _config["hillshade_azimuth"] = hillshade_azimuth
+    if hillshade_altitude is not None:
+        _config["hillshade_altitude"] = hillshade_altitude
+
+
+def slope(block):
+    """
+    Slope in degrees
+    """
+    gradient_magnitude = np.sqrt(block["gradient_x"]**2 + block["gradient_y"]**2)
+    return np.arctan(gradient_magnitude) * 180 / np.pi
+
+
+def aspect(block):
+    """
+    Aspect in degrees
+    """
+    return np.arctan2(block["gradient_x"], block["gradient_y"]) * 180 / np.pi + 180
+
+
+def curvature(block):
+    """
+    Curvature (1/100 m) as negative Laplacian of the DEM: positive for convex (e.g. ridges),
+    negative for concave surfaces (e.g. valleys), as in ArcGIS Curvature.
+    """
+    dem = block["dem"]
+    d2z_dx2 = (_neighbour(block, 0, -1) - 2 * dem + _neighbour(block, 0, 1)) / block["dx"]**2
+    d2z_dy2 = (_neighbour(block, -1, 0) - 2 * dem + _neighbour(block, 1, 0)) / block["dy"]**2
+    return -100 * (d2z_dx2 + d2z_dy2)
+
+
+def hillshade(block):
+    """
+    Hillshade (0-255) for illumination from configured azimuth and altitude (degrees)
+    """
+    azimuth = np.deg2rad(_config["hillshade_azimuth"])
+    altitude = np.deg2rad(_config["hillshade_altitude"])
+    gradient_x, gradient_y = block["gradient_x"], block["gradient_y"]
+    # cosine of angle between surface normal (-dz/dx, -dz/dy, 1) and direction of illumination
+    shade = (np.sin(altitude) - np.cos(altitude) * (np.sin(azimuth) * gradient_x + np.cos(azimuth) * gradient_y)) \
+        / np.sqrt(1 + gradient_x**2 + gradient_y**2)
+    return 255 * np.clip(shade, 0, 1)
+
+
+def tpi(block):
+    """
+    Topographic Position Index (m): elevation minus mean elevation of the 8 neighbouring pixels
+    """
+    # sum in float64 to avoid loss of precision for float32 DEMs
+    total = np.zeros(block["dem"].shape)
+    for di, dj in _NEIGHBOURS:
+        total += _neighbour(block, di, dj)
+    return block["dem"] - total / len(_NEIGHBOURS)
+
+
+def roughness(block):
+    """
+    Roughness (m): range of elevation (maximum - minimum) in 3 x 3 pixel window
+    """
+    maximum = block["dem"].copy()
+    minimum = block["dem"].copy()
+    for di, dj in _NEIGHBOURS:
+        neighbour = _neighbour(block, di, dj)
+        np.maximum(maximum, neighbour, out=maximum)
+        np.minimum(minimum, neighbour, out=minimum)
+    return maximum - minimum
+
+
+# Terrain layers computed from DEM and its gradients (see _compute_window)
+LAYERS = {
+    "slope": slope,
+    "aspect": aspect,
+    "curvature": curvature,
+    "hillshade": hillshade,
+    "tpi": tpi,
+    "roughness": roughness,
+}
+
+# Offsets (rows, columns) of the 8 neighbouring pixels
+_NEIGHBOURS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+
+def derivatives(fname_dem, outputs, dtype=None, workers=None, max_memory_mb=None):
+    """
+    Calculate multiple terrain layers from DEM in one pass and save as GeoTIFFs.
+
+    The DEM is read once per window and the gradients are shared by all layers.
+    Layers that need neighbouring pixels (curvature, TPI, roughness) are nan at the raster edges.
+
+    Parameters
+    ----------
+    fname_dem : str
+        DEM file name
+    outputs : dict
+        output file name for each layer, e.g. {"slope": "Slope_DEM.tif", "tpi": "TPI_DEM.tif"}.
+        Layers: "slope", "aspect", "curvature", "hillshade", "tpi", "roughness"
+    dtype, workers, max_memory_mb : optional
+        override configured values (see configure)
+
+    Returns
+    -------
+    outputs : dict of layer and output file name
+    """
+    for layer in outputs:
+        if layer not in LAYERS:
+            raise ValueError(f"Layer {layer} not recognised, must be one of {list(LAYERS)}")
+    dtype = np.dtype(dtype or _config["dtype"])
+    workers = workers or _config["workers"]
+    max_memory_mb = max_memory_mb or _config["max_memory_mb"]
+    with rasterio.open(fname_dem) as src:
+        crs = src.crs
+    fname_tmp = None
+    if crs is not None and crs != "EPSG:4326":
+        # Degree to meter conversion requires DEM in EPSG:4326
+        outdir = os.path.dirname(os.path.abspath(next(iter(outputs.values()))))
+        fd, fname_tmp = tempfile.mkstemp(suffix=".tif", dir=outdir)
+        os.close(fd)
+        fname_dem = _warp_to_wgs84(fname_dem, fname_tmp)
+    try:
+        _process(fname_dem, {fname: LAYERS[layer] for layer, fname in outputs.items()}, dtype, workers, max_memory_mb)
+    finally:
+        if fname_tmp is not None and os.path.exists(fname_tmp):
+            os.remove(fname_tmp)
+    return outputs
+
+
+def calculate(fname_dem, fname_out, layer="slope", dtype=None, workers=None, max_memory_mb=None):
+    """
+    Calculate terrain layer from DEM block-wise and save as GeoTIFF.
+
+    Parameters
+    ----------
+    fname_dem : str
+        DEM file name
+    fname_out : str
+        output file name
+    layer : str
+        "slope", "aspect", "curvature", "hillshade", "tpi" or "roughness"
+    dtype, workers, max_memory_mb : optional
+        override configured values (see configure)
+
+    Returns
+    -------
+    fname_out : str
+    """
+    return derivatives(fname_dem, {layer: fname_out}, dtype, workers, max_memory_mb)[layer]
+
+
+def _warp_to_wgs84(fname_dem, fname_tmp):
+    """
+    Internal function, warps DEM to EPSG:4326 (nearest neighbour) with the default output grid.
+    """
+    with rasterio.open(fname_dem) as src:
+        transform, width, height = calculate_default_transform(
+            src.crs, "EPSG:4326", src.width, src.height, *src.bounds
+        )
+        profile = src.profile.copy()
+        profile.update(crs="EPSG:4326", transform=transform, width=width, height=height)
+        return utils._warp(src, fname_tmp, profile)
+
+
+def _masked_dtype(dtype):
+    """
+    Internal function, returns data type of DEM masked by nodata (as in rioxarray with masked=True):
+    float types are kept, integers up to 16 bit are converted to float32, others to float64.
+    """
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.floating):
+        return dtype
+    return np.dtype("float32") if dtype.itemsize <= 2 else np.dtype("float64")
+
+
+def _process(fname_dem, outputs, dtype, workers, max_memory_mb):
+    """
+    Internal function, computes terrain layers of a DEM in EPSG:4326 in windows of rows and
+    writes them window by window.
+
+    INPUTS:
+        fname_dem: DEM file name
+        outputs: dict of output file name and layer function (see LAYERS)
+        dtype: data type of outputs
+        workers: number of windows processed concurrently
+        max_memory_mb: maximum memory of the arrays of one window in MB
+    """
+    with rasterio.open(fname_dem) as src:
+        width, height, count = src.width, src.height, src.count
+        transform, crs = src.transform, src.crs
+        dtype_dem = _masked_dtype(src.dtypes[0])
+    if width < 2 or height < 2:
+        raise ValueError(f"DEM {fname_dem} must have at least 2 x 2 pixels")
+    coords = affine_to_coords(transform, width, height)
+    grid = dict(
+        x=coords["x"],
+        res=(abs(transform.a), abs(transform.e)),
+        y_spacing=_spacing(coords["y"]),
+        # factor for converting degrees to meter based on latitude (x: one per row, y: constant)
+        deg2meter=arc2meter.calc_arc2meter(3600, coords["y"]),
+        dtype=dtype_dem,
+    )
+
+    # Number of rows per window, multiple of the output block size where possible
+    itemsize = max(dtype_dem.itemsize, dtype.itemsize, 8)
+    nrows = max(1, int(max_memory_mb * 2**20 // (_NTEMP * count * width * itemsize)))
+    blocksize = geotiff.blocksize()
+    if nrows > blocksize:
+        nrows = nrows // blocksize * blocksize
+    nrows = min(nrows, height)
+    windows = [Window(0, row, width, min(nrows, height - row)) for row in range(0, height, nrows)]
+
+    profile = dict(driver="GTiff", width=width, height=height, count=count, dtype=dtype.name,
+                   crs=crs, transform=transform, nodata=None)
+    dsts = {fname: geotiff.open_raster(fname, **profile) for fname in outputs}
+    try:
+        def write(window, results):
+            for fname, result in results.items():
+                dsts[fname].write(result.astype(dtype, copy=False), window=window)
+
+        funcs = list(outputs.items())
+        if workers <= 1:
+            for window in windows:
+                write(window, _compute_window(fname_dem, window, grid, funcs))
+        else:
+            # Windows are computed concurrently (each worker reads its own window)
+            # and written in order; at most 2 windows per worker are pending
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                pending = deque()
+                for window in windows:
+                    pending.append((window, executor.submit(_compute_window, fname_dem, window, grid, funcs)))
+                    if len(pending) >= 2 * workers:
+                        window_done, future = pending.popleft()
+                        write(window_done, future.result())
+                while pending:
+                    window_done, future = pending.popleft()
+                    write(window_done, future.result())
+    finally:
+        for dst in dsts.values():
+            dst.close()
+    for fname in outputs:
+        geotiff.finalize(fname)
+
+
+def _compute_window(fname_dem, window, grid, funcs):
+    """
+    Internal function, reads window of DEM with halo of one row above and below
+    and returns dict of output file name and terrain layer of the window.
+    """
+    row, nrows = int(window.row_off), int(window.height)
+    height = len(grid["deg2meter"][0])
+    r0, r1 = max(row - 1, 0), min(row + nrows + 1, height)
+    with rasterio.open(fname_dem) as src:
+        data = src.read(window=Window(0, r0, window.width, r1 - r0), masked=True)
+    dem = np.ma.filled(data.astype(grid["dtype"]), np.nan)
+
+    deg2meter_x, deg2meter_y = grid["deg2meter"]
+    block = dict(
+        dem=dem,
+        gradient_x=np.gradient(dem, grid["x"], axis=-1, edge_order=1) / deg2meter_x[r0:r1, None],
+        gradient_y=_gradient_rows(dem, grid["y_spacing"], r0) / deg2meter_y,
+        # pixel size in meter (x: one per row, y: constant)
+        dx=grid["res"][0] * deg2meter_x[r0:r1, None],
+        dy=grid["res"][1] * deg2meter_y,
+    )
+
+    # results without halo, set to 0 where DEM is 0
+    inner = slice(row - r0, row - r0 + nrows)
+    results = {}
+    for fname, func in funcs:
+        result = np.where(dem != 0, func(block), 0)
+        results[fname] = result[:, inner]
+    return results
+
+
+def _neighbour(block, di, dj):
+    """
+    Internal function, returns DEM of block shifted by di rows and dj columns,
+    i.e. the neighbouring pixel of each pixel (nan outside of block).
+    """
+    if "padded" not in block:
+        block["padded"] = np.pad(block["dem"], ((0, 0), (1, 1), (1, 1)), constant_values=np.nan)
+    nrows, ncols = block["dem"].shape[1:]
+    return block["padded"][:, 1 + di:1 + di + nrows, 1 + dj:1 + dj + ncols]
+
+
+def _spacing(coords):
+    """
+    Internal function, returns spacing of coordinates as scalar if constant, otherwise
+    as array of differences (as in numpy.gradient for the whole raster).
+    """
+    diff = np.diff(coords)
+    if (diff == diff[0]).all():
+        return diff[0]
+    return diff
+
+
+def _gradient_rows(f, spacing, r0):
+    """
+    Internal function, gradient of block f (band, row, col) along rows, with the same formulas
+    as numpy.gradient(edge_order=1) for the whole raster.
+
+    INPUTS:
+        f: block of rows r0 to r0 + f.shape[1] of raster
+        spacing: spacing of rows of whole raster (see _spacing)
+        r0: first row of block in raster
+    """
+    out = np.empty_like(f)
+    n = f.shape[1]
+    if np.ndim(spacing) == 0:
+        out[:, 1:-1] = (f[:, 2:] - f[:, :-2]) / (2. * spacing)
+        dx_0 = dx_n = spacing
+    else:
+        dx1 = spacing[r0:r0 + n - 2]
+        dx2 = spacing[r0 + 1:r0 + n - 1]
+        a = (-(dx2) / (dx1 * (dx1 + dx2)))[:, None]
+        b = ((dx2 - dx1) / (dx1 * dx2))[:, None]
+        c = (dx1 / (dx2 * (dx1 + dx2)))[:, None]
+        out[:, 1:-1] = a * f[:, :-2] + b * f[:, 1:-1] + c * f[:, 2:]
+        dx_0, dx_n = spacing[r0], spacing[r0 + n - 2]
+    # one-sided differences at first and last row (only used at the raster edges)
+    out[:, 0] = (f[:, 1] - f[:, 0]) / dx_0
+    out[:, -1] = (f[:, -1] - f[:, -2]) / dx_n
+    return out
@@ -10,6 +10,9 @@ reproj_mask: Masks a raster to the area of a shape, and reprojects.
 reproj_rastermatch: Reproject a file to match the shape and projection of
     existing raster.
 reproj_raster: Reproject and clip for a given output resolution, crs and bbox.
+target_grid: Defines common target grid for bbox and resolution.
+reproj_to_grid: Warps raster onto target grid with multithreaded GDAL warping.
+align_rasters: Warps list of rasters onto one common target grid.
 _read_file (internal): Reads raster with rasterio returns numpy array
 aggregate_rasters: Averages (or similar) over multiple files and multiple
     channels.
@@ -22,16 +25,20 @@ raster_query: Given a longitude,latitude value, return the value at that point
 extract_values_from_rasters: Given a list of rasters, extract the values at coords.
 init_logtable: Stores metdata for each step of raster download and processing.
 update_logtable: Updates each the logtable with new information.
+stream_to_file: Writes HTTP response to file in chunks with size and checksum validation.
 """
 
 from glob import glob
 import os
 import json
+import hashlib
 
 import rasterio
 from rasterio.mask import mask
 from rasterio.warp import calculate_default_transform, reproject, Resampling
 from rasterio.plot import show
+from rasterio.windows import Window, transform as window_transform
+from rasterio.transform import from_origin
 
 import numpy as np
 import pandas as pd
@@ -48,10 +55,15 @@ from numba import jit
 
 import warnings
 import logging
+import threading
+from contextlib import contextmanager
 
 from termcolor import colored, cprint
 from alive_progress import alive_bar, config_handler
 
+from geodata_harvester import geotiff
+from geodata_harvester.logtable import LogTable
+
 
 config_handler.set_global(
     force_tty=True,
@@ -77,9 +89,19 @@ def spin(message=None, colour="magenta", events=1, log=False):
     """Spin animation as a progress inidicator"""
     if log:
         logging.info(message)
+    if threading.current_thread() is not threading.main_thread():
+        # Animations of multiple bars interfere when sources are downloaded in parallel
+        return _spin_static(message, colour)
     return alive_bar(events, title=colored("\u2299 " + message, color=colour))
 
 
+@contextmanager
+def _spin_static(message=None, colour="magenta"):
+    """Static progress message for use in worker threads (same interface as spin)"""
+    cprint("\u2299 " + message, color=colour)
+    yield lambda *args, **kwargs: None
+
+
 def msg_info(message, icon=True, log=False):
     """Prints an info message"""
     if log:
@@ -231,29 +253,38 @@ def reproj_mask(filepath, bbox, crscode=4326, filepath_out=None):
             }
         )
 
-        with rasterio.open(filepath_out, "w", **out_meta) as dest:
+        with geotiff.open_raster(filepath_out, **out_meta) as dest:
             dest.write(out_img)
+        geotiff.finalize(filepath_out)
         print("Clipped raster written to:", filepath_out)
 
     return out_img
 
 
-def reproj_rastermatch(infile, matchfile, outfile, nodata):
+def reproj_rastermatch(
+    infile, matchfile, outfile, nodata, resampling="nearest", num_threads="ALL_CPUS", warp_mem_limit=512,
+    max_memory_mb=256
+):
     """
     Reproject a file to match the shape and projection of existing raster.
     Output file is written to disk.
 
+    All bands are warped together with multithreaded GDAL warping, and the output is
+    processed in windows, so that the size of the output is not limited by memory (see _warp).
+
     Parameters
     ----------
     infile : (string) path to input file to reproject
     matchfile : (string) path to raster with desired shape and projection
     outfile : (string) path to output file tif
     nodata : (float) nodata value for output raster
+    resampling : (string) resampling method, e.g. "nearest" (Default), "bilinear", "average"
+    num_threads : (int or "ALL_CPUS") number of warping threads, default all CPUs
+    warp_mem_limit : (int) working memory of warper in MB
+    max_memory_mb : (float) maximum size of output window held in memory in MB
     """
     # open input
     with rasterio.open(infile) as src:
-        src_transform = src.transform
-
         # open input to match
         with rasterio.open(matchfile) as match:
             dst_crs = match.crs
@@ -281,28 +312,28 @@ def reproj_rastermatch(infile, matchfile, outfile, nodata):
         print(
             "Coregistered to shape:", dst_height, dst_width, "\n Affine", dst_transform
         )
-        # open output
-        with rasterio.open(outfile, "w", **dst_kwargs) as dst:
-            # iterate through bands and write using reproject function
-            for i in range(1, src.count + 1):
-                reproject(
-                    source=rasterio.band(src, i),
-                    destination=rasterio.band(dst, i),
-                    src_transform=src.transform,
-                    src_crs=src.crs,
-                    dst_transform=dst_transform,
-                    dst_crs=dst_crs,
-                    resampling=Resampling.nearest,
-                )
+        _warp(
+            src,
+            outfile,
+            dst_kwargs,
+            resampling=resampling,
+            num_threads=num_threads,
+            warp_mem_limit=warp_mem_limit,
+            max_memory_mb=max_memory_mb,
+        )
 
 
 def reproj_raster(
-    infile, outfile, bbox_out, resolution_out=None, crs_out="EPSG:4326", nodata=0
+    infile, outfile, bbox_out, resolution_out=None, crs_out="EPSG:4326", nodata=0, resampling="nearest",
+    num_threads="ALL_CPUS", warp_mem_limit=512, max_memory_mb=256
 ):
     """
     Reproject and clip for a given output resolution, crs and bbox.
     Output file is written to disk.
 
+    All bands are warped together with multithreaded GDAL warping, and the output is
+    processed in windows, so that the size of the output is not limited by memory (see _warp).
+
     Parameters
     ----------
     infile : (string) path to input file to reproject
@@ -311,11 +342,13 @@ def reproj_raster(
     resolution_out : (float) resolution of output raster
     crs_out : default "EPSG:4326"
     nodata : (float) nodata value for output raster
+    resampling : (string) resampling method, e.g. "nearest" (Default), "bilinear", "average"
+    num_threads : (int or "ALL_CPUS") number of warping threads, default all CPUs
+    warp_mem_limit : (int) working memory of warper in MB
+    max_memory_mb : (float) maximum size of output window held in memory in MB
     """
     # open input
     with rasterio.open(infile) as src:
-        src_transform = src.transform
-
         width_out = int((bbox_out[2] - bbox_out[0]) / resolution_out)
         height_out = int((bbox_out[3] - bbox_out[1]) / resolution_out)
 
@@ -340,19 +373,183 @@ def reproj_raster(
             }
         )
         print("Converting to shape:", dst_height, dst_width, "\n Affine", dst_transform)
-        # open output
-        with rasterio.open(outfile, "w", **dst_kwargs) as dst:
-            # iterate through bands and write using reproject function
-            for i in range(1, src.count + 1):
-                reproject(
-                    source=rasterio.band(src, i),
-                    destination=rasterio.band(dst, i),
-                    src_transform=src.transform,
-                    src_crs=src.crs,
-                    dst_transform=dst_transform,
-                    dst_crs=crs_out,
-                    resampling=Resampling.nearest,
-                )
+        _warp(
+            src,
+            outfile,
+            dst_kwargs,
+            resampling=resampling,
+            num_threads=num_threads,
+            warp_mem_limit=warp_mem_limit,
+            max_memory_mb=max_memory_mb,
+        )
+
+
+def _warp(src, outfile, profile, resampling="nearest", num_threads="ALL_CPUS", warp_mem_limit=512, max_memory_mb=256):
+    """
+    Internal function, warps all bands of a raster to a new GeoTIFF with the crs, transform,
+    width, height and nodata of profile.
+
+    The output is processed in windows of rows that fit within max_memory_mb. For each window,
+    all bands are warped in one call with num_threads GDAL threads and a working buffer of
+    warp_mem_limit MB, and only the part of the input that covers the window is read.
+    Band descriptions and tags of the input are copied to the output.
+
+    INPUTS:
+        src: rasterio dataset (opened for reading)
+        outfile: output filename
+        profile: rasterio profile of output
+        resampling: resampling method (name or rasterio Resampling)
+        num_threads: number of warping threads or "ALL_CPUS"
+        warp_mem_limit: working memory of warper in MB
+        max_memory_mb: maximum size of output window in MB
+    """
+    bands = list(range(1, src.count + 1))
+    dtype = np.dtype(profile["dtype"])
+    nodata = profile.get("nodata")
+    width, height = profile["width"], profile["height"]
+    if isinstance(resampling, str):
+        resampling = Resampling[resampling]
+    if num_threads == "ALL_CPUS":
+        num_threads = os.cpu_count()
+    # Number of rows per window, multiple of the output block size where possible
+    nrows = max(1, int(max_memory_mb * 2**20 // (len(bands) * width * dtype.itemsize)))
+    blocksize = geotiff.blocksize()
+    if nrows > blocksize:
+        nrows = nrows // blocksize * blocksize
+    nrows = min(nrows, height)
+    fill = 0 if nodata is None else nodata
+    with geotiff.open_raster(outfile, **profile) as dst:
+        for row in range(0, height, nrows):
+            window = Window(0, row, width, min(nrows, height - row))
+            data = np.full((len(bands), int(window.height), width), fill, dtype=dtype)
+            reproject(
+                source=rasterio.band(src, bands),
+                destination=data,
+                src_nodata=src.nodata,
+                dst_transform=window_transform(window, profile["transform"]),
+                dst_crs=profile["crs"],
+                dst_nodata=nodata,
+                resampling=resampling,
+                num_threads=num_threads,
+                warp_mem_limit=int(warp_mem_limit),
+            )
+            dst.write(data, window=window)
+        for i, description in enumerate(src.descriptions, start=1):
+            if description:
+                dst.set_band_description(i, description)
+            tags = src.tags(i)
+            if tags:
+                dst.update_tags(i, **tags)
+        dst.update_tags(**src.tags())
+    geotiff.finalize(outfile)
+    return outfile
+
+
+def target_grid(bbox, resolution, crs="EPSG:4326"):
+    """
+    Define common target grid for bbox and resolution, with pixel edges at the left and top of bbox.
+
+    Parameters
+    ----------
+    bbox : (left, bottom, right, top) in units of crs
+    resolution : (float) pixel size in units of crs
+    crs : default "EPSG:4326"
+
+    Returns
+    -------
+    grid : dict with crs, transform, width and height of target grid
+    """
+    width = max(1, int(round((bbox[2] - bbox[0]) / resolution)))
+    height = max(1, int(round((bbox[3] - bbox[1]) / resolution)))
+    transform = from_origin(bbox[0], bbox[3], resolution, resolution)
+    return {"crs": CRS.from_user_input(crs), "transform": transform, "width": width, "height": height}
+
+
+def reproj_to_grid(
+    infile, outfile, grid, resampling="nearest", nodata=None, num_threads="ALL_CPUS", warp_mem_limit=512
+):
+    """
+    Warp raster onto target grid (see target_grid), all bands together (see _warp).
+    Output file is written to disk.
+
+    Parameters
+    ----------
+    infile : (string) path to input file to reproject
+    outfile : (string) path to output file tif
+    grid : (dict) target grid with crs, transform, width and height
+    resampling : (string) resampling method, default "nearest"
+    nodata : (float) nodata value for output raster, default nodata of input (or nan for float data)
+    num_threads : (int or "ALL_CPUS") number of warping threads
+    warp_mem_limit : (int) working memory of warper in MB
+    """
+    with rasterio.open(infile) as src:
+        if nodata is None:
+            nodata = src.nodata
+        if (nodata is None) and np.issubdtype(np.dtype(src.dtypes[0]), np.floating):
+            nodata = np.nan
+        profile = src.profile
+        profile.update(
+            crs=grid["crs"], transform=grid["transform"], width=grid["width"], height=grid["height"], nodata=nodata
+        )
+        return _warp(
+            src, outfile, profile, resampling=resampling, num_threads=num_threads, warp_mem_limit=warp_mem_limit
+        )
+
+
+def on_grid(fname, grid, tol=1e-9):
+    """
+    Return True if raster is already on target grid (same crs, transform and shape).
+    """
+    with rasterio.open(fname) as src:
+        if (src.crs != grid["crs"]) or (src.width, src.height) != (grid["width"], grid["height"]):
+            return False
+        return src.transform.almost_equals(grid["transform"], precision=tol * abs(grid["transform"].a))
+
+
+def align_rasters(
+    raster_files, outpath, grid, resampling="nearest", num_threads="ALL_CPUS", warp_mem_limit=512, root=None
+):
+    """
+    Warp rasters onto one common target grid (analysis-ready grid), so that all layers
+    share the same pixels and point values can be extracted with one index computation
+    for all layers (see extract_values_from_rasters).
+
+    Parameters
+    ----------
+    raster_files : list of raster file paths
+    outpath : (string) output folder, aligned rasters keep their path relative to root
+        (e.g. root/silo/rain.tif is saved as outpath/silo/rain.tif)
+    grid : (dict) target grid with crs, transform, width and height (see target_grid)
+    resampling, num_threads, warp_mem_limit : see reproj_to_grid
+    root : (string) folder of the input rasters that is replaced by outpath,
+        default: common folder of all raster_files
+
+    Returns
+    -------
+    aligned_files : list of aligned raster file paths in same order as raster_files.
+        Rasters that are already on the target grid are not copied.
+    """
+    if root is None:
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(fname)) for fname in raster_files])
+    aligned_files = []
+    for fname in raster_files:
+        if on_grid(fname, grid):
+            aligned_files.append(fname)
+            continue
+        relpath = os.path.relpath(os.path.abspath(fname), os.path.abspath(root))
+        if relpath.startswith(os.pardir):
+            raise ValueError(f"{fname} is not in folder {root}")
+        outfile = os.path.join(outpath, relpath)
+        if os.path.abspath(outfile) == os.path.abspath(fname):
+            raise ValueError(f"Output folder {outpath} must differ from folder of {fname}")
+        if outfile in aligned_files:
+            raise ValueError(f"{fname} and another raster are both aligned to {outfile}")
+        os.makedirs(os.path.dirname(outfile), exist_ok=True)
+        reproj_to_grid(
+            fname, outfile, grid, resampling=resampling, num_threads=num_threads, warp_mem_limit=warp_mem_limit
+        )
+        aligned_files.append(outfile)
+    return aligned_files
 
 
 def _read_file(file):
@@ -448,8 +645,9 @@ def aggregate_rasters(
     # Write output file
     list_outfnames = []
     for a in aggcheck:
-        with rasterio.open(outfile + "_" + a + ".tif", "w", **meta) as dst:
+        with geotiff.open_raster(outfile + "_" + a + ".tif", **meta) as dst:
             dst.write(aggdict[a].astype(rasterio.float32), 1)
+        geotiff.finalize(outfile + "_" + a + ".tif")
         print(a, "of filelist saved in: ", outfile + "_" + a + ".tif")
         list_outfnames.append(outfile + "_" + a + ".tif")
     return list_outfnames
@@ -539,10 +737,9 @@ def aggregate_multiband(
         # Write output file
         for a in aggcheck:
             outstring = outfile + "_" + a + "_channel_" + channel + ".tif"
-            with rasterio.open(
-                outstring, "w", **meta
-            ) as dst:
+            with geotiff.open_raster(outstring, **meta) as dst:
                 dst.write(aggdict[a].astype(rasterio.float32), 1)
+            geotiff.finalize(outstring)
             print(
                 a,
                 "of filelist saved in: ",
@@ -610,41 +807,28 @@ def raster_query(longs, lats, rasters, titles=None):
         # Get the transformation crs data
         gt = raster.transform
 
-        # This will only be the first band, usally multiband has same index.
-        arr = raster.read(1)
-
         if titles is not None:
             colname = titles[rasters.index(filepath)]
         else:
             colname = Path(filepath).stem
             # colname = filepath.split("/")[-1][:-4]
 
-        # Interogate the tiff file as an array
-
         # FIXME Check the number of bands and print a warning if more than 1
 
-        # Shape of raster
-        # print("Raster pixel size:", np.shape(arr))
-
-        # Slowest part of this function.
-        # Speed up with Numba/Dask etc
-        # (although previous attempts have not been worth it.)
-        # Query the raster at the points of interest
-        with spin(f"• {filename} | pixel size: {np.shape(arr)}", "blue") as s:
-            values = []
-            for (lon, lat) in zip(longs, lats):
-
-                # Convert lat/lon to raster units-index
-                point = _get_coords_at_point(gt, lon, lat)
-
-                # This will fail for small areas or on boundaries
-                try:
-                    val = arr[point[0], point[1]]
-                except:
-                    # print(lon,lat,point[0],point[1],"has failed.")
-                    val = 0
-                values.append(val)
+        # Query the raster at the points of interest.
+        # This will only be the first band, usally multiband has same index.
+        # Only the windows that contain points are read (see _read_pixels).
+        with spin(f"• {filename} | pixel size: {raster.shape}", "blue") as s:
+            # Convert lat/lon to raster units-index
+            points = [_get_coords_at_point(gt, lon, lat) for (lon, lat) in zip(longs, lats)]
+            rows = np.array([point[0] for point in points], dtype=np.int64)
+            cols = np.array([point[1] for point in points], dtype=np.int64)
+            # Points outside of raster are set to 0
+            inside = (rows >= 0) & (rows < raster.height) & (cols >= 0) & (cols < raster.width)
+            values = np.zeros(len(rows), dtype=raster.dtypes[0])
+            values[inside] = _read_pixels(raster, rows[inside], cols[inside], bands=[1])[:, 0]
             s(1)
+        raster.close()
 
         # dd the values at the points to the dataframe
         gdf[filepath] = values
@@ -653,12 +837,18 @@ def raster_query(longs, lats, rasters, titles=None):
     return gdf
 
 
-def extract_values_from_rasters(coords, raster_files, method = "nearest"):
+def extract_values_from_rasters(coords, raster_files, method = "nearest", max_memory_mb = 256):
     """
     Extract values from a list of raster files at given coordinates using rioxarray.
     Values will be extracted for all bands in each raster file.
     Return geopandas DataFrame with extracted values and geometry.
 
+    For the default method "nearest", all coordinates are converted to pixel indices
+    in one affine transformation and each raster is sampled with vectorized indexing of
+    only the windows that contain points (see _sample_raster), which is much faster than
+    selecting points one by one and keeps memory use bounded for very large rasters.
+    Pixel indices are computed only once for all rasters on the same grid (see align_rasters).
+
     Input:
         coords: A list of tuples containing longitude and latitude coordinates.
                 Format: [(lng1, lat1), (lng2, lat2), ...]
@@ -674,6 +864,9 @@ def extract_values_from_rasters(coords, raster_files, method = "nearest"):
             - backfill / bfill: propagate next valid index value backward
             - None: only exact matches
 
+        max_memory_mb: memory budget in MB for reading raster data (method "nearest" only).
+                For larger rasters only the blocks that contain points are read.
+
     Output:
         A geopandas DataFrame containing the extracted values and geometry, where each row represents
         a coordinate point and the columns represent the bands for each raster file.
@@ -681,6 +874,9 @@ def extract_values_from_rasters(coords, raster_files, method = "nearest"):
     """
     all_coords_data = []
     column_names = []
+    coords = np.asarray(coords)
+    # Pixel indices of coordinates by raster grid, shared by all rasters on the same grid
+    index_cache = {}
 
     with spin("Extracting values from raster files...", "blue") as s:
         for raster_file in raster_files:
@@ -688,16 +884,21 @@ def extract_values_from_rasters(coords, raster_files, method = "nearest"):
             ds = rxr.open_rasterio(raster_file)
             
             # Extract values for all coordinates
-            coords_data = []
-            for lng, lat in coords:
-                # Select the nearest lat and lon coordinates from the dataset
-                data = ds.sel(x=lng, y=lat, method=method)
-                
-                # Convert the data to a numpy array and flatten it
-                data_array = data.values.flatten().tolist()
-                
-                # Add the extracted values to the list
-                coords_data.append(data_array)
+            if method == "nearest":
+                coords_data = _sample_raster(
+                    raster_file, coords[:, 0], coords[:, 1], max_memory_mb=max_memory_mb, index_cache=index_cache
+                )
+            else:
+                coords_data = []
+                for lng, lat in coords:
+                    # Select the nearest lat and lon coordinates from the dataset
+                    data = ds.sel(x=lng, y=lat, method=method)
+
+                    # Convert the data to a numpy array and flatten it
+                    data_array = data.values.flatten().tolist()
+
+                    # Add the extracted values to the list
+                    coords_data.append(data_array)
 
             # Concatenate the extracted values from all raster files
             all_coords_data.append(coords_data)
@@ -713,6 +914,7 @@ def extract_values_from_rasters(coords, raster_files, method = "nearest"):
                     band_names = ds.band.values.tolist()
             except:
                 band_names = ds.band.values.tolist()
+            ds.close()
             # get the raster name
             raster_name = os.path.basename(raster_file).split(".")[0]
             # Add the raster name to the band names
@@ -740,6 +942,111 @@ def extract_values_from_rasters(coords, raster_files, method = "nearest"):
     return gdf
 
 
+def _coords_to_index(transform, width, height, xs, ys):
+    """
+    Internal function, converts arrays of coordinates into row and column indices
+    of the nearest pixel centers in a raster with the given affine transform.
+    Points outside the raster are assigned to the nearest edge pixel
+    (same as xarray selection with method="nearest").
+
+    INPUTS:
+        transform: affine transform of raster
+        width, height: number of columns and rows of raster
+        xs, ys: arrays of x and y coordinates
+
+    RETURNS:
+        rows, cols: arrays of row and column indices
+    """
+    cols, rows = ~transform * (np.asarray(xs, dtype=float), np.asarray(ys, dtype=float))
+    cols = np.clip(np.floor(cols), 0, width - 1).astype(np.int64)
+    rows = np.clip(np.floor(rows), 0, height - 1).astype(np.int64)
+    return rows, cols
+
+
+def _sample_raster(raster_file, xs, ys, max_memory_mb=256, index_cache=None):
+    """
+    Internal function, returns values of all bands of raster at nearest pixels to coordinates.
+    Only windows that contain points are read from file (see _read_pixels).
+
+    INPUTS:
+        raster_file: raster filename
+        xs, ys: arrays of x and y coordinates (in crs of raster)
+        max_memory_mb: memory budget in MB for reading raster data
+        index_cache: optional dict of pixel indices by raster grid, so that indices are
+            computed only once for all rasters on the same grid (see align_rasters)
+
+    RETURNS:
+        values: array with shape (number of points, number of bands)
+    """
+    with rasterio.open(raster_file) as src:
+        grid = (src.transform, src.width, src.height)
+        if (index_cache is not None) and (grid in index_cache):
+            rows, cols = index_cache[grid]
+        else:
+            rows, cols = _coords_to_index(src.transform, src.width, src.height, xs, ys)
+            if index_cache is not None:
+                index_cache[grid] = (rows, cols)
+        return _read_pixels(src, rows, cols, max_memory_mb=max_memory_mb)
+
+
+def _read_pixels(src, rows, cols, bands=None, max_memory_mb=256):
+    """
+    Internal function, reads values at pixel indices from an open rasterio dataset.
+
+    If the window enclosing all points fits in the memory budget, it is read at once.
+    Otherwise points are grouped by tiles of the internal block structure of the raster
+    and only tiles that contain points are read, one at a time. Memory use is then
+    limited to about one tile, independent of raster size.
+
+    INPUTS:
+        src: rasterio dataset (opened for reading)
+        rows, cols: arrays of row and column indices (must be within raster)
+        bands: list of band indices (1-based), default all bands
+        max_memory_mb: memory budget in MB for reading raster data
+
+    RETURNS:
+        values: array with shape (number of points, number of bands)
+    """
+    if bands is None:
+        bands = list(range(1, src.count + 1))
+    dtype = src.dtypes[bands[0] - 1]
+    values = np.empty((len(rows), len(bands)), dtype=dtype)
+    if len(rows) == 0:
+        return values
+    nbytes_pixel = len(bands) * np.dtype(dtype).itemsize
+    max_bytes = max_memory_mb * 1024**2
+    row_off, col_off = rows.min(), cols.min()
+    nrows, ncols = rows.max() - row_off + 1, cols.max() - col_off + 1
+    if nrows * ncols * nbytes_pixel <= max_bytes:
+        data = src.read(bands, window=Window(col_off, row_off, ncols, nrows))
+        values[:] = data[:, rows - row_off, cols - col_off].T
+        return values
+
+    # Tiles are multiples of the internal blocks, with up to 512 x 512 pixels
+    block_height, block_width = src.block_shapes[bands[0] - 1]
+    scale = max(1, int(np.sqrt(512 * 512 / (block_height * block_width))))
+    tile_height = min(block_height * scale, src.height)
+    tile_width = min(block_width * scale, src.width)
+    # Group points by tile
+    ntiles_x = int(np.ceil(src.width / tile_width))
+    tile_ids = (rows // tile_height) * ntiles_x + cols // tile_width
+    order = np.argsort(tile_ids, kind="stable")
+    tile_ids_sorted = tile_ids[order]
+    splits = np.flatnonzero(np.diff(tile_ids_sorted)) + 1
+    for idx in np.split(order, splits):
+        tile_row = (rows[idx[0]] // tile_height) * tile_height
+        tile_col = (cols[idx[0]] // tile_width) * tile_width
+        window = Window(
+            tile_col,
+            tile_row,
+            min(tile_width, src.width - tile_col),
+            min(tile_height, src.height - tile_row),
+        )
+        data = src.read(bands, window=window)
+        values[idx] = data[:, rows[idx] - tile_row, cols[idx] - tile_col].T
+    return values
+
+
 def init_logtable():
     """
     Create a log table to store information from the raster download or processing.
@@ -773,9 +1080,11 @@ def update_logtable(
     """
     Update the dataframe table with the information from the raster download or processing.
     The dataframe is simultaneoulsy saved to a csv file in default output directory.
+    If df_log is a LogTable (see logtable.py), the entries are appended to its database
+    instead, and the table is exported only when requested (LogTable.to_csv).
 
     INPUTS
-    df_log: dataframe to update
+    df_log: dataframe or LogTable to update
     filenames: list of filenames to add to the dataframe (captured in output of getdata_* functions)
     layernames: list of layernames to add to the dataframe (must be same length as filenames)
     datasource: datasource of the rasters (e.g. 'SLGA', 'SILO', 'DEA', see settings)
@@ -785,7 +1094,7 @@ def update_logtable(
     loginfos: string or list of log information strings to add to the dataframe;
 
     RETURNS
-    df_log: updated dataframe
+    df_log: updated dataframe (or LogTable)
     """
     # First automatically check consistency of inputs and set defaults if necessary
     if len(filenames) != len(layernames):
@@ -820,17 +1129,6 @@ def update_logtable(
             layernames[i] + "_" + agfunctions[i] for i in range(len(layernames))
         ]
 
-    # check if you are adding a duplicate entry to the log
-    for f in filenames:
-        warnings.simplefilter(action="ignore", category=FutureWarning)
-        if f in df_log.filename_out.values:
-            if force == False:
-                print("Error: " + str(f) + " exists in df_log! Dataframe not updated.\nCheck your inputs or overwrite with force=True")
-                return df_log
-            elif force==True:
-                print("Warning: " + str(f) + " exists in df_log and has been overitten by force=True")
-                df_log.drop(df_log[df_log.filename_out != f].index, inplace=True)
-
     # check if loginfos is a list or a string
     if type(loginfos) == str:
         loginfos = [loginfos] * len(layernames)
@@ -851,6 +1149,22 @@ def update_logtable(
         "filename_out": filenames,
         "loginfo": loginfos,
     }
+    # Append to log database, duplicates are checked by its index
+    if isinstance(df_log, LogTable):
+        df_log.add(data_add, force=force)
+        return df_log
+
+    # check if you are adding a duplicate entry to the log
+    existing = set(df_log.filename_out.values)
+    for f in filenames:
+        if f in existing:
+            if force == False:
+                print("Error: " + str(f) + " exists in df_log! Dataframe not updated.\nCheck your inputs or overwrite with force=True")
+                return df_log
+            elif force==True:
+                print("Warning: " + str(f) + " exists in df_log and has been overitten by force=True")
+                df_log.drop(df_log[df_log.filename_out == f].index, inplace=True)
+
     # Add to log dataframe
     df_log = pd.concat([df_log, pd.DataFrame(data_add)], ignore_index=True)
     # Save to csv in settings.outpath
@@ -903,3 +1217,46 @@ def coreg_raster(i0, j0, data, region):
     pts = np.array(list(pts_iterator))
 
     return pts
+
+
+def stream_to_file(response, outfname, expected_size=None, checksum=None, chunk_size=2**20):
+    """
+    Write body of streamed HTTP response (requests with stream=True) to file in chunks.
+
+    The data is written to a temporary file (outfname + ".part"), which is renamed to outfname
+    after the download is complete and validated, so that outfname never contains a partial file.
+
+    INPUTS
+        response: requests.Response, requested with stream=True
+        outfname: output file name
+        expected_size: expected size in bytes (optional).
+            If not given, the Content-Length of the response is used (if available).
+        checksum: expected sha256 hex digest of file (optional)
+        chunk_size: size of chunks in bytes
+
+    RETURNS
+        outfname
+    """
+    if (expected_size is None) and ("Content-Encoding" not in response.headers):
+        content_length = response.headers.get("Content-Length")
+        if content_length is not None:
+            expected_size = int(content_length)
+    sha256 = hashlib.sha256() if checksum is not None else None
+    fname_tmp = outfname + ".part"
+    size = 0
+    try:
+        with open(fname_tmp, "wb") as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+                size += len(chunk)
+                if sha256 is not None:
+                    sha256.update(chunk)
+        if (expected_size is not None) and (size != expected_size):
+            raise IOError(f"Incomplete download of {outfname}: {size} of {expected_size} bytes received")
+        if (sha256 is not None) and (sha256.hexdigest() != checksum.lower()):
+            raise IOError(f"Checksum mismatch for {outfname}")
+        os.replace(fname_tmp, outfname)
+    finally:
+        if os.path.exists(fname_tmp):
+            os.remove(fname_tmp)
+    return outfname
@@ -47,6 +47,28 @@ def check_schema(settings):
         "temp_intervals": int,
         "temp_buffer": int,
         "target_sources": dict,
+        "max_workers": [int, type(None)],
+        "wcs_cache_dir": [str, type(None)],
+        "max_connections": [int, type(None)],
+        "cache_dir": [str, type(None)],
+        "cache_max_size_gb": [float, int, type(None)],
+        "download_timeout": [float, int, type(None)],
+        "download_retries": [int, type(None)],
+        "silo_download_workers": [int, type(None)],
+        "silo_cpu_workers": [int, type(None)],
+        "output_cog": [bool, type(None)],
+        "output_compress": [str, type(None)],
+        "output_blocksize": [int, type(None)],
+        "output_overviews": [bool, type(None)],
+        "output_zarr": [bool, type(None)],
+        "zarr_chunks": [dict, type(None)],
+        "zarr_compressor": [str, type(None)],
+        "zarr_compress_level": [int, type(None)],
+        "align_grid": [bool, type(None)],
+        "warp_threads": [int, str, type(None)],
+        "warp_mem_limit": [int, float, type(None)],
+        "terrain_dtype": [str, type(None)],
+        "terrain_workers": [int, type(None)],
     }
     for conf in list(settings.keys()):
         if conf not in list(conf_schema.keys()):
@@ -117,15 +139,18 @@ def check_target_dates(dates):
     return True
 
 
-def check_target_size(bbox, target_res, nmax_pixels=1e8):
+def check_target_size(bbox, target_res, nmax_pixels=1e10, tile_size=4096):
     """
-    Validate bounding box and check number of raster pixels
+    Validate bounding box and check number of raster pixels.
+    Images with more than tile_size pixels in width or height are downloaded in tiles
+    (see wcsclient.download_coverage).
 
     INPUT
     -----
     bbox: list, target bounding box
     target_res: float or int, target resolution
     nmax_pixels: maximum number of raster pixels for target image (nmax = nx * ny)
+    tile_size: maximum width and height in pixels of a single image request
     """
     if (bbox != None) & (bbox != ""):
         # Check if bbox is correct order: [left, bottom, right, top]
@@ -144,6 +169,10 @@ def check_target_size(bbox, target_res, nmax_pixels=1e8):
                 "Reduce size of bounding box or set target resolution to larger value."
             )
             return False
+        if (nx > tile_size) | (ny > tile_size):
+            print(
+                f"Requested image is large ({npix} pixels) and will be downloaded in tiles."
+            )
     return True
 
 
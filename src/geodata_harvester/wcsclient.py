@@ -0,0 +1,608 @@
+"""
+Shared Web Coverage Service (WCS) clients.
+
+Creating an owslib WebCoverageService object downloads and parses the full GetCapabilities
+document of a server, which can take several seconds for large services such as DEA.
+Instead of creating a new client for every image request, all getdata modules request their
+WCS clients via get_wcs(), which keeps one client per (url, version) in memory.
+
+Clients are reused until their time-to-live (TTL) is expired. Optionally, the capabilities
+documents can be stored on disk so that they are also reused between runs, e.g.:
+
+    from geodata_harvester import wcsclient
+    wcsclient.configure(ttl=3600, cache_dir="~/.cache/geodata_harvester/capabilities")
+
+Concurrent coverage requests (e.g. parallel downloads of DEA images) are limited per host,
+see host_slot() and the option max_connections of configure().
+
+Coverages are downloaded with download_coverage() and streamed to disk in chunks.
+Images larger than tile_size pixels
+in width or height are split into tiles on the same pixel grid, which are requested
+concurrently (each tile is retried individually on failure) and written window by window
+into one output GeoTIFF, so that the full mosaic never has to be held in memory.
+If the download cache is enabled (see cache.py), requests are served from the cache, and
+GeoTIFF requests that lie within a cached raster of the same layer at the same or finer
+resolution are cropped and resampled locally instead of requested from the server.
+
+This package is part of the Data Harvester project developed for the Agricultural Research Federation (AgReFed).
+
+Copyright 2023 Sydney Informatics Hub (SIH), The University of Sydney
+
+This open-source software is released under the LGPL-3.0 License.
+"""
+
+import os
+import time
+import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse, urlencode
+import requests
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window, from_bounds
+from rasterio.enums import Resampling
+from owslib.wcs import WebCoverageService
+from owslib.etree import etree
+from owslib.coverage.wcs100 import WebCoverageService_1_0_0
+from owslib.util import ServiceException, makeString
+
+from geodata_harvester import cache, geotiff, utils
+
+# Default time-to-live for clients in memory and capabilities on disk (in seconds)
+# and maximum number of concurrent requests per host.
+# Images larger than tile_size pixels (width or height) are downloaded in tiles,
+# each tile is retried up to tile_retries times.
+_config = {
+    "ttl": 3600,
+    "disk_ttl": 86400,
+    "cache_dir": None,
+    "max_connections": 4,
+    "tile_size": 4096,
+    "tile_retries": 2,
+}
+# Registry of clients: (url, version) -> (creation time, client)
+_clients = {}
+_lock = threading.Lock()
+# One lock per (url, version) so that concurrent requests wait for the first capabilities download
+_key_locks = {}
+# Semaphores limiting concurrent requests per host
+_host_semaphores = {}
+
+
+def configure(
+    ttl=None,
+    disk_ttl=None,
+    cache_dir=None,
+    max_connections=None,
+    tile_size=None,
+    tile_retries=None,
+):
+    """
+    Configure the WCS client registry.
+
+    Parameters
+    ----------
+    ttl : int, optional
+        time-to-live of clients in memory in seconds
+    disk_ttl : int, optional
+        time-to-live of capabilities documents stored on disk in seconds
+    cache_dir : str, optional
+        directory for storing capabilities documents between runs.
+        Set to False to disable the disk storage.
+    max_connections : int, optional
+        maximum number of concurrent requests per host (Default: 4)
+    tile_size : int, optional
+        maximum width and height in pixels of a single coverage request (Default: 4096)
+    tile_retries : int, optional
+        number of retries for each failed tile request (Default: 2)
+    """
+    if ttl is not None:
+        _config["ttl"] = ttl
+    if disk_ttl is not None:
+        _config["disk_ttl"] = disk_ttl
+    if cache_dir is not None:
+        if cache_dir is False:
+            _config["cache_dir"] = None
+        else:
+            cache_dir = os.path.expanduser(cache_dir)
+            os.makedirs(cache_dir, exist_ok=True)
+            _config["cache_dir"] = cache_dir
+    if max_connections is not None:
+        with _lock:
+            _config["max_connections"] = max(1, int(max_connections))
+            # new limit applies to all semaphores created from now on
+            _host_semaphores.clear()
+    if tile_size is not None:
+        _config["tile_size"] = max(1, int(tile_size))
+    if tile_retries is not None:
+        _config["tile_retries"] = max(0, int(tile_retries))
+
+
+def clear(disk=False):
+    """
+    Remove all clients from the registry.
+
+    Parameters
+    ----------
+    disk : bool
+        if True, also remove capabilities documents stored on disk
+    """
+    with _lock:
+        _clients.clear()
+    if disk and _config["cache_dir"] is not None:
+        for fname in os.listdir(_config["cache_dir"]):
+            if fname.endswith(".xml"):
+                os.remove(os.path.join(_config["cache_dir"], fname))
+
+
+def get_wcs(url, version="1.0.0", timeout=300):
+    """
+    Return a WebCoverageService client for url and version.
+
+    The capabilities are only requested from the server if no valid client
+    is available in memory or on disk.
+
+    Parameters
+    ----------
+    url : str
+        url of wcs server
+    version : str
+        WCS version, default "1.0.0". If None, the version is determined by the server.
+    timeout : int
+        timeout in seconds for the capabilities request
+
+    Returns
+    -------
+    wcs : owslib WebCoverageService object
+    """
+    key = (url, version)
+    with _lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+    with key_lock:
+        with _lock:
+            entry = _clients.get(key)
+        if entry is not None and time.time() - entry[0] < _config["ttl"]:
+            return entry[1]
+        xml = _read_capabilities(url, version)
+        if xml is not None:
+            wcs = WebCoverageService(url, version=version, xml=xml, timeout=timeout)
+        else:
+            wcs = WebCoverageService(url, version=version, timeout=timeout)
+            _write_capabilities(url, version, wcs)
+        with _lock:
+            _clients[key] = (time.time(), wcs)
+    return wcs
+
+
+def get_title(url, identifier, version="1.0.0", timeout=300):
+    """
+    Return title of coverage layer identifier of WCS server.
+
+    If the download cache is enabled, the title is stored in the cache with the request
+    parameters (see cache.py), so that file names based on the title are the same for cached
+    and new downloads and no capabilities request is needed once the title is cached.
+
+    Parameters
+    ----------
+    url : str
+        url of wcs server
+    identifier : str
+        layer identifier
+    version : str
+        WCS version, default "1.0.0"
+    timeout : int
+        timeout in seconds for the capabilities request
+
+    Returns
+    -------
+    title : str
+    """
+    if not cache.enabled():
+        return get_wcs(url, version=version, timeout=timeout)[identifier].title
+
+    def _save(fname):
+        with open(fname, "w", encoding="utf-8") as f:
+            f.write(get_wcs(url, version=version, timeout=timeout)[identifier].title)
+
+    fname, _ = cache.fetch_path(_save, ".txt", source=url, identifier=identifier, version=version, request="title")
+    with open(fname, encoding="utf-8") as f:
+        return f.read()
+
+
+def host_slot(url):
+    """
+    Return a semaphore that limits the number of concurrent requests to the host of url.
+
+    Usage:
+        with wcsclient.host_slot(url):
+            data = wcs.getCoverage(...)
+
+    Parameters
+    ----------
+    url : str
+        url of wcs server
+
+    Returns
+    -------
+    threading.BoundedSemaphore (to be used as context manager)
+    """
+    host = urlparse(url).netloc
+    with _lock:
+        semaphore = _host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(_config["max_connections"])
+            _host_semaphores[host] = semaphore
+    return semaphore
+
+
+def download_coverage(
+    outfname,
+    url,
+    identifier,
+    bbox,
+    crs="EPSG:4326",
+    format="GeoTIFF",
+    width=None,
+    height=None,
+    resx=None,
+    resy=None,
+    version="1.0.0",
+    timeout=300,
+    **kwargs,
+):
+    """
+    Download coverage from WCS server and save to file.
+
+    Images with more than tile_size pixels in width or height are requested in tiles
+    (GeoTIFF only), which are downloaded concurrently and mosaicked into outfname.
+    If the download cache is enabled, cached files and crops of cached larger rasters
+    are used instead (see cache.py).
+    The output image size is either given by width and height or by resolution resx and resy.
+
+    Parameters
+    ----------
+    outfname : str
+        output file name
+    url : str
+        url of wcs server
+    identifier : str
+        layer identifier
+    bbox : list
+        bounding box [minx, miny, maxx, maxy]
+    crs : str
+        crs of bounding box and output, default 'EPSG:4326'
+    format : str
+        output format, default "GeoTIFF"
+    width, height : int, optional
+        output image size in pixels
+    resx, resy : float, optional
+        output resolution in units of crs
+    version : str
+        WCS version, default "1.0.0"
+    timeout : int
+        timeout in seconds for the capabilities and coverage requests
+    **kwargs : dict
+        additional arguments passed to getCoverage (e.g. time, Styles)
+
+    Returns
+    -------
+    outfname : str
+    """
+    params = dict(source=url, identifier=identifier, crs=crs, format=format, version=version, **kwargs)
+    grid = dict(bbox=bbox, width=width, height=height, resx=resx, resy=resy)
+    if cache.enabled() and (format.lower() == "geotiff") and not cache.contains(**params, **grid):
+        # Crop from cached raster of a larger region at the same or finer resolution (if any)
+        # (not possible if output size is determined by server)
+        nx, ny = _grid_shape(bbox, width, height, resx, resy)
+        if nx > 0 and ny > 0:
+            fname_cache = cache.find_superset(bbox, (bbox[2] - bbox[0]) / nx, (bbox[3] - bbox[1]) / ny, **params)
+            if fname_cache is not None:
+                _crop_coverage(fname_cache, outfname, bbox, nx, ny)
+                return outfname
+    # Requests that are found in the download cache (see cache.py) need no network access
+    cache.fetch(
+        outfname,
+        lambda fname: _download_coverage(
+            fname, url, identifier, bbox, crs, format, width, height, resx, resy, version, timeout, **kwargs
+        ),
+        **params,
+        **grid,
+    )
+    return outfname
+
+
+def _download_coverage(
+    outfname, url, identifier, bbox, crs, format, width, height, resx, resy, version, timeout, **kwargs
+):
+    """
+    Download coverage from WCS server and save to file (see download_coverage).
+    """
+    wcs = get_wcs(url, version=version, timeout=timeout)
+    nx, ny = _grid_shape(bbox, width, height, resx, resy)
+    tile_size = _config["tile_size"]
+    if (nx <= tile_size and ny <= tile_size) or (format.lower() != "geotiff"):
+        with host_slot(url):
+            _stream_coverage(
+                wcs,
+                outfname,
+                timeout=timeout,
+                identifier=identifier,
+                bbox=bbox,
+                format=format,
+                crs=crs,
+                width=width,
+                height=height,
+                resx=resx,
+                resy=resy,
+                **kwargs,
+            )
+        if format.lower() == "geotiff":
+            # Tiling and compression of server images vary, convert to output layout
+            geotiff.rewrite(outfname)
+        return outfname
+
+    # Split image into tiles on the pixel grid of the full image
+    xres = (bbox[2] - bbox[0]) / nx
+    yres = (bbox[3] - bbox[1]) / ny
+    windows = [
+        Window(col, row, min(tile_size, nx - col), min(tile_size, ny - row))
+        for row in range(0, ny, tile_size)
+        for col in range(0, nx, tile_size)
+    ]
+
+    def _fetch(window):
+        # Tile is streamed to a temporary file, so that only a block of rows is held in memory at a time
+        fname_tile = f"{outfname}.{int(window.row_off)}_{int(window.col_off)}.tile"
+        tile_bbox = [
+            bbox[0] + window.col_off * xres,
+            bbox[3] - (window.row_off + window.height) * yres,
+            bbox[0] + (window.col_off + window.width) * xres,
+            bbox[3] - window.row_off * yres,
+        ]
+        for attempt in range(_config["tile_retries"] + 1):
+            try:
+                with host_slot(url):
+                    return _stream_coverage(
+                        wcs,
+                        fname_tile,
+                        timeout=timeout,
+                        identifier=identifier,
+                        bbox=tile_bbox,
+                        format=format,
+                        crs=crs,
+                        width=int(window.width),
+                        height=int(window.height),
+                        **kwargs,
+                    )
+            except Exception:
+                if attempt == _config["tile_retries"]:
+                    raise
+                time.sleep(2**attempt)
+
+    # Write tiles to temporary file first, so that incomplete mosaics are never left behind
+    fname_tmp = f"{outfname}.part"
+    dst = None
+    max_pending = 2 * _config["max_connections"]
+    pending = {}
+    try:
+        with ThreadPoolExecutor(max_workers=_config["max_connections"]) as executor:
+            todo = list(windows)
+            while todo or pending:
+                # Keep the number of tiles on disk bounded
+                while todo and len(pending) < max_pending:
+                    window = todo.pop(0)
+                    pending[executor.submit(_fetch, window)] = window
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    window = pending.pop(future)
+                    fname_tile = future.result()
+                    try:
+                        with rasterio.open(fname_tile) as tile:
+                            if dst is None:
+                                dst = _open_mosaic(fname_tmp, tile, bbox, xres, yres, nx, ny, crs)
+                            _write_tile(tile, dst, window)
+                    finally:
+                        os.remove(fname_tile)
+        dst.close()
+        geotiff.finalize(fname_tmp)
+        os.replace(fname_tmp, outfname)
+    except Exception:
+        if dst is not None:
+            dst.close()
+        if os.path.exists(fname_tmp):
+            os.remove(fname_tmp)
+        # Tiles of cancelled or failed requests
+        for future in pending:
+            if future.done() and not future.cancelled() and (future.exception() is None):
+                os.remove(future.result())
+        raise
+    return outfname
+
+
+def _write_tile(tile, dst, window, block_rows=None):
+    """
+    Write tile into window of mosaic dst in blocks of rows (tiles with other shape than the window
+    are resampled with nearest neighbour as a whole).
+    """
+    out_shape = (tile.count, int(window.height), int(window.width))
+    if tile.shape != out_shape[1:]:
+        dst.write(tile.read(out_shape=out_shape, resampling=Resampling.nearest), window=window)
+        return
+    block_rows = block_rows or geotiff.blocksize()
+    for row in range(0, tile.height, block_rows):
+        nrows = min(block_rows, tile.height - row)
+        array = tile.read(window=Window(0, row, tile.width, nrows))
+        dst.write(array, window=Window(window.col_off, window.row_off + row, window.width, nrows))
+
+
+def _stream_coverage(wcs, outfname, timeout=30, **kwargs):
+    """
+    Request coverage and write response to outfname in chunks (see utils.stream_to_file),
+    so that the response is never held in memory as a whole.
+
+    The GetCoverage request of WCS 1.0.0 is sent with requests directly, since owslib reads
+    the full response into memory. Other clients fall back to owslib's getCoverage, whose
+    response is copied to file in chunks.
+    """
+    if not isinstance(wcs, WebCoverageService_1_0_0):
+        data = wcs.getCoverage(timeout=timeout, **kwargs)
+        fname_tmp = outfname + ".part"
+        try:
+            with open(fname_tmp, "wb") as f:
+                shutil.copyfileobj(data, f, 2**20)
+            os.replace(fname_tmp, outfname)
+        finally:
+            if os.path.exists(fname_tmp):
+                os.remove(fname_tmp)
+        return outfname
+    try:
+        base_url = next(
+            m.get("url") for m in wcs.getOperationByName("GetCoverage").methods if m.get("type").lower() == "get"
+        )
+    except (KeyError, StopIteration):
+        base_url = wcs.url
+    # Same request parameters as owslib WebCoverageService_1_0_0.getCoverage
+    request = {"version": wcs.version, "request": "GetCoverage", "service": "WCS"}
+    request["Coverage"] = kwargs.pop("identifier")
+    bbox = kwargs.pop("bbox")
+    request["BBox"] = ",".join([makeString(x) for x in bbox])
+    time_ = kwargs.pop("time", None)
+    if time_:
+        request["time"] = ",".join(time_)
+    for key in ["crs", "format", "width", "height", "resx", "resy"]:
+        value = kwargs.pop(key, None)
+        if value or (key == "format"):
+            request[key] = value
+    request.update(kwargs)
+    auth = (wcs.auth.username, wcs.auth.password) if (wcs.auth.username and wcs.auth.password) else None
+    response = requests.get(
+        base_url,
+        params=urlencode(request),
+        headers=wcs.headers,
+        cookies=wcs.cookies,
+        auth=auth,
+        verify=wcs.auth.verify,
+        timeout=timeout,
+        stream=True,
+    )
+    with response:
+        if response.status_code in [400, 401]:
+            raise ServiceException(response.text)
+        response.raise_for_status()
+        if response.headers.get("Content-Type") in ["text/xml", "application/xml", "application/vnd.ogc.se_xml"]:
+            # Service exception reported with status 200
+            raise ServiceException(response.text)
+        utils.stream_to_file(response, outfname)
+    return outfname
+
+
+def _grid_shape(bbox, width=None, height=None, resx=None, resy=None):
+    """
+    Return number of pixels (nx, ny) of output image.
+    """
+    if width and height:
+        return int(width), int(height)
+    if resx and resy:
+        nx = int(round(abs(bbox[2] - bbox[0]) / resx))
+        ny = int(round(abs(bbox[3] - bbox[1]) / resy))
+        return max(nx, 1), max(ny, 1)
+    # Size determined by server
+    return 0, 0
+
+
+def _open_mosaic(fname, tile, bbox, xres, yres, nx, ny, crs):
+    """
+    Create output GeoTIFF for mosaic with data type, bands and nodata of first tile.
+    """
+    profile = {
+        "dtype": tile.dtypes[0],
+        "count": tile.count,
+        "nodata": tile.nodata,
+        "width": nx,
+        "height": ny,
+        "crs": tile.crs if tile.crs is not None else crs,
+        "transform": from_origin(bbox[0], bbox[3], xres, yres),
+    }
+    dst = geotiff.open_raster(fname, **profile)
+    for i, description in enumerate(tile.descriptions, start=1):
+        if description:
+            dst.set_band_description(i, description)
+    return dst
+
+
+def _crop_coverage(src_fname, outfname, bbox, nx, ny, block_rows=1024):
+    """
+    Crop raster to bbox and resample to nx by ny pixels with nearest neighbour (as the WCS servers).
+    The output is written in blocks of rows to limit memory usage.
+    """
+    xres = (bbox[2] - bbox[0]) / nx
+    yres = (bbox[3] - bbox[1]) / ny
+    fname_tmp = f"{outfname}.part"
+    try:
+        with rasterio.open(src_fname) as src:
+            profile = src.profile
+            profile.update(width=nx, height=ny, transform=from_origin(bbox[0], bbox[3], xres, yres))
+            with geotiff.open_raster(fname_tmp, **profile) as dst:
+                for i, description in enumerate(src.descriptions, start=1):
+                    if description:
+                        dst.set_band_description(i, description)
+                for row in range(0, ny, block_rows):
+                    nrows = min(block_rows, ny - row)
+                    # Fractional window of the source raster that covers the block
+                    window = from_bounds(
+                        bbox[0],
+                        bbox[3] - (row + nrows) * yres,
+                        bbox[2],
+                        bbox[3] - row * yres,
+                        transform=src.transform,
+                    )
+                    data = src.read(
+                        window=window, out_shape=(src.count, nrows, nx), resampling=Resampling.nearest
+                    )
+                    dst.write(data, window=Window(0, row, nx, nrows))
+        geotiff.finalize(fname_tmp)
+        os.replace(fname_tmp, outfname)
+    except Exception:
+        if os.path.exists(fname_tmp):
+            os.remove(fname_tmp)
+        raise
+    return outfname
+
+
+def _capabilities_fname(url, version):
+    """
+    Return filename of capabilities document on disk for url and version.
+    """
+    key = hashlib.sha1(f"{url}|{version}".encode("utf-8")).hexdigest()
+    return os.path.join(_config["cache_dir"], key + ".xml")
+
+
+def _read_capabilities(url, version):
+    """
+    Read capabilities document from disk if available and not expired.
+    """
+    if _config["cache_dir"] is None:
+        return None
+    fname = _capabilities_fname(url, version)
+    if not os.path.exists(fname):
+        return None
+    if time.time() - os.path.getmtime(fname) > _config["disk_ttl"]:
+        return None
+    with open(fname, "rb") as f:
+        return f.read()
+
+
+def _write_capabilities(url, version, wcs):
+    """
+    Save capabilities document of client to disk (written to temporary file first,
+    so that concurrent readers never see incomplete documents).
+    """
+    if _config["cache_dir"] is None:
+        return
+    fname = _capabilities_fname(url, version)
+    fname_tmp = f"{fname}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(fname_tmp, "wb") as f:
+        f.write(etree.tostring(wcs._capabilities))
+    os.replace(fname_tmp, fname)
@@ -453,11 +453,15 @@ def gen_panel_dem():
         w_dem: widget for DEM settings
         options_dem: list of DEM options 
     """
-    options_dem = ["DEM", "Slope", "Aspect"]
+    options_dem = ["DEM", "Slope", "Aspect", "Curvature", "Hillshade", "TPI", "Roughness"]
     desc_dem = [
         "Digital Elevation Model (DEM) of Australia derived from STRM with 1 Second Grid - Hydrologically Enforced.",
         "DEM Slope",
         "DEM Aspect Ratio",
+        "DEM Curvature",
+        "DEM Hillshade",
+        "DEM Topographic Position Index",
+        "DEM Roughness",
     ]
     w_dem = []
     box_dem = []
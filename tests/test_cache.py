@@ -0,0 +1,77 @@
+# Tests for cache.py functions
+
+import os
+import time
+from geodata_harvester import cache
+
+
+def test_fetch(tmp_path):
+    """
+    Test that cached files are reused in new output folders without downloading again
+    """
+    cache_dir = str(tmp_path / "cache")
+    cache.configure(cache_dir=cache_dir, max_size_gb=1)
+    ndownloads = []
+
+    def download(fname):
+        ndownloads.append(fname)
+        with open(fname, "wb") as f:
+            f.write(b"x" * 1000)
+
+    params = dict(source="https://example.org/wcs", identifier="1", bbox=[149.0, -30.0, 149.5, -29.5], resx=0.1)
+    try:
+        assert not cache.fetch(f"{tmp_path}/run1/layer.tif", download, **params)
+        # Same request in new output folder and with different file name
+        assert cache.fetch(f"{tmp_path}/run2/other.tif", download, **params)
+        assert len(ndownloads) == 1
+        with open(f"{tmp_path}/run2/other.tif", "rb") as f:
+            assert f.read() == b"x" * 1000
+        # Outputs are copies, modifying them in place does not change the cache
+        with open(f"{tmp_path}/run2/other.tif", "r+b") as f:
+            f.write(b"y")
+        assert cache.fetch(f"{tmp_path}/run3/layer.tif", download, **params)
+        with open(f"{tmp_path}/run3/layer.tif", "rb") as f:
+            assert f.read() == b"x" * 1000
+        # Rounding noise in bbox gives the same key, other resolution not
+        params["bbox"] = [149.0 + 1e-13, -30.0, 149.5, -29.5]
+        assert cache.fetch(f"{tmp_path}/run2/layer.tif", download, **params)
+        params["resx"] = 0.2
+        assert not cache.fetch(f"{tmp_path}/run2/layer2.tif", download, **params)
+        assert len(ndownloads) == 2
+        # No temporary files left in cache
+        assert not [f for f in os.listdir(cache_dir) if f.endswith(".tmp")]
+    finally:
+        cache.configure(cache_dir=False)
+    print("fetch test passed")
+
+
+def test_evict(tmp_path):
+    """
+    Test that least recently used files are removed first
+    """
+    cache_dir = str(tmp_path)
+    # Room for two files of 1000 bytes
+    cache.configure(cache_dir=cache_dir, max_size_gb=2500 / 1024**3)
+
+    def download(fname):
+        with open(fname, "wb") as f:
+            f.write(b"x" * 1000)
+
+    try:
+        paths = []
+        for i in range(2):
+            paths.append(cache.fetch_path(download, ".tif", layer=i)[0])
+            # Make sure that modification times differ
+            os.utime(paths[-1], (time.time() - 100 + i, time.time() - 100 + i))
+        # Use first file again, second file is now least recently used
+        assert cache.fetch_path(download, ".tif", layer=0)[1]
+        paths.append(cache.fetch_path(download, ".tif", layer=2)[0])
+        assert os.path.exists(paths[0])
+        assert not os.path.exists(paths[1])
+        assert not os.path.exists(paths[1][:-4] + ".json")
+        assert os.path.exists(paths[2])
+        cache.clear()
+        assert os.listdir(cache_dir) == []
+    finally:
+        cache.configure(cache_dir=False)
+    print("evict test passed")
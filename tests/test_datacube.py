@@ -0,0 +1,62 @@
+# Tests for datacube.py functions
+
+import os
+import numpy as np
+import pytest
+import rasterio
+import xarray as xr
+from rasterio.transform import from_origin
+from geodata_harvester import datacube
+
+pytest.importorskip("zarr")
+
+
+def test_write_files(tmp_path):
+    """
+    Test that time stacks of single- and multi-band GeoTIFFs are written to groups of one Zarr store
+    """
+    outpath = str(tmp_path)
+    rng = np.random.default_rng(0)
+    profile = dict(driver="GTiff", width=30, height=20, dtype="float32", nodata=-9999, crs="EPSG:4326",
+                   transform=from_origin(149, -29, 0.05, 0.05))
+    datacube.configure(chunks={"time": 2, "y": 16, "x": 16})
+    try:
+        # One file per time step, date after last underscore of file name
+        file_list = []
+        data_list = []
+        for date in ["2019-01-01", "2019-01-21", "2019-02-10"]:
+            data = rng.random((1, 20, 30)).astype("float32")
+            data[0, 0, 0] = -9999
+            fname = os.path.join(outpath, f"daily_rain_mean_{date}.tif")
+            with rasterio.open(fname, "w", count=1, **profile) as dst:
+                dst.write(data)
+            file_list.append(fname)
+            data_list.append(data[0])
+        # One band per time step, date as band description
+        fname = os.path.join(outpath, "max_temp.tif")
+        stack = rng.random((4, 20, 30)).astype("float32")
+        with rasterio.open(fname, "w", count=4, **profile) as dst:
+            dst.write(stack)
+            for band in range(1, 5):
+                dst.update_tags(band, long_name=f"2019-01-0{band}")
+                dst.set_band_description(band, f"2019-01-0{band}")
+        store = datacube.store_path(outpath, "SILO")
+        datacube.write_files(file_list, store, "daily_rain", "daily_rain", attrs=dict(source="SILO", aggregation="mean"))
+        datacube.write_multiband(fname, store, "max_temp", "max_temp", attrs=dict(source="SILO"))
+
+        ds = xr.open_zarr(store, group="daily_rain")
+        assert ds["daily_rain"].dims == ("time", "y", "x")
+        assert ds["daily_rain"].encoding["chunks"] == (2, 16, 16)
+        assert str(ds.time.values[1])[:10] == "2019-01-21"
+        assert ds.attrs["aggregation"] == "mean"
+        assert ds["daily_rain"].rio.crs == "EPSG:4326"
+        values = ds["daily_rain"].values
+        assert np.isnan(values[:, 0, 0]).all()
+        expected = np.stack(data_list)
+        assert np.array_equal(values[:, 1:, 1:], expected[:, 1:, 1:])
+        ds = xr.open_zarr(store, group="max_temp")
+        assert ds["max_temp"].shape == (4, 20, 30)
+        assert np.array_equal(ds["max_temp"].values, stack)
+    finally:
+        datacube.configure(chunks={"time": 64, "y": 256, "x": 256})
+    print("write_files test passed")
@@ -0,0 +1,44 @@
+# Tests for geotiff.py functions
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from geodata_harvester import geotiff
+
+
+def test_open_raster(tmp_path):
+    """
+    Test tiling, compression, predictor, overviews and COG layout of written rasters
+    """
+    fname = str(tmp_path / "test_geotiff.tif")
+    rng = np.random.default_rng(0)
+    data = rng.random((2, 1100, 1300)).astype("float32")
+    profile = dict(dtype="float32", count=2, width=1300, height=1100, nodata=-9999, crs="EPSG:4326",
+                   transform=from_origin(149, -29, 0.001, 0.001), tiled=False, compress="lzw")
+    try:
+        for config, compression, overviews, layout in [
+            (dict(), "DEFLATE", [], None),
+            (dict(compress="zstd", blocksize=256, overviews=True), "ZSTD", [2, 4, 8], None),
+            (dict(cog=True), "ZSTD", [2, 4, 8], "COG"),
+        ]:
+            geotiff.configure(**config)
+            with geotiff.open_raster(fname, **profile) as dst:
+                dst.write(data)
+                dst.set_band_description(1, "2019-01-01")
+            geotiff.finalize(fname)
+            with rasterio.open(fname) as src:
+                structure = src.tags(ns="IMAGE_STRUCTURE")
+                assert structure["COMPRESSION"] == compression
+                assert structure["PREDICTOR"] == "3"
+                assert structure.get("LAYOUT") == layout
+                assert src.block_shapes[0] == (geotiff._config["blocksize"],) * 2
+                assert src.overviews(1) == overviews
+                assert src.descriptions[0] == "2019-01-01"
+                assert src.nodata == -9999
+                assert np.array_equal(src.read(), data)
+        # Integer data uses horizontal differencing
+        geotiff.configure(cog=False, compress="deflate", blocksize=512, overviews=False)
+        assert geotiff.creation_options("int16")["predictor"] == 2
+    finally:
+        geotiff.configure(cog=False, compress="deflate", blocksize=512, overviews=False)
+    print("open_raster test passed")
@@ -110,4 +110,28 @@ def test_get_dea_images_daterange():
     outfnames = getdata_dea.get_dea_images_daterange(layername, date_start, date_end, bbox, resolution, outpath, crs=crs)
     assert len(outfnames) > 0
     shutil.rmtree(outpath, ignore_errors=True)
-    print('get_dea_images_daterange test passed')
\ No newline at end of file
+    print('get_dea_images_daterange test passed')
+
+def test_get_dea_images_daterange_parallel(monkeypatch, tmp_path):
+    """
+    Test that images for all dates are downloaded in parallel and returned in date order
+    """
+    import threading
+    import time
+    dates = ["2019-01-01T00:00:00.000Z", "2019-01-17T00:00:00.000Z", "2019-02-02T00:00:00.000Z"]
+    barrier = threading.Barrier(len(dates), timeout=10)
+
+    def fake_get_wcsmap(outfname, layername, bbox, date, resolution, url, crs="EPSG:4326", format_out="GeoTIFF"):
+        # all downloads must be active at the same time to pass the barrier
+        barrier.wait()
+        # finish in reverse order
+        time.sleep(0.1 * (len(dates) - dates.index(date)))
+        return date != dates[1]
+
+    monkeypatch.setattr(getdata_dea, "get_times_startend", lambda url, layername, dmin, dmax: dates)
+    monkeypatch.setattr(getdata_dea, "get_wcsmap", fake_get_wcsmap)
+    outpath = str(tmp_path)
+    fnames = getdata_dea.get_dea_images_daterange(
+        "ga_ls8c_ard_3", "2019-01-01", "2019-02-28", [149, -30, 149.1, -29.9], 6, outpath, max_workers=3)
+    assert [os.path.basename(f) for f in fnames] == ["ga_ls8c_ard_3_2019-1-1.tif", "ga_ls8c_ard_3_2019-2-2.tif"]
+    print('get_dea_images_daterange_parallel test passed')
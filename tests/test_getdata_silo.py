@@ -1,10 +1,42 @@
 # Tests for getdata_silo.py functions
 
 import os
+import io
+import re
 import shutil
 import pytest
+from http.server import SimpleHTTPRequestHandler
 from geodata_harvester import getdata_silo
 
+
+class _RangeHandler(SimpleHTTPRequestHandler):
+    """HTTP handler with support for single byte ranges"""
+    nbytes = 0
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        rng = self.headers.get("Range")
+        if (not os.path.isfile(path)) or (rng is None):
+            return super().send_head()
+        size = os.path.getsize(path)
+        match = re.match(r"bytes=(\d+)-(\d*)", rng)
+        start = int(match.group(1))
+        end = min(int(match.group(2)) if match.group(2) else size - 1, size - 1)
+        with open(path, "rb") as f:
+            f.seek(start)
+            data = f.read(end - start + 1)
+        _RangeHandler.nbytes += len(data)
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        return io.BytesIO(data)
+
+    def log_message(self, *args):
+        pass
+
+
 def test_get_SILO_raster():
     """
     test script
@@ -42,3 +74,227 @@ def test_get_SILO_layers():
         os.remove(fname)
     shutil.rmtree(outpath, ignore_errors=True)
     print("get_SILO_layers test passed")
+
+
+def test_read_remote_subset(tmp_path):
+    """
+    Test reading subset of netCDF file from local HTTP server with and without range requests
+    """
+    import functools
+    import threading
+    import numpy as np
+    import pandas as pd
+    import xarray
+    from http.server import ThreadingHTTPServer
+
+    outpath = str(tmp_path)
+    # Synthetic SILO-like annual file
+    times = pd.date_range("2019-01-01", periods=20)
+    lat = np.arange(-44, -10, 0.05)
+    lon = np.arange(112, 154, 0.05)
+    data = np.random.rand(len(times), len(lat), len(lon)).astype("float32")
+    ds = xarray.Dataset({"daily_rain": (("time", "lat", "lon"), data)},
+                        coords={"time": times, "lat": lat, "lon": lon})
+    fname = os.path.join(outpath, "2019.daily_rain.nc")
+    ds.to_netcdf(fname, encoding={"daily_rain": {"chunksizes": (1, 100, 100), "zlib": True}})
+    bbox = (149, -30, 149.5, -29.5)
+    expected = getdata_silo.subset_dataset(ds, bbox, "2019-01-05", "2019-01-10")
+
+    for handler, ranges in [(_RangeHandler, True), (SimpleHTTPRequestHandler, False)]:
+        server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(handler, directory=outpath))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}/2019.daily_rain.nc"
+        ds_remote = getdata_silo.read_remote_subset(url, "daily_rain", 2019, bbox, "2019-01-05", "2019-01-10")
+        server.shutdown()
+        server.server_close()
+        if ranges:
+            assert ds_remote is not None
+            assert np.array_equal(ds_remote.daily_rain.values, expected.daily_rain.values)
+            # only a fraction of the file is transferred
+            assert _RangeHandler.nbytes < os.path.getsize(fname) / 4
+        else:
+            # no range requests supported, fall back to download
+            assert ds_remote is None
+    print("read_remote_subset test passed")
+
+
+def test_download_resumable(tmp_path):
+    """
+    Test that interrupted downloads are resumed with range requests
+    """
+    import re
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from geodata_harvester import cache
+
+    body = os.urandom(2**21)
+
+    class FlakyHandler(BaseHTTPRequestHandler):
+        """Drops the connection in the middle of the first response, supports byte ranges"""
+        ranges = []
+
+        def do_GET(self):
+            rng = self.headers.get("Range")
+            FlakyHandler.ranges.append(rng)
+            start = int(re.match(r"bytes=(\d+)-", rng).group(1)) if rng else 0
+            self.send_response(206 if rng else 200)
+            if rng:
+                self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+            self.send_header("Content-Length", str(len(body) - start))
+            self.end_headers()
+            if len(FlakyHandler.ranges) == 1:
+                self.wfile.write(body[:2**20])
+                self.wfile.flush()
+                self.close_connection = True
+                return
+            self.wfile.write(body[start:])
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    outpath = str(tmp_path)
+    getdata_silo.configure(backoff=0.01)
+    try:
+        fname = getdata_silo.download_resumable(
+            f"http://127.0.0.1:{server.server_port}/2019.daily_rain.nc", os.path.join(outpath, "2019.daily_rain.nc"))
+        with open(fname, "rb") as f:
+            assert f.read() == body
+        assert FlakyHandler.ranges == [None, f"bytes={2**20}-"]
+        assert os.listdir(outpath) == ["2019.daily_rain.nc"]
+        # Interrupted download into the download cache is resumed by the next run
+        cache.configure(cache_dir=os.path.join(outpath, "cache"))
+        getdata_silo.configure(retries=0, backoff=0.01)
+        FlakyHandler.ranges = []
+        url = f"http://127.0.0.1:{server.server_port}/2020.daily_rain.nc"
+        with pytest.raises(IOError):
+            getdata_silo.download_file(url, "daily_rain", 2020, os.path.join(outpath, "run1"))
+        fnames_part = [f for f in os.listdir(os.path.join(outpath, "cache")) if f.endswith(".part")]
+        assert len(fnames_part) == 1
+        fname = getdata_silo.download_file(url, "daily_rain", 2020, os.path.join(outpath, "run2"))
+        with open(fname, "rb") as f:
+            assert f.read() == body
+        assert FlakyHandler.ranges == [None, f"bytes={2**20}-"]
+        assert not [f for f in os.listdir(os.path.join(outpath, "cache")) if f.endswith((".part", ".tmp"))]
+    finally:
+        cache.configure(cache_dir=False)
+        getdata_silo.configure(retries=5, backoff=1.0)
+        server.shutdown()
+        server.server_close()
+    print("download_resumable test passed")
+
+
+def test_get_SILO_layers_pipeline(monkeypatch, tmp_path):
+    """
+    Test pipelined download and cropping of multiple years and variables from local HTTP server,
+    with full downloads and with remote subset reads (and download of files without range requests)
+    """
+    import functools
+    import threading
+    import numpy as np
+    import pandas as pd
+    import xarray
+    import rioxarray
+    from http.server import ThreadingHTTPServer
+
+    class PartialRangeHandler(_RangeHandler):
+        """Supports byte ranges for files of 2019 only"""
+        def send_head(self):
+            if "2020" in self.path:
+                return SimpleHTTPRequestHandler.send_head(self)
+            return super().send_head()
+
+    serverpath = str(tmp_path / "server")
+    lat = np.arange(-44, -10, 0.05)
+    lon = np.arange(112, 154, 0.05)
+    bbox = (149, -30, 149.5, -29.5)
+    expected = {}
+    for layername in ["daily_rain", "max_temp"]:
+        os.makedirs(os.path.join(serverpath, layername), exist_ok=True)
+        for year in [2019, 2020]:
+            times = pd.date_range(f"{year}-01-01", periods=5)
+            data = np.random.rand(len(times), len(lat), len(lon)).astype("float32")
+            ds = xarray.Dataset({layername: (("time", "lat", "lon"), data)},
+                                coords={"time": times, "lat": lat, "lon": lon})
+            ds.lat.attrs = {"standard_name": "latitude", "units": "degrees_north", "axis": "Y"}
+            ds.lon.attrs = {"standard_name": "longitude", "units": "degrees_east", "axis": "X"}
+            ds.to_netcdf(os.path.join(serverpath, layername, f"{year}.{layername}.nc"))
+            expected.setdefault(layername, []).append(getdata_silo.subset_dataset(ds, bbox)[layername].values)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(PartialRangeHandler, directory=serverpath))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(getdata_silo, "SILO_BASEURL", f"http://127.0.0.1:{server.server_port}/")
+    try:
+        for remote in [False, True]:
+            outpath = str(tmp_path / f"remote_{remote}")
+            fnames_out = getdata_silo.get_SILO_layers(
+                ["daily_rain", "max_temp"], "2019-01-01", "2020-12-31", outpath, bbox, "tif", remote=remote)
+            assert len(fnames_out) == 2
+            for fname, layername in zip(fnames_out, ["daily_rain", "max_temp"]):
+                assert layername in fname
+                result = rioxarray.open_rasterio(fname).values
+                assert np.allclose(result, np.concatenate(expected[layername]))
+            # remote: only files without range request support are downloaded
+            downloaded = sorted(f for f in os.listdir(os.path.join(outpath, "temp_silo")) if f.endswith(".nc")
+                                and "cropped" not in f)
+            if remote:
+                assert downloaded == ["2020.daily_rain.nc", "2020.max_temp.nc"]
+            else:
+                assert len(downloaded) == 4
+    finally:
+        server.shutdown()
+        server.server_close()
+    print("get_SILO_layers_pipeline test passed")
+
+
+def test_run_pipeline():
+    """
+    Test that items are processed while the next items are still downloaded
+    """
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    processing_started = threading.Event()
+
+    def fetch(item):
+        if item == 1:
+            # Second download only finishes once the first item is processed
+            assert processing_started.wait(timeout=10)
+        return item * 10
+
+    def process(item, fetched):
+        processing_started.set()
+        return fetched + 1
+
+    with ThreadPoolExecutor(2) as download_pool, ThreadPoolExecutor(1) as cpu_pool:
+        assert getdata_silo._run_pipeline([0, 1, 2], fetch, process, download_pool, cpu_pool) == [1, 11, 21]
+    print("run_pipeline test passed")
+
+
+def test_xarray2tif(tmp_path):
+    """
+    Test that time steps are written as bands with dates as band descriptions
+    """
+    import numpy as np
+    import pandas as pd
+    import xarray
+    import rasterio
+    from geodata_harvester import temporal
+
+    times = pd.date_range("2019-01-01", periods=12)
+    data = np.random.rand(12, 20, 30).astype("float32")
+    ds = xarray.Dataset({"daily_rain": (("time", "lat", "lon"), data)},
+                        coords={"time": times, "lat": -30 + np.arange(20) * 0.05, "lon": 149 + np.arange(30) * 0.05})
+    fname = str(tmp_path / "silo_test_xarray2tif.tif")
+    # blocks of 5 bands
+    getdata_silo.xarray2tif(ds, fname, "daily_rain", max_memory_mb=5 * 20 * 30 * 4 / 2**20)
+    with rasterio.open(fname) as src:
+        assert src.count == 12
+        assert src.descriptions[0] == "2019-01-01" and src.descriptions[-1] == "2019-01-12"
+        assert src.tags(3)["long_name"] == "2019-01-03"
+        assert np.array_equal(src.read(), data)
+    # dates are read as time coordinate
+    xdr = temporal.combine_rasters_temporal(fname)
+    assert str(xdr.time.values[-1])[:10] == "2019-01-12"
+    print("xarray2tif test passed")
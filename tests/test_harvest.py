@@ -34,3 +34,69 @@ def test_harvest():
     # Remove output directory
     shutil.rmtree(path_harvest, ignore_errors=True)
     print("Test for test_harvest passed.")
+
+
+def test_run_sources_order(monkeypatch):
+    """
+    Test that sources run concurrently and results are returned in fixed source order
+    """
+    import threading
+    import time
+    from types import SimpleNamespace
+
+    # Barrier only passes if both sources are processed at the same time
+    barrier = threading.Barrier(2, timeout=10)
+
+    def fake_harvester(source, delay):
+        def _harvest(settings, path_to_config, period_days):
+            barrier.wait()
+            time.sleep(delay)
+            return [dict(filenames=[f"{source}.tif"], layernames=[source], datasource=source)]
+        return _harvest
+
+    monkeypatch.setattr(harvest, "harvest_dea", fake_harvester("DEA", 0.2))
+    monkeypatch.setattr(harvest, "harvest_slga", fake_harvester("SLGA", 0.0))
+    settings = SimpleNamespace(target_sources={"SLGA": {}, "DEA": []})
+    results = harvest.run_sources(settings, None, None)
+    assert list(results.keys()) == ["DEA", "SLGA"]
+    assert results["DEA"][0]["filenames"] == ["DEA.tif"]
+    assert results["SLGA"][0]["filenames"] == ["SLGA.tif"]
+    print("Test for test_run_sources_order passed.")
+
+
+def test_run_sources_resume(monkeypatch, tmp_path):
+    """
+    Test that only failed sources are processed again when resuming a run
+    """
+    from types import SimpleNamespace
+    from geodata_harvester.manifest import Manifest
+
+    outpath = str(tmp_path)
+    ncalls = {"DEM": 0, "SLGA": 0}
+    fail = {"SLGA": True}
+
+    def fake_harvester(source):
+        def _harvest(settings, path_to_config, period_days, manifest=None):
+            ncalls[source] += 1
+            if fail.get(source):
+                raise RuntimeError("server timeout")
+            fname = os.path.join(outpath, f"{source}.tif")
+            with open(fname, "w") as f:
+                f.write(source)
+            return [dict(filenames=[fname], layernames=[source], datasource=source)]
+        return _harvest
+
+    monkeypatch.setattr(harvest, "harvest_dem", fake_harvester("DEM"))
+    monkeypatch.setattr(harvest, "harvest_slga", fake_harvester("SLGA"))
+    settings = SimpleNamespace(target_sources={"DEM": ["DEM"], "SLGA": {}}, target_bbox=[149, -30, 149.5, -29.5],
+                               target_res=1, date_min="2019-01-01", date_max="2019-12-31", outpath=outpath)
+    try:
+        harvest.run_sources(settings, None, None, max_workers=1, manifest=Manifest(outpath))
+    except RuntimeError:
+        pass
+    fail["SLGA"] = False
+    results = harvest.run_sources(settings, None, None, max_workers=1, manifest=Manifest(outpath, resume=True))
+    assert ncalls == {"DEM": 1, "SLGA": 2}
+    assert results["DEM"][0]["filenames"] == [os.path.join(outpath, "DEM.tif")]
+    assert results["SLGA"][0]["filenames"] == [os.path.join(outpath, "SLGA.tif")]
+    print("Test for test_run_sources_resume passed.")
@@ -0,0 +1,47 @@
+# Tests for logtable.py functions
+
+import os
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from geodata_harvester import utils
+from geodata_harvester.logtable import LogTable, LOG_COLUMNS
+
+
+def test_update_logtable(tmp_path):
+    """
+    Test that entries from concurrent workers are appended, duplicates are rejected or
+    replaced with force=True, and the table is exported as CSV
+    """
+    outpath = str(tmp_path)
+    settings = Namespace(outpath=outpath, target_sources={"SILO": {"daily_rain": ["mean"]}})
+    log = LogTable(os.path.join(outpath, "df_log.sqlite"))
+
+    def worker(source):
+        for i in range(50):
+            utils.update_logtable(log, [f"{source}_{i}.tif"], [f"layer_{i}"], source, settings,
+                                  agfunctions="mean", loginfos="downloaded")
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(worker, ["DEA", "SILO", "SLGA", "DEM"]))
+    assert len(log) == 200
+    # duplicate file name: no entries of call are added
+    utils.update_logtable(log, ["new.tif", "SILO_3.tif"], ["a", "b"], "SILO", settings, agfunctions="mean")
+    assert len(log) == 200
+    utils.update_logtable(log, ["SILO_3.tif"], ["daily_rain"], "SILO", settings, agfunctions="max", force=True)
+    df = log.to_dataframe()
+    assert len(df) == 200 and list(df.columns) == LOG_COLUMNS
+    row = df[df.filename_out == "SILO_3.tif"].iloc[0]
+    assert (row.layertitle, row.agfunction) == ("daily_rain_max", "max")
+    # entries are exported once, in order of insertion per worker
+    fname = log.to_csv(os.path.join(outpath, "download_summary.csv"))
+    df_csv = pd.read_csv(fname)
+    assert df_csv.equals(df)
+    silo = df_csv[df_csv.dataset == "SILO"].filename_out.tolist()
+    assert silo == [f"SILO_{i}.tif" for i in range(50) if i != 3] + ["SILO_3.tif"]
+    log.close()
+    # new log of next run starts empty
+    log = LogTable(os.path.join(outpath, "df_log.sqlite"))
+    assert len(log) == 0
+    log.close()
+    print("update_logtable test passed")
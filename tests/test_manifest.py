@@ -0,0 +1,62 @@
+# Tests for manifest.py functions
+
+import os
+from geodata_harvester.manifest import Manifest
+
+
+def test_run_stage(tmp_path):
+    """
+    Test that completed stages are skipped when resuming unless inputs or outputs changed
+    """
+    outpath = str(tmp_path)
+    ncalls = []
+
+    def stage(name, value):
+        def _run():
+            ncalls.append(name)
+            fname = os.path.join(outpath, name + ".txt")
+            with open(fname, "w") as f:
+                f.write(value)
+            return [fname]
+        return _run
+
+    manifest = Manifest(outpath)
+    manifest.run_stage("a", stage("a", "1"), inputs={"x": 1}, outputs=lambda files: files)
+    manifest.run_stage("b", stage("b", "1"), inputs={"x": 1}, input_files=[os.path.join(outpath, "a.txt")],
+                       outputs=lambda files: files)
+    assert ncalls == ["a", "b"]
+    assert os.path.exists(os.path.join(outpath, "harvest_manifest.json"))
+    # Without resume, files are recorded without checksum
+    assert all(record["sha1"] is None for record in manifest.data["files"].values())
+
+    # Resume: nothing to do
+    manifest = Manifest(outpath, resume=True)
+    result = manifest.run_stage("a", stage("a", "1"), inputs={"x": 1}, outputs=lambda files: files)
+    assert result == [os.path.join(outpath, "a.txt")]
+    manifest.run_stage("b", stage("b", "1"), inputs={"x": 1}, input_files=[os.path.join(outpath, "a.txt")],
+                       outputs=lambda files: files)
+    assert ncalls == ["a", "b"]
+
+    # Changed input parameters and changed input file
+    manifest = Manifest(outpath, resume=True)
+    manifest.run_stage("a", stage("a", "2"), inputs={"x": 2}, outputs=lambda files: files)
+    manifest.run_stage("b", stage("b", "1"), inputs={"x": 1}, input_files=[os.path.join(outpath, "a.txt")],
+                       outputs=lambda files: files)
+    assert ncalls == ["a", "b", "a", "b"]
+    assert all(record["sha1"] is not None for record in manifest.data["files"].values())
+
+    # Changed or missing output file
+    with open(os.path.join(outpath, "b.txt"), "w") as f:
+        f.write("changed")
+    manifest = Manifest(outpath, resume=True)
+    manifest.run_stage("b", stage("b", "1"), inputs={"x": 1}, input_files=[os.path.join(outpath, "a.txt")],
+                       outputs=lambda files: files)
+    os.remove(os.path.join(outpath, "a.txt"))
+    manifest.run_stage("a", stage("a", "2"), inputs={"x": 2}, outputs=lambda files: files)
+    assert ncalls == ["a", "b", "a", "b", "b", "a"]
+
+    # Without resume, all stages are run again
+    manifest = Manifest(outpath)
+    manifest.run_stage("a", stage("a", "2"), inputs={"x": 2}, outputs=lambda files: files)
+    assert ncalls[-1] == "a" and len(ncalls) == 7
+    print("run_stage test passed")
@@ -0,0 +1,90 @@
+# Tests for spatial.py functions
+
+import os
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from geodata_harvester import spatial
+
+
+def test_raster_buffer_stats(tmp_path):
+    """
+    Test that buffer statistics for many points, read in one or several windows, are the same
+    as for the values of raster_buffer for each point
+    """
+    outpath = str(tmp_path)
+    fname = os.path.join(outpath, "raster.tif")
+    rng = np.random.default_rng(0)
+    data = rng.random((200, 300)).astype("float32")
+    data[50:60, 50:60] = -9999
+    profile = dict(driver="GTiff", width=300, height=200, count=1, dtype="float32", nodata=-9999,
+                   crs="EPSG:4326", transform=from_origin(149.0, -29.0, 0.001, 0.001))
+    with rasterio.open(fname, "w", **profile) as dst:
+        dst.write(data, 1)
+    # points inside raster, near edges and in nodata region
+    longs = np.concatenate([rng.uniform(149.0, 149.3, 50), [149.0005, 149.2995, 149.0555]])
+    lats = np.concatenate([rng.uniform(-29.2, -29.0, 50), [-29.0005, -29.1995, -29.0555]])
+    for max_memory_mb in [256, 0.001]:
+        stats = spatial.raster_buffer_stats(longs, lats, fname, 4, max_memory_mb=max_memory_mb)
+        for k in range(len(longs)):
+            values = spatial.raster_buffer(longs[k], lats[k], fname, 4)
+            values = values[values != -9999]
+            assert stats["count"][k] == len(values)
+            if len(values) == 0:
+                assert np.isnan(stats["mean"][k])
+                continue
+            assert np.isclose(stats["mean"][k], values.mean(dtype="float64"))
+            assert stats["median"][k] == np.median(values.astype("float64"))
+            assert np.isclose(stats["std"][k], values.astype("float64").std())
+            assert stats["min"][k] == values.min() and stats["max"][k] == values.max()
+    # radius in meters: columns are narrower than rows in meters at this latitude
+    stats = spatial.raster_buffer_stats(longs[:1], lats[:1], fname, 500, units="meters")
+    ry, rx = 500 / (0.001 * 3600 * 30.87), 500 / (0.001 * 3600 * 30.922 * np.cos(np.deg2rad(lats[0])))
+    assert rx > ry
+    assert abs(stats["count"][0] - np.pi * rx * ry) < 0.1 * np.pi * rx * ry
+    print("raster_buffer_stats test passed")
+
+
+def test_zonal_stats(tmp_path):
+    """
+    Test zonal statistics of polygons with full and partly covered pixels, for the whole window
+    and for windows of single rows
+    """
+    import geopandas as gpd
+    from shapely.geometry import box, Polygon
+
+    outpath = str(tmp_path)
+    fname = os.path.join(outpath, "raster.tif")
+    rng = np.random.default_rng(0)
+    data = rng.random((100, 100))
+    data[0, 0] = -9999
+    profile = dict(driver="GTiff", width=100, height=100, count=1, dtype="float64", nodata=-9999,
+                   crs="EPSG:4326", transform=from_origin(149.0, -29.0, 0.01, 0.01))
+    with rasterio.open(fname, "w", **profile) as dst:
+        dst.write(data, 1)
+    # zone a: aligned with pixels, b: adjacent to a with half-covered pixels in last column,
+    # c: triangle, d: outside of raster
+    gdf = gpd.GeoDataFrame(
+        {"paddock": ["a", "b", "c", "d"]},
+        geometry=[box(149.0, -29.2, 149.2, -29.0), box(149.2, -29.2, 149.455, -29.0),
+                  Polygon([(149.5, -29.5), (149.7, -29.5), (149.6, -29.3)]), box(150.5, -29.2, 150.6, -29.1)],
+        crs="EPSG:4326",
+    )
+    df = spatial.zonal_stats(gdf, [fname], zone_col="paddock")
+    df_rows = spatial.zonal_stats(gdf, [fname], zone_col="paddock", max_memory_mb=0.001)
+    assert np.allclose(df[spatial.ZONAL_STATS].values, df_rows[spatial.ZONAL_STATS].values, equal_nan=True)
+    df = df.set_index("zone")
+    values = np.where(data == -9999, np.nan, data)
+    zone_a = values[:20, :20]
+    assert df.loc["a", "count"] == 399 and df.loc["a", "layer"] == "raster"
+    assert np.isclose(df.loc["a", "mean"], np.nanmean(zone_a))
+    assert np.isclose(df.loc["a", "std"], np.nanstd(zone_a))
+    assert df.loc["a", "min"] == np.nanmin(zone_a) and df.loc["a", "max"] == np.nanmax(zone_a)
+    assert np.isclose(df.loc["a", "weighted_mean"], df.loc["a", "mean"])
+    # half of last column covered
+    expected = (values[:20, 20:45].sum() + 0.5 * values[:20, 45].sum()) / (20 * 25 + 10)
+    assert np.isclose(df.loc["b", "weighted_mean"], expected)
+    assert np.isclose(df.loc["b", "coverage"], 510)
+    assert np.isclose(df.loc["c", "coverage"], 200)
+    assert df.loc["d", "count"] == 0 and np.isnan(df.loc["d", "mean"])
+    print("zonal_stats test passed")
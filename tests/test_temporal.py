@@ -0,0 +1,112 @@
+# Tests for temporal.py functions
+
+import os
+import warnings
+import numpy as np
+import pandas as pd
+import xarray as xr
+import rioxarray
+from geodata_harvester import temporal
+
+
+def _make_xdr(ntimes=60, freq="1D", dtype="float32"):
+    """
+    Create xarray with random values and missing data for testing
+    """
+    rng = np.random.default_rng(0)
+    data = (rng.random((ntimes, 20, 30)) * 100).astype(dtype)
+    data[rng.random(data.shape) < 0.3] = np.nan
+    # pixel without any valid data
+    data[:, 0, 0] = np.nan
+    xdr = xr.DataArray(
+        data,
+        dims=("time", "y", "x"),
+        coords={
+            "time": pd.date_range("2019-01-01", periods=ntimes, freq=freq),
+            "y": -29 - np.arange(20) * 0.01,
+            "x": 149 + np.arange(30) * 0.01,
+        },
+    )
+    return xdr.rio.write_crs(4326)
+
+
+def test_aggregate_stats():
+    """
+    Test single-pass statistics against numpy nan-functions
+    """
+    data = _make_xdr().values
+    aggs = ["mean", "median", "sum", "perc95", "perc5", "max", "min"]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        expected = {
+            "mean": np.nanmean(data, axis=0),
+            "median": np.nanmedian(data, axis=0),
+            "sum": np.nansum(data, axis=0),
+            "perc95": np.nanquantile(data, 0.95, axis=0),
+            "perc5": np.nanquantile(data, 0.05, axis=0),
+            "max": np.nanmax(data, axis=0),
+            "min": np.nanmin(data, axis=0),
+        }
+    result = temporal.aggregate_stats(data, aggs, axis=0)
+    for a in aggs:
+        assert result[a].dtype == data.dtype
+        assert np.allclose(result[a], expected[a], rtol=1e-6, equal_nan=True), a
+    print("aggregate_stats test passed")
+
+
+def test_aggregate_temporal(tmp_path):
+    """
+    Test aggregation over time periods against xarray groupby
+    """
+    xdr = _make_xdr(ntimes=30, freq="5D")
+    outpath = str(tmp_path)
+    outfname_list, agg_list = temporal.aggregate_temporal(
+        xdr, period=20, agg=["mean", "perc95"], outfile=os.path.join(outpath, "test"), fill_nan=False)
+    ndays = int((xdr.time.values[-1] - xdr.time.values[0]) / np.timedelta64(1, "D"))
+    groups = xdr.groupby_bins("time", ndays // 20)
+    expected = {"mean": groups.mean(), "perc95": groups.quantile(q=0.95)}
+    assert agg_list == ["mean"] * len(expected["mean"]) + ["perc95"] * len(expected["mean"])
+    for fname, a in zip(outfname_list, agg_list):
+        label = os.path.basename(fname).split("_")[-1][:-4]
+        values = [p for p in expected[a] if str(p["time_bins"].values)[1:11] == label][0]
+        result = rioxarray.open_rasterio(fname).values[0]
+        # outputs keep the float32 precision of the input
+        assert result.dtype == np.float32
+        assert np.allclose(result, values.values, rtol=1e-6, equal_nan=True)
+    print("aggregate_temporal test passed")
+
+
+def test_multiband_raster_to_xarray_lazy(tmp_path):
+    """
+    Test lazy raster stack and masking of missing values during aggregation
+    """
+    import rasterio
+    from rasterio.transform import from_origin
+    outpath = str(tmp_path)
+    rng = np.random.default_rng(2)
+    file_list = []
+    data_list = []
+    for date in ["2019-01-01", "2019-01-17", "2019-02-02"]:
+        data = rng.integers(-1200, 3000, (2, 20, 30)).astype("int16")
+        data[data < -1000] = -999
+        fname = os.path.join(outpath, f"layer_{date}.tif")
+        with rasterio.open(fname, "w", driver="GTiff", width=30, height=20, count=2, dtype="int16", nodata=-999,
+                           crs="EPSG:4326", transform=from_origin(149, -29, 0.01, 0.01)) as dst:
+            dst.write(data)
+        file_list.append(fname)
+        data_list.append(data)
+    xdr = temporal.multiband_raster_to_xarray(file_list)
+    if temporal._chunks is not None:
+        # data is not loaded into memory
+        assert not isinstance(xdr.data, np.ndarray)
+    outfname_list, agg_list = temporal.aggregate_temporal(
+        xdr, period=100, agg=["median"], outfile=os.path.join(outpath, "test"), nodata_max=-999.)
+    stack = np.stack(data_list).astype(float)
+    stack[stack <= -999] = np.nan
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        expected = np.nanmedian(stack, axis=0)
+    assert len(outfname_list) == 1
+    result = rioxarray.open_rasterio(outfname_list[0]).values
+    assert np.allclose(result, expected, equal_nan=True)
+    print("multiband_raster_to_xarray_lazy test passed")
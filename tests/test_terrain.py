@@ -0,0 +1,99 @@
+# Tests for terrain.py functions
+
+import os
+import numpy as np
+import rasterio
+import rioxarray
+from rasterio.transform import from_origin
+from geodata_harvester import terrain, arc2meter
+
+
+def _slope_aspect_xarray(fname_dem, type="slope"):
+    """
+    Slope or aspect of the whole DEM with xarray (previous implementation of
+    getdata_dem.calculate_slope_aspect)
+    """
+    dem = rioxarray.open_rasterio(fname_dem, masked=True)
+    deg2meter_x = arc2meter.calc_arc2meter(3600, dem.y)[0]
+    deg2meter_y = arc2meter.calc_arc2meter(3600, dem.y)[1]
+    gradient_x = dem.differentiate("x") / deg2meter_x
+    gradient_y = dem.differentiate("y") / deg2meter_y
+    if type == "slope":
+        result = np.arctan(np.sqrt(gradient_x**2 + gradient_y**2)) * 180 / np.pi
+    else:
+        result = np.arctan2(gradient_x, gradient_y) * 180 / np.pi + 180
+    return result.where(dem != 0, 0).values
+
+
+def test_calculate_windowed(tmp_path):
+    """
+    Test that slope and aspect computed in windows with halo are identical to the computation
+    for the whole DEM, for float32 and int16 DEMs with nodata and zero values
+    """
+    outpath = str(tmp_path)
+    rng = np.random.default_rng(0)
+    height, width = 203, 150
+    yy, xx = np.mgrid[0:height, 0:width]
+    elevation = 200 + 50 * np.sin(xx / 17) * np.cos(yy / 23) + rng.normal(0, 2, (height, width))
+    elevation[:20, :30] = 0
+    elevation[100:104, 60:70] = -9999
+    for dtype in ["float32", "int16"]:
+        fname_dem = os.path.join(outpath, f"dem_{dtype}.tif")
+        profile = dict(driver="GTiff", width=width, height=height, count=1, dtype=dtype, nodata=-9999,
+                       crs="EPSG:4326", transform=from_origin(149.0, -29.0, 1 / 3600, 1 / 3600))
+        with rasterio.open(fname_dem, "w", **profile) as dst:
+            dst.write(elevation.astype(dtype), 1)
+        for layer in ["slope", "aspect"]:
+            expected = _slope_aspect_xarray(fname_dem, layer)
+            # whole raster in one window, and windows of a few rows computed concurrently
+            for workers, max_memory_mb in [(1, None), (3, 0.05)]:
+                fname_out = os.path.join(outpath, f"{layer}_{dtype}_{workers}.tif")
+                terrain.calculate(fname_dem, fname_out, layer=layer, workers=workers, max_memory_mb=max_memory_mb)
+                with rasterio.open(fname_out) as src:
+                    assert src.dtypes[0] == "float64"
+                    result = src.read()
+                assert np.array_equal(result, expected, equal_nan=True)
+            fname_out = os.path.join(outpath, f"{layer}_{dtype}_float32.tif")
+            terrain.calculate(fname_dem, fname_out, layer=layer, dtype="float32", max_memory_mb=0.05)
+            with rasterio.open(fname_out) as src:
+                assert np.array_equal(src.read(), expected.astype("float32"), equal_nan=True)
+    print("calculate_windowed test passed")
+
+
+def test_derivatives(tmp_path):
+    """
+    Test that all terrain layers computed in one pass in windows are identical to the layers
+    computed one by one for the whole DEM, and check neighbourhood layers against a full-array computation
+    """
+    outpath = str(tmp_path)
+    rng = np.random.default_rng(1)
+    elevation = (300 + rng.normal(0, 5, (120, 90))).astype("float32")
+    elevation[:10, :10] = 0
+    fname_dem = os.path.join(outpath, "dem.tif")
+    profile = dict(driver="GTiff", width=90, height=120, count=1, dtype="float32", nodata=-9999,
+                   crs="EPSG:4326", transform=from_origin(149.0, -29.0, 1 / 3600, 1 / 3600))
+    with rasterio.open(fname_dem, "w", **profile) as dst:
+        dst.write(elevation, 1)
+    outputs = {layer: os.path.join(outpath, f"{layer}.tif") for layer in terrain.LAYERS}
+    terrain.derivatives(fname_dem, outputs, workers=2, max_memory_mb=0.05)
+    results = {}
+    for layer, fname_out in outputs.items():
+        with rasterio.open(fname_out) as src:
+            results[layer] = src.read(1)
+        terrain.calculate(fname_dem, os.path.join(outpath, "single.tif"), layer=layer)
+        with rasterio.open(os.path.join(outpath, "single.tif")) as src:
+            assert np.array_equal(src.read(1), results[layer], equal_nan=True)
+    # TPI and roughness of 3 x 3 neighbourhood, nan at raster edges
+    z = elevation.astype("float64")
+    windows = np.lib.stride_tricks.sliding_window_view(z, (3, 3))
+    tpi = z[1:-1, 1:-1] - (windows.sum(axis=(2, 3)) - z[1:-1, 1:-1]) / 8
+    roughness = windows.max(axis=(2, 3)) - windows.min(axis=(2, 3))
+    inner = (slice(1, -1), slice(1, -1))
+    mask = z[inner] != 0
+    assert np.allclose(results["tpi"][inner][mask], tpi[mask])
+    assert np.array_equal(results["roughness"][inner][mask], roughness[mask])
+    assert np.isnan(results["tpi"][-1, 20]) and np.isnan(results["curvature"][20, 0])
+    # all layers are 0 where DEM is 0, hillshade within 0-255
+    assert (results["hillshade"][:10, :10] == 0).all()
+    assert np.nanmin(results["hillshade"]) >= 0 and np.nanmax(results["hillshade"]) <= 255
+    print("derivatives test passed")
@@ -0,0 +1,129 @@
+# Tests for utils.py functions
+
+import os
+import numpy as np
+import rasterio
+import rioxarray as rxr
+from rasterio.transform import from_origin
+from geodata_harvester import utils
+
+
+def _write_test_raster(fname, transform, width=120, height=90, count=2, dtype="float32"):
+    """
+    Write raster with random values for testing
+    """
+    rng = np.random.default_rng(42)
+    data = rng.random((count, height, width)).astype(dtype)
+    profile = dict(driver="GTiff", width=width, height=height, count=count, dtype=dtype,
+                   crs="EPSG:4326", transform=transform)
+    with rasterio.open(fname, "w", **profile) as dst:
+        dst.write(data)
+    return data
+
+
+def test_extract_values_from_rasters(tmp_path):
+    """
+    Test that vectorized extraction returns the same values as selecting points one by one
+    """
+    outpath = str(tmp_path)
+    fnames = [os.path.join(outpath, "north_up.tif"), os.path.join(outpath, "south_up.tif")]
+    _write_test_raster(fnames[0], from_origin(149.0, -29.0, 0.01, 0.01))
+    # raster with increasing y coordinates
+    _write_test_raster(fnames[1], rasterio.Affine(0.01, 0, 149.0, 0, 0.01, -29.9))
+    rng = np.random.default_rng(0)
+    # points inside and outside of rasters
+    coords = np.column_stack([rng.uniform(148.9, 150.3, 500), rng.uniform(-30.0, -28.9, 500)])
+    gdf = utils.extract_values_from_rasters(coords, fnames)
+    assert len(gdf) == len(coords)
+    for fname in fnames:
+        ds = rxr.open_rasterio(fname)
+        expected = np.array([ds.sel(x=x, y=y, method="nearest").values for x, y in coords])
+        raster_name = os.path.basename(fname).split(".")[0]
+        for i, band in enumerate(ds.band.values):
+            assert np.array_equal(gdf[f"{raster_name}_{band}"].values, expected[:, i])
+        ds.close()
+    print("extract_values_from_rasters test passed")
+
+
+def test_read_pixels_windowed(tmp_path):
+    """
+    Test that block-wise sampling with small memory budget returns the same values as a full read
+    """
+    outpath = str(tmp_path)
+    fname = os.path.join(outpath, "tiled.tif")
+    profile = dict(driver="GTiff", width=1500, height=1100, count=2, dtype="int16", crs="EPSG:4326",
+                   transform=from_origin(149.0, -29.0, 0.001, 0.001), tiled=True, blockxsize=256, blockysize=256)
+    rng = np.random.default_rng(1)
+    data = rng.integers(-1000, 1000, (2, 1100, 1500), dtype="int16")
+    with rasterio.open(fname, "w", **profile) as dst:
+        dst.write(data)
+    rows = rng.integers(0, 1100, 2000)
+    cols = rng.integers(0, 1500, 2000)
+    with rasterio.open(fname) as src:
+        values = utils._read_pixels(src, rows, cols, max_memory_mb=0.1)
+    assert np.array_equal(values, data[:, rows, cols].T)
+    # sparse sampling via extract_values_from_rasters with small memory budget
+    coords = np.column_stack([149.0 + (cols + 0.5) * 0.001, -29.0 - (rows + 0.5) * 0.001])
+    gdf = utils.extract_values_from_rasters(coords, [fname], max_memory_mb=0.1)
+    assert np.array_equal(gdf[["tiled_1", "tiled_2"]].values, data[:, rows, cols].T)
+    print("read_pixels_windowed test passed")
+
+
+def test_align_rasters(tmp_path):
+    """
+    Test that rasters with different resolution and alignment are warped onto the common target grid
+    """
+    outpath = str(tmp_path)
+    # coarse raster (0.05 deg) with offset origin and raster that is already on target grid (0.01 deg)
+    fnames = [os.path.join(outpath, "coarse.tif"), os.path.join(outpath, "fine.tif")]
+    coarse = _write_test_raster(fnames[0], from_origin(148.973, -28.973, 0.05, 0.05), width=30, height=25)
+    fine = _write_test_raster(fnames[1], from_origin(149.0, -29.0, 0.01, 0.01))
+    grid = utils.target_grid((149.0, -29.9, 150.2, -29.0), 0.01)
+    assert (grid["width"], grid["height"]) == (120, 90)
+    aligned = utils.align_rasters(fnames, os.path.join(outpath, "aligned"), grid, num_threads=2)
+    assert aligned[0] == os.path.join(outpath, "aligned", "coarse.tif")
+    # raster on target grid is not copied
+    assert aligned[1] == fnames[1]
+    with rasterio.open(aligned[0]) as src:
+        assert src.transform.almost_equals(grid["transform"])
+        assert (src.width, src.height) == (120, 90)
+        data = src.read()
+    # nearest neighbour: pixel centres of target grid fall into coarse pixels
+    rows = ((np.arange(90) + 0.5) * 0.01 + 0.027) // 0.05
+    cols = ((np.arange(120) + 0.5) * 0.01 + 0.027) // 0.05
+    assert np.array_equal(data, coarse[:, rows.astype(int)[:, None], cols.astype(int)[None, :]])
+    # extraction from aligned rasters
+    coords = np.array([[149.005, -29.005], [150.195, -29.895]])
+    gdf = utils.extract_values_from_rasters(coords, aligned)
+    assert np.array_equal(gdf[["fine_1", "fine_2"]].values, fine[:, [0, 89], [0, 119]].T)
+    # rasters with the same file name in different folders keep their relative paths
+    fnames = [os.path.join(outpath, source, "layer.tif") for source in ["dea", "silo"]]
+    for fname in fnames:
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        _write_test_raster(fname, from_origin(148.973, -28.973, 0.05, 0.05), width=30, height=25)
+    aligned = utils.align_rasters(fnames, os.path.join(outpath, "aligned"), grid, root=outpath)
+    assert aligned == [os.path.join(outpath, "aligned", source, "layer.tif") for source in ["dea", "silo"]]
+    print("align_rasters test passed")
+
+
+def test_reproj_raster_windowed(tmp_path):
+    """
+    Test that warping all bands in windows gives the same result as warping each band in one piece
+    """
+    outpath = str(tmp_path)
+    infile = os.path.join(outpath, "input.tif")
+    data = _write_test_raster(infile, from_origin(149.0, -29.0, 0.01, 0.01), count=3)
+    bbox = (149.0, -29.9, 150.2, -29.0)
+    for resampling in ["nearest", "bilinear", "average"]:
+        # one window for all rows, and windows of a few rows (small memory budget)
+        utils.reproj_raster(infile, os.path.join(outpath, "full.tif"), bbox, 0.025, resampling=resampling)
+        utils.reproj_raster(infile, os.path.join(outpath, "windowed.tif"), bbox, 0.025, resampling=resampling,
+                            num_threads=2, max_memory_mb=0.001)
+        with rasterio.open(os.path.join(outpath, "full.tif")) as a:
+            with rasterio.open(os.path.join(outpath, "windowed.tif")) as b:
+                assert a.count == 3 and a.shape == b.shape
+                assert np.array_equal(a.read(), b.read())
+                full = a.read()
+    # average of 2.5 x 2.5 input pixels stays within range of input values
+    assert full.min() >= data.min() and full.max() <= data.max()
+    print("reproj_raster_windowed test passed")
@@ -0,0 +1,267 @@
+# Tests for wcsclient.py functions
+
+import os
+import pytest
+from geodata_harvester import wcsclient
+
+
+class FakeWCS:
+    """
+    Minimal stand-in for owslib WebCoverageService that counts capabilities requests
+    """
+    ncreated = 0
+    nrequests = 0
+
+    def __init__(self, url, version=None, xml=None, timeout=30):
+        from owslib.etree import etree
+        FakeWCS.ncreated += 1
+        if xml is None:
+            FakeWCS.nrequests += 1
+            xml = b"<WCS_Capabilities version='1.0.0'><Service>test</Service></WCS_Capabilities>"
+        self.url = url
+        self._capabilities = etree.fromstring(xml)
+
+
+def test_get_wcs(monkeypatch):
+    """
+    Test that clients are created once per url and version and renewed after TTL
+    """
+    monkeypatch.setattr(wcsclient, "WebCoverageService", FakeWCS)
+    wcsclient.clear()
+    FakeWCS.ncreated = FakeWCS.nrequests = 0
+    url = "https://example.org/wcs"
+    wcs = wcsclient.get_wcs(url, version="1.0.0")
+    for _ in range(200):
+        assert wcsclient.get_wcs(url, version="1.0.0") is wcs
+    assert FakeWCS.nrequests == 1
+    # New client for different url
+    wcsclient.get_wcs(url + "2", version="1.0.0")
+    assert FakeWCS.nrequests == 2
+    # Expired TTL
+    monkeypatch.setitem(wcsclient._config, "ttl", -1)
+    assert wcsclient.get_wcs(url, version="1.0.0") is not wcs
+    assert FakeWCS.nrequests == 3
+    wcsclient.clear()
+    print("get_wcs test passed")
+
+
+def test_get_wcs_disk(monkeypatch, tmp_path):
+    """
+    Test that capabilities are stored on disk and reused between runs
+    """
+    monkeypatch.setattr(wcsclient, "WebCoverageService", FakeWCS)
+    monkeypatch.setitem(wcsclient._config, "cache_dir", None)
+    cache_dir = str(tmp_path)
+    wcsclient.configure(cache_dir=cache_dir)
+    wcsclient.clear(disk=True)
+    FakeWCS.ncreated = FakeWCS.nrequests = 0
+    url = "https://example.org/wcs"
+    wcsclient.get_wcs(url, version="1.0.0")
+    assert len(os.listdir(cache_dir)) == 1
+    # Clear memory only, new client is created from capabilities on disk
+    wcsclient.clear()
+    wcsclient.get_wcs(url, version="1.0.0")
+    assert FakeWCS.ncreated == 2
+    assert FakeWCS.nrequests == 1
+    wcsclient.clear(disk=True)
+    wcsclient.configure(cache_dir=False)
+    print("get_wcs_disk test passed")
+
+
+def test_get_title(monkeypatch, tmp_path):
+    """
+    Test that layer titles are kept in the download cache and need no capabilities request
+    """
+    from types import SimpleNamespace
+    from geodata_harvester import cache
+
+    class FakeTitleWCS(FakeWCS):
+        def __getitem__(self, identifier):
+            return SimpleNamespace(title=f"Layer {identifier}")
+
+    monkeypatch.setattr(wcsclient, "WebCoverageService", FakeTitleWCS)
+    wcsclient.clear()
+    FakeWCS.nrequests = 0
+    url = "https://example.org/wcs"
+    cache.configure(cache_dir=str(tmp_path / "cache"))
+    try:
+        assert wcsclient.get_title(url, "1") == "Layer 1"
+        wcsclient.clear()
+        assert wcsclient.get_title(url, "1") == "Layer 1"
+        assert FakeWCS.nrequests == 1
+    finally:
+        cache.configure(cache_dir=False)
+        wcsclient.clear()
+    print("get_title test passed")
+
+
+class FakeCoverageWCS(FakeWCS):
+    """
+    Fake WCS server returning GeoTIFFs of a synthetic field for any bounding box
+    """
+    nrequests_coverage = 0
+    timeouts = set()
+
+    def getCoverage(self, identifier=None, bbox=None, format=None, crs=None, width=None, height=None, resx=None, resy=None, **kwargs):
+        import io
+        import numpy as np
+        import rasterio
+        from rasterio.transform import from_bounds
+        FakeCoverageWCS.nrequests_coverage += 1
+        FakeCoverageWCS.timeouts.add(kwargs.get("timeout"))
+        if resx is not None:
+            width = int(round((bbox[2] - bbox[0]) / resx))
+            height = int(round((bbox[3] - bbox[1]) / resy))
+        elif width is None:
+            # size determined by server
+            width, height = 50, 40
+        transform = from_bounds(*bbox, width, height)
+        # value of each pixel is given by coordinates of pixel center
+        cols, rows = np.meshgrid(np.arange(width), np.arange(height))
+        xs, ys = rasterio.transform.xy(transform, rows.ravel(), cols.ravel())
+        data = (np.asarray(xs) + 100 * np.asarray(ys)).reshape(height, width)
+        profile = dict(driver="GTiff", width=width, height=height, count=1, dtype="float64", crs=crs, transform=transform)
+        with rasterio.io.MemoryFile() as memfile:
+            with memfile.open(**profile) as dst:
+                dst.write(data, 1)
+            return io.BytesIO(memfile.read())
+
+
+def test_download_coverage_tiled(monkeypatch, tmp_path):
+    """
+    Test that tiled downloads are mosaicked into the same image as a single request
+    """
+    import numpy as np
+    import rasterio
+    monkeypatch.setattr(wcsclient, "WebCoverageService", FakeCoverageWCS)
+    wcsclient.clear()
+    url = "https://example.org/wcs"
+    bbox = [149.0, -30.0, 149.5, -29.6]
+    outpath = str(tmp_path)
+    fname_single = os.path.join(outpath, "single.tif")
+    fname_tiled = os.path.join(outpath, "tiled.tif")
+    wcsclient.download_coverage(fname_single, url, "layer", bbox, resx=0.005, resy=0.005)
+    FakeCoverageWCS.nrequests_coverage = 0
+    monkeypatch.setitem(wcsclient._config, "tile_size", 32)
+    # tiles are copied into the mosaic in blocks of 16 rows
+    monkeypatch.setattr(wcsclient.geotiff, "blocksize", lambda: 16)
+    FakeCoverageWCS.timeouts = set()
+    wcsclient.download_coverage(fname_tiled, url, "layer", bbox, resx=0.005, resy=0.005, timeout=60)
+    # 100 x 80 pixels in tiles of 32 x 32 pixels, streamed to temporary tile files that are removed
+    assert FakeCoverageWCS.nrequests_coverage == 4 * 3
+    assert FakeCoverageWCS.timeouts == {60}
+    assert sorted(os.listdir(outpath)) == ["single.tif", "tiled.tif"]
+    with rasterio.open(fname_single) as src1, rasterio.open(fname_tiled) as src2:
+        assert src1.shape == src2.shape == (80, 100)
+        assert np.allclose(src1.transform, src2.transform)
+        assert np.allclose(src1.read(1), src2.read(1), rtol=0, atol=1e-6)
+    wcsclient.clear()
+    print("download_coverage_tiled test passed")
+
+
+def test_download_coverage_superset(monkeypatch, tmp_path):
+    """
+    Test that subsets of cached rasters are cropped locally instead of requested from the server
+    """
+    import numpy as np
+    import rasterio
+    from geodata_harvester import cache
+    monkeypatch.setattr(wcsclient, "WebCoverageService", FakeCoverageWCS)
+    wcsclient.clear()
+    url = "https://example.org/wcs"
+    outpath = str(tmp_path)
+    cache.configure(cache_dir=os.path.join(outpath, "cache"))
+    try:
+        wcsclient.download_coverage(
+            os.path.join(outpath, "region.tif"), url, "layer", [149.0, -30.0, 149.5, -29.6], resx=0.005, resy=0.005)
+        FakeCoverageWCS.nrequests_coverage = 0
+        # Subset at same and coarser resolution
+        bbox = [149.1, -29.9, 149.3, -29.7]
+        fname_crop = os.path.join(outpath, "crop.tif")
+        wcsclient.download_coverage(fname_crop, url, "layer", bbox, resx=0.005, resy=0.005)
+        wcsclient.download_coverage(os.path.join(outpath, "coarse.tif"), url, "layer", bbox, resx=0.02, resy=0.02)
+        assert FakeCoverageWCS.nrequests_coverage == 0
+        # Finer resolution, other layer and region outside of cached raster are requested from server
+        wcsclient.download_coverage(os.path.join(outpath, "fine.tif"), url, "layer", bbox, resx=0.001, resy=0.001)
+        wcsclient.download_coverage(os.path.join(outpath, "other.tif"), url, "layer2", bbox, resx=0.005, resy=0.005)
+        wcsclient.download_coverage(
+            os.path.join(outpath, "outside.tif"), url, "layer", [149.4, -29.9, 149.6, -29.7], resx=0.005, resy=0.005)
+        assert FakeCoverageWCS.nrequests_coverage == 3
+        cache.configure(cache_dir=False)
+        fname_server = os.path.join(outpath, "server.tif")
+        wcsclient.download_coverage(fname_server, url, "layer", bbox, resx=0.005, resy=0.005)
+        with rasterio.open(fname_crop) as src1, rasterio.open(fname_server) as src2:
+            assert src1.shape == src2.shape == (40, 40)
+            assert np.allclose(src1.transform, src2.transform)
+            assert np.allclose(src1.read(1), src2.read(1), rtol=0, atol=1e-6)
+        with rasterio.open(os.path.join(outpath, "coarse.tif")) as src:
+            assert src.shape == (10, 10)
+        # Requests without size or resolution are cached but not cropped from cached rasters
+        cache.configure(cache_dir=os.path.join(outpath, "cache"))
+        FakeCoverageWCS.nrequests_coverage = 0
+        for i in range(2):
+            fname_server = os.path.join(outpath, f"server_size_{i}.tif")
+            wcsclient.download_coverage(fname_server, url, "layer", bbox)
+            with rasterio.open(fname_server) as src:
+                assert src.shape == (40, 50)
+        assert FakeCoverageWCS.nrequests_coverage == 1
+    finally:
+        cache.configure(cache_dir=False)
+        wcsclient.clear()
+    print("download_coverage_superset test passed")
+
+
+def test_stream_coverage(tmp_path):
+    """
+    Test that coverages are streamed to file and that incomplete responses leave no file behind
+    """
+    import threading
+    from urllib.parse import urlparse, parse_qs
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from owslib.coverage.wcs100 import WebCoverageService_1_0_0
+
+    body = os.urandom(3 * 2**20)
+
+    class CoverageHandler(BaseHTTPRequestHandler):
+        """Returns body for any GetCoverage request, truncated if requested"""
+        queries = []
+
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            CoverageHandler.queries.append(query)
+            self.send_response(200)
+            self.send_header("Content-Type", "image/tiff")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[:1000] if query["Coverage"] == ["truncated"] else body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CoverageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/wcs"
+    xml = f"""<WCS_Capabilities xmlns="http://www.opengis.net/wcs" xmlns:xlink="http://www.w3.org/1999/xlink" version="1.0.0">
+    <Service><name>test</name><label>test</label><fees>NONE</fees><accessConstraints>NONE</accessConstraints></Service>
+    <Capability><Request><GetCoverage><DCPType><HTTP><Get><OnlineResource xlink:href="{url}?"/></Get></HTTP></DCPType>
+    </GetCoverage></Request></Capability><ContentMetadata/></WCS_Capabilities>"""
+    wcs = WebCoverageService_1_0_0(url, xml.encode(), None)
+    outpath = str(tmp_path)
+    try:
+        fname = os.path.join(outpath, "layer.tif")
+        wcsclient._stream_coverage(wcs, fname, identifier="layer", bbox=[149.0, -30.0, 149.5, -29.5],
+                                   format="GeoTIFF", crs="EPSG:4326", resx=0.01, resy=0.01, time=["2019-01-01"])
+        with open(fname, "rb") as f:
+            assert f.read() == body
+        query = CoverageHandler.queries[-1]
+        assert query["Coverage"] == ["layer"] and query["BBox"] == ["149.0,-30.0,149.5,-29.5"]
+        assert query["time"] == ["2019-01-01"] and query["resx"] == ["0.01"]
+        fname = os.path.join(outpath, "truncated.tif")
+        with pytest.raises(Exception):
+            wcsclient._stream_coverage(wcs, fname, identifier="truncated", bbox=[149.0, -30.0, 149.5, -29.5],
+                                       format="GeoTIFF", crs="EPSG:4326", resx=0.01, resy=0.01)
+        assert os.listdir(outpath) == ["layer.tif"]
+    finally:
+        server.shutdown()
+        server.server_close()
+    print("stream_coverage test passed")